@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import time
+import tracemalloc
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.schema import apply_schema
+from src.features.build_features import (ABT_COLUMNS, add_rates, assemble_abt, fill_missing, get_region,
+                                         get_registered_time)
+
+
+def legacy_assemble_abt(datasets, max_time):
+    """ The chained-merge assembly replaced by `assemble_abt`, kept as the
+        reference: one left merge per feature block and three payment
+        groupbys.
+    """
+    student = datasets['students'].copy()
+    fileViews_agg = datasets['fileViews_agg']
+    payments_agg = datasets['payments_agg']
+    usage_device = datasets['usage_device']
+
+    fileViews_agg = fileViews_agg.assign(StudentId=pd.to_numeric(fileViews_agg.StudentId, errors='coerce'))
+    fileViews_agg = fileViews_agg.dropna(subset=['StudentId'])
+    fileViews_agg['StudentId'] = fileViews_agg.StudentId.astype(int)
+
+    student['registered_time'] = get_registered_time(student, max_time)
+    df = pd.merge(student, datasets['usage_weekly'], left_on='Id', right_on='StudentId', how='left')
+    for block in [datasets['sessions_agg'][['StudentId', 'session_count']], fileViews_agg,
+                  datasets['questions_agg']]:
+        df = pd.merge(df, block, on='StudentId', how='left')
+    df['region'] = get_region(df)
+
+    usage_device = usage_device.assign(StudentId=pd.to_numeric(usage_device.StudentId, errors='coerce'))
+    df['mobile'] = 0
+    df['desktop'] = 0
+    df.loc[df.StudentId.isin(usage_device.StudentId[usage_device.mobile == 1]), 'mobile'] = 1
+    df.loc[df.StudentId.isin(usage_device.StudentId[usage_device.desktop == 1]), 'desktop'] = 1
+
+    total = payments_agg.groupby(['StudentId']).payment_count.sum().reset_index()
+    monthly = payments_agg.loc[payments_agg.PlanType == 'Mensal'].groupby(
+        ['StudentId']).payment_count.sum().reset_index()
+    yearly = payments_agg.loc[payments_agg.PlanType == 'Anual'].groupby(
+        ['StudentId']).payment_count.sum().reset_index()
+    total.columns = ['StudentId', 'payment_total']
+    monthly.columns = ['StudentId', 'payment_monthly']
+    yearly.columns = ['StudentId', 'payment_yearly']
+    for block in [total, monthly, yearly, datasets['cancellations_agg'], datasets['subjects_agg']]:
+        df = pd.merge(df, block, on='StudentId', how='left')
+
+    return fill_missing(add_rates(df))[ABT_COLUMNS].copy()
+
+
+def make_abt_inputs(n_students, seed=0):
+    """ Processed ABT inputs for `n_students`, typed by their schemas, with
+        students missing from some aggregates, students without a state and
+        a few malformed ids.
+    """
+    rng = np.random.default_rng(seed)
+    ids = rng.permutation(n_students * 10)[:n_students] + 1
+    registered = pd.Timestamp('2016-01-01') + pd.to_timedelta(rng.integers(0, 700, n_students), unit='D')
+    states = np.array(['São Paulo', 'Bahia', 'Paraná', 'Goias', 'Amazonas', None], dtype=object)
+    students = pd.DataFrame({'Id': ids,
+                             'RegisteredDate': registered.strftime('%Y-%m-%d %H:%M:%S'),
+                             'UniversityName': rng.choice(['USP', 'UFBA', 'UFPR', None], n_students),
+                             'CourseName': rng.choice(['Direito', 'Medicina', 'Engenharia'], n_students),
+                             'City': rng.choice(['Cidade A', 'Cidade B', None], n_students),
+                             'State': rng.choice(states, n_students)})
+
+    def counts(name, share):
+        active = rng.choice(ids, int(n_students * share), replace=False)
+        return pd.DataFrame({'StudentId': active, name: rng.integers(1, 50, len(active))})
+
+    file_views = counts('fileview_count', 0.8)
+    file_views = pd.concat([file_views.astype({'StudentId': object}),
+                            pd.DataFrame({'StudentId': ['abc', ''], 'fileview_count': [3, 1]})],
+                           ignore_index=True)
+    sessions = counts('session_count', 0.9)
+    sessions['last_session'] = (pd.Timestamp('2018-01-01')
+                                - pd.to_timedelta(rng.integers(0, 300, len(sessions)), unit='D'))
+    payers = rng.choice(ids, n_students // 5, replace=False)
+    payments = pd.DataFrame({'StudentId': np.repeat(payers, 2),
+                             'PlanType': np.tile(['Mensal', 'Anual'], len(payers)),
+                             'payment_count': rng.integers(0, 5, 2 * len(payers))})
+    payments = payments.loc[payments.payment_count > 0]
+    weekly_count = rng.integers(0, 30, n_students)
+    usage_weekly = pd.DataFrame({'usage_weekly_count': weekly_count,
+                                 'usage_weekly_mean': np.where(weekly_count > 0, rng.random(n_students) * 5, np.nan),
+                                 'StudentId': ids})
+    device = counts('mobile', 0.8)
+    device['mobile'] = rng.integers(0, 2, len(device))
+    device['desktop'] = 1 - device.mobile
+    datasets = {'students': students,
+                'cancellations_agg': counts('cancelation_count', 0.05),
+                'fileViews_agg': file_views,
+                'payments_agg': payments,
+                'questions_agg': counts('question_count', 0.3),
+                'sessions_agg': sessions,
+                'subjects_agg': counts('subject_count', 0.6),
+                'usage_weekly': usage_weekly,
+                'usage_device': device}
+    return {name: apply_schema(df, name) for name, df in datasets.items()}
+
+
+def measure(func, *args):
+    """ Wall time of one call and peak traced memory (MB) of a second one,
+        since tracing slows the allocations down.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+@click.command()
+@click.option('--sizes', default='100000,1000000,3000000', help='Comma separated student counts.')
+def main(sizes):
+    """ Checks assemble_abt against the chained-merge assembly and reports the
+        time and peak memory of both as the number of students grows.
+    """
+    print(f"{'students':>10}{'merge s':>10}{'merge MB':>10}{'indexed s':>11}{'indexed MB':>12}")
+    for n in [int(size) for size in sizes.split(',')]:
+        datasets = make_abt_inputs(n)
+        max_time = datasets['sessions_agg'].last_session.max()
+        expected, legacy_time, legacy_peak = measure(legacy_assemble_abt, datasets, max_time)
+        result, indexed_time, indexed_peak = measure(assemble_abt, datasets, max_time)
+        pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+        del expected, result
+        print(f"{n:>10}{legacy_time:>10.2f}{legacy_peak:>10.0f}{indexed_time:>11.2f}{indexed_peak:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import pandas as pd
+
+from src.data.catalog import Catalog
+from src.data.storage import FORMATS, read_dataset
+from src.features.build_features import ABT_INPUTS
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+@click.option('--students', default=1000, help='Students of the filtered loads.')
+def main(output_filepath, storage_format, students):
+    """ Loads the ABT inputs through the catalog, checks every load against
+        read_dataset and reports the time of the first load, of the cached
+        one and of a filtered load served from memory.
+    """
+    catalog = Catalog(output_filepath, storage_format)
+    ids = read_dataset(output_filepath, 'students', columns=['Id'], fmt=storage_format).Id.dropna()
+    ids = list(ids.iloc[:students])
+    totals = {'read': 0.0, 'cached': 0.0, 'filtered': 0.0}
+    for name, columns in ABT_INPUTS.items():
+        filters = [('Id' if name == 'students' else 'StudentId', 'in', ids)]
+        expected, elapsed = timed(lambda: read_dataset(output_filepath, name, columns=columns, fmt=storage_format))
+        totals['read'] += elapsed
+        pd.testing.assert_frame_equal(catalog.load(name, columns), expected)
+        df, elapsed = timed(lambda: catalog.load(name, columns))
+        pd.testing.assert_frame_equal(df, expected)
+        totals['cached'] += elapsed
+        df, elapsed = timed(lambda: catalog.load(name, columns[::-1], filters))
+        pd.testing.assert_frame_equal(df, read_dataset(output_filepath, name, columns=columns[::-1], filters=filters,
+                                                       fmt=storage_format))
+        totals['filtered'] += elapsed
+    print(f'{len(ABT_INPUTS)} ABT inputs: read {totals["read"]:.3f}s, cached {totals["cached"]:.4f}s, '
+          f'filtered from memory {totals["filtered"]:.4f}s')
+    print(f'{catalog.hits} hits, {catalog.misses} misses, {catalog.nbytes / 2 ** 20:.1f} MB kept')
+    print(catalog.info().to_string(index=False, float_format=lambda x: f'{x:.2f}'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset
+from src.models.predict_model import SCORERS, agreement, load_artifact, score
+from src.models.train_model import MODEL_PATH
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--students', default=1000000, help='Rows of the scaled ABT.')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(output_filepath, students, model_path, storage_format):
+    """ Scores a scaled copy of the ABT with the classifier and the nearest
+        centroid, checks the centroid scorer against the KMeans assignment
+        and reports the students scored per second and how often both
+        scorers agree.
+    """
+    artifact = load_artifact(model_path)
+    artifact['classifier'].set_params(n_jobs=1)
+    abt = read_dataset(output_filepath, 'abt_segmentation', fmt=storage_format)
+    abt = abt.iloc[np.arange(students) % len(abt)].reset_index(drop=True)
+
+    kmeans = artifact['kmeans'].predict(artifact['scaler'].transform(abt[artifact['features']]))
+    for scorer in SCORERS:
+        start = time.perf_counter()
+        predictions = score(artifact, abt, scorer)
+        elapsed = time.perf_counter() - start
+        if scorer == 'centroid':
+            assert (predictions.cluster.values == kmeans).all()
+            assert ((predictions.probability >= 0.5) & (predictions.probability <= 1)).all()
+        print(f'{scorer:<8} {students} students in {elapsed:.2f}s ({students / elapsed:.0f} students/s)')
+    print(f'centroid agrees with the classifier on {agreement(artifact, abt):.2%} of the students')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset
+from src.models.compiled_forest import CompiledForest, compile_forest, forest_path
+from src.models.predict_model import load_artifact
+from src.models.train_model import MODEL_PATH
+
+
+def timed(func, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--students', default=1000000, help='Rows of the scaled ABT.')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(output_filepath, students, model_path, storage_format):
+    """ Compiles the classifier of the model artifact, checks that the
+        compiled forest's probabilities are bit-identical to predict_proba
+        and compares the load time and the students scored per second.
+    """
+    artifact, joblib_time = timed(load_artifact, model_path, repeat=5)
+    classifier = artifact['classifier'].set_params(n_jobs=1)
+    compile_forest(classifier, artifact['features'], forest_path(model_path))
+    forest, compiled_time = timed(CompiledForest, forest_path(model_path), repeat=5)
+
+    abt = read_dataset(output_filepath, 'abt_segmentation', fmt=storage_format)
+    abt = abt.iloc[np.arange(students) % len(abt)].reset_index(drop=True)
+    x = abt[artifact['features']]
+    expected = classifier.predict_proba(x)
+    assert np.array_equal(forest.predict_proba(abt), expected)
+    assert (forest.predict(abt) == classifier.predict(x)).all()
+
+    print(f'{forest.meta["trees"]} trees, {forest.meta["nodes"]} nodes, depth {forest.meta["max_depth"]}')
+    print(f'load            joblib + sklearn {joblib_time * 1000:10.2f} ms, compiled {compiled_time * 1000:10.2f} ms')
+    for batch in [1, 16, 256, 4096, students]:
+        repeat = max(1, 1000 // batch)
+        _, sklearn_time = timed(classifier.predict_proba, x.iloc[:batch], repeat=repeat)
+        _, forest_time = timed(forest.predict_proba, x.iloc[:batch], repeat=repeat)
+        print(f'batch {batch:>8}  joblib + sklearn {batch / sklearn_time:10.0f} rows/s, '
+              f'compiled {batch / forest_time:10.0f} rows/s')
+    print('compiled probabilities are bit-identical to predict_proba')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.event_index import INDEXED_TABLES, NAT, build_event_index, load_event_index
+from src.data.incremental import EVENT_TIME
+from src.data.storage import FORMATS, read_dataset
+from src.features.windows import DAY
+
+
+def timed(func, *args, repeat=3):
+    """ Result and best wall time of `repeat` calls. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def masked_events(df, time_column, student_ids):
+    """ The reference lookup: one boolean mask over the table per student. """
+    return [np.sort(df.loc[df.StudentId == student_id, time_column].to_numpy(dtype='datetime64[ns]'))
+            for student_id in student_ids]
+
+
+def sliced_events(index, student_ids):
+    return [index.events(student_id) for student_id in student_ids]
+
+
+def grouped(df, time_column):
+    """ The reference reductions: one groupby per statistic. """
+    groups = df.dropna(subset=['StudentId']).groupby('StudentId')[time_column]
+    days = df[time_column].dt.floor('D')
+    return pd.DataFrame({'count': groups.size(), 'first': groups.min(), 'last': groups.max(),
+                         'days': days.groupby(df.StudentId).nunique()})
+
+
+def reduced(index):
+    """ The same reductions over the CSR segments. """
+    times = np.asarray(index.times)
+    days = np.where(times == NAT, NAT, times // DAY)
+    return pd.DataFrame({'count': index.counts(), 'first': index.first_time().view('datetime64[ns]'),
+                         'last': index.last_time().view('datetime64[ns]'),
+                         'days': index.distinct(days) - index.reduce(days == NAT)},
+                        index=pd.Index(index.student_ids, name='StudentId'))
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+@click.option('--lookups', type=click.IntRange(min=1), default=200, help='Students looked up one by one.')
+def main(output_filepath, storage_format, lookups):
+    """ Checks the per-student event index against boolean masks and
+        groupbys, and times single-student lookups and per-student
+        reductions with both.
+    """
+    rng = np.random.default_rng(0)
+    for table in INDEXED_TABLES:
+        time_column = EVENT_TIME[table]
+        df = read_dataset(output_filepath, table, fmt=storage_format)
+        _, build_time = timed(build_event_index, output_filepath, table, storage_format, repeat=1)
+        index = load_event_index(output_filepath, table, storage_format)
+
+        # the rows point back to the events of each student
+        ids = np.repeat(index.student_ids, index.counts())
+        assert (df.StudentId.to_numpy(dtype=np.int64, na_value=-1)[index.rows] == ids).all()
+
+        student_ids = rng.choice(index.student_ids, size=min(lookups, len(index)), replace=False)
+        expected, mask_time = timed(masked_events, df, time_column, student_ids)
+        result, slice_time = timed(sliced_events, index, student_ids)
+        for a, b in zip(expected, result):
+            np.testing.assert_array_equal(a, b)
+
+        expected, groupby_time = timed(grouped, df, time_column)
+        result, reduceat_time = timed(reduced, index)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+
+        print(f'{table}: {len(index.times)} events of {len(index)} students, index built in {build_time:.2f}s')
+        print(f'  {len(student_ids)} lookups: mask {mask_time:.3f}s, slice {slice_time:.4f}s')
+        print(f'  count/first/last/active days: groupby {groupby_time:.3f}s, reduceat {reduceat_time:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset, write_dataset
+from src.features.feature_store import FeatureStore, write_feature_store
+
+
+def scaled_abt(output_filepath, n_students, fmt):
+    """ The ABT of `output_filepath` repeated up to `n_students` rows, with
+        fresh ids in shuffled order.
+    """
+    abt = read_dataset(output_filepath, 'abt_segmentation', fmt=fmt)
+    abt = abt.iloc[np.arange(n_students) % len(abt)].reset_index(drop=True)
+    abt['Id'] = np.random.default_rng(1).permutation(n_students) + 1
+    return abt
+
+
+def timed(func, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--students', default=1000000, help='Rows of the scaled ABT.')
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(output_filepath, students, storage_format):
+    """ Compares reading one student's features from the ABT dataset with
+        the feature store lookups, gathers and column slices.
+    """
+    abt = scaled_abt(output_filepath, students, storage_format)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as store_dir:
+        write_dataset(abt, store_dir, 'abt_segmentation', storage_format)
+        _, write_time = timed(write_feature_store, abt, store_dir)
+        student_id = int(abt.Id.iloc[students // 2])
+
+        def from_dataset():
+            df = read_dataset(store_dir, 'abt_segmentation', fmt=storage_format)
+            return df.loc[df.Id == student_id]
+
+        _, dataset_time = timed(from_dataset)
+        store, open_time = timed(FeatureStore, store_dir)
+        _, lookup_time = timed(store.lookup, student_id, repeat=1000)
+        keys = rng.choice(abt.Id.to_numpy(), 10000)
+        gathered, gather_time = timed(store.gather, keys, repeat=10)
+        column, column_time = timed(store.column, 'session_rate', repeat=1000)
+        assert np.shares_memory(column, store.values)
+        expected = abt.set_index('Id').loc[keys, store.columns].astype('float64').to_numpy()
+        assert (gathered.to_numpy() == expected).all()
+
+    print(f'{students} students')
+    print(f'write store            {write_time * 1000:10.2f} ms')
+    print(f'read dataset + filter  {dataset_time * 1000:10.2f} ms')
+    print(f'open store             {open_time * 1000:10.2f} ms')
+    print(f'lookup one student     {lookup_time * 1e6:10.2f} us')
+    print(f'gather 10k students    {gather_time * 1000:10.2f} ms')
+    print(f'column slice           {column_time * 1e6:10.2f} us')
+
+
+if __name__ == '__main__':
+    main()
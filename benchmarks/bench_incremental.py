@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import pandas as pd
+
+from src.data.aggregate import AGGREGATIONS
+from src.data.generate_dataset import generate
+from src.data.incremental import EVENT_TIME
+from src.data.make_dataset import create_database_A, create_database_B, create_database_agg, update_database_agg
+from src.data.storage import FORMATS, read_dataset
+from src.features.build_features import create_database_ABT, update_database_ABT
+
+OUTPUTS = list(AGGREGATIONS) + ['sessions_weekly', 'usage_weekly', 'fileViews_clients', 'usage_device',
+                                'abt_segmentation']
+
+
+def write_history_until(input_filepath, output_filepath, cutoff):
+    """ Copies the raw JSON files keeping only events (and students) up to
+        `cutoff`, as they were exported at that time.
+    """
+    os.makedirs(f'{output_filepath}/BASE A')
+    os.makedirs(f'{output_filepath}/BASE B')
+    pd.read_json(f'{input_filepath}/BASE A/premium_students.json') \
+        .to_json(f'{output_filepath}/BASE A/premium_students.json', orient='records')
+    for file in ['fileViews', 'premium_cancellations', 'premium_payments', 'questions', 'sessions', 'students',
+                 'subjects']:
+        df = pd.read_json(f'{input_filepath}/BASE B/{file}.json')
+        time_column = EVENT_TIME.get(file, 'RegisteredDate' if file == 'students' else None)
+        if time_column is not None:
+            df = df.loc[pd.to_datetime(df[time_column], format='ISO8601') <= cutoff]
+        df.to_json(f'{output_filepath}/BASE B/{file}.json', orient='records')
+
+
+def append_edge_events(history_filepath, current_filepath):
+    """ Appends to both exports a session and a file view without a valid
+        time, then to the current exports a session at the last session time
+        of the history and the same rows without a time again: new rows a
+        time filter on the watermark would miss or count twice.
+    """
+    history = pd.read_json(f'{history_filepath}/BASE B/sessions.json', dtype={'SessionStartTime': str})
+    last = history.loc[pd.to_datetime(history.SessionStartTime, format='ISO8601').idxmax()]
+    session = {'StudentId': int(last.StudentId), 'SessionStartTime': None, 'StudentClient': 'Website'}
+    view = {'StudentId': int(last.StudentId), 'FileName': 'Fisica', 'ViewDate': 'unknown', 'Studentclient': 'Website'}
+    edges = {'sessions': ([session], [session, dict(session, SessionStartTime=last.SessionStartTime), session]),
+             'fileViews': ([view], [view, view])}
+    for file, (history_rows, current_rows) in edges.items():
+        for path, rows in [(history_filepath, history_rows), (current_filepath, history_rows + current_rows)]:
+            df = pd.read_json(f'{path}/BASE B/{file}.json', dtype=False)
+            df = pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
+            df.to_json(f'{path}/BASE B/{file}.json', orient='records')
+
+
+def default_cutoff(input_filepath):
+    sessions = pd.read_json(f'{input_filepath}/BASE B/sessions.json')
+    return pd.to_datetime(sessions.SessionStartTime, format='ISO8601').quantile(0.8)
+
+
+def full_build(input_filepath, output_filepath, fmt):
+    create_database_A(input_filepath, output_filepath, fmt=fmt)
+    create_database_B(input_filepath, output_filepath, fmt=fmt)
+    start = time.perf_counter()
+    create_database_agg(input_filepath, output_filepath, fmt)
+    create_database_ABT(input_filepath, output_filepath, fmt)
+    return time.perf_counter() - start
+
+
+def incremental_build(input_filepath, output_filepath, fmt):
+    create_database_A(input_filepath, output_filepath, fmt=fmt)
+    create_database_B(input_filepath, output_filepath, fmt=fmt)
+    start = time.perf_counter()
+    update_database_agg(input_filepath, output_filepath, fmt)
+    update_database_ABT(input_filepath, output_filepath, fmt)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True), required=False)
+@click.option('--cutoff', default=None, help='Event time of the first build, defaults to the 80th '
+                                             'percentile of the session times.')
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+@click.option('--scale', type=click.FloatRange(min=0, max=100, min_open=True), default=0.01,
+              help='Size of the synthetic exports used without INPUT_FILEPATH.')
+def main(input_filepath, cutoff, storage_format, scale):
+    """ Builds the aggregates and the ABT from the history up to `cutoff`,
+        updates them incrementally with the full history and checks that the
+        result matches a full rebuild. Both histories get rows at the
+        watermark time and rows without a valid time (see
+        `append_edge_events`). Without INPUT_FILEPATH, runs on synthetic
+        exports.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        history, current, incremental, full = [f'{tmp}/{name}' for name in ['history', 'current', 'incremental',
+                                                                             'full']]
+        if input_filepath is None:
+            generate(current, scale)
+        else:
+            shutil.copytree(input_filepath, current)
+        cutoff = pd.Timestamp(cutoff) if cutoff else default_cutoff(current)
+        write_history_until(current, history, cutoff)
+        append_edge_events(history, current)
+        os.makedirs(incremental)
+        os.makedirs(full)
+
+        full_build(history, incremental, storage_format)
+        incremental_seconds = incremental_build(current, incremental, storage_format)
+        full_seconds = full_build(current, full, storage_format)
+
+        for name in OUTPUTS:
+            pd.testing.assert_frame_equal(read_dataset(incremental, name, fmt=storage_format),
+                                          read_dataset(full, name, fmt=storage_format),
+                                          check_dtype=False, check_categorical=False, obj=name)
+    print(f'incremental outputs match the full rebuild (cutoff {cutoff})')
+    print(f'full rebuild {full_seconds:.2f}s, incremental update {incremental_seconds:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
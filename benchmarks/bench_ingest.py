@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import filecmp
+import json
+import os
+import tempfile
+import time
+
+import click
+import pandas as pd
+
+from src.data import ingest
+from src.data.make_dataset import raw_files
+from src.data.storage import FORMATS, dataset_path, read_dataset
+
+# sessions whose keys differ between records: the first batch of two lacks
+# StudentClient and Extra, a later record lacks SessionStartTime
+RAGGED_SESSIONS = [{'StudentId': 1, 'SessionStartTime': '2017-02-19 18:44:52'},
+                   {'StudentId': 2, 'SessionStartTime': '2017-02-20 08:00:00'},
+                   {'StudentId': 3, 'SessionStartTime': '2017-02-21 09:30:00', 'StudentClient': 'Website'},
+                   {'StudentId': 4, 'StudentClient': 'iOS | 10.2.1', 'Extra': 'x'},
+                   {'StudentId': 5, 'SessionStartTime': '2017-02-22 10:00:00'}]
+
+
+def decode_times(files):
+    """ Seconds to decode each raw file with the standard library and with
+        orjson (when installed).
+    """
+    rows = []
+    for name, path in files.items():
+        with open(path, 'rb') as f:
+            data = f.read()
+        row = {'file': name, 'mb': len(data) / 2 ** 20}
+        start = time.perf_counter()
+        json.loads(data)
+        row['json_s'] = time.perf_counter() - start
+        if ingest.orjson is not None:
+            start = time.perf_counter()
+            ingest.orjson.loads(data)
+            row['orjson_s'] = time.perf_counter() - start
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def check_ragged(storage_format):
+    """ Converts ragged records whole and in batches of two, and checks
+        that both write the same dataset.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = f'{tmp}/sessions.json'
+        with open(json_path, 'w') as f:
+            json.dump(RAGGED_SESSIONS, f)
+        for label, batch_size in [('whole', None), ('batches', 2)]:
+            os.makedirs(f'{tmp}/{label}')
+            ingest.convert_json(json_path, f'{tmp}/{label}', 'sessions', batch_size, storage_format)
+        whole, batches = [read_dataset(f'{tmp}/{label}', 'sessions', fmt=storage_format)
+                          for label in ['whole', 'batches']]
+        # parquet batches store categories as string columns, read back with string categories
+        pd.testing.assert_frame_equal(batches, whole, check_dtype=storage_format == 'csv',
+                                      check_categorical=storage_format == 'csv')
+        assert list(whole.columns) == ['StudentId', 'SessionStartTime', 'StudentClient', 'Extra']
+    print('whole and batched conversions of ragged records match')
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.option('--workers', type=click.IntRange(min=2), default=max(2, os.cpu_count() or 1))
+@click.option('--batch-size', type=click.IntRange(min=1), default=None)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(input_filepath, workers, batch_size, storage_format):
+    """ Checks the batched conversion of ragged records, times the
+        conversion of the raw files serially and on a process pool, checks
+        that both write the same datasets and compares the JSON decoders.
+    """
+    check_ragged(storage_format)
+    files = raw_files(input_filepath)
+    timings = {}
+    with tempfile.TemporaryDirectory() as serial, tempfile.TemporaryDirectory() as parallel:
+        for label, output_filepath, n in [('serial', serial, 1), (f'{workers} workers', parallel, workers)]:
+            print(f'--- {label}')
+            start = time.perf_counter()
+            ingest.convert_files(files, output_filepath, batch_size, storage_format, n)
+            timings[label] = time.perf_counter() - start
+        for name in files:
+            if storage_format == 'csv':
+                same = filecmp.cmp(dataset_path(serial, name), dataset_path(parallel, name), shallow=False)
+            else:
+                same = pd.read_parquet(dataset_path(serial, name, storage_format)).equals(
+                    pd.read_parquet(dataset_path(parallel, name, storage_format)))
+            assert same, f'{name} differs between the serial and parallel conversion'
+    print('serial and parallel conversions match')
+    for label, seconds in timings.items():
+        print(f'{label}: {seconds:.2f}s')
+
+    print(f"--- decoders (orjson {'installed' if ingest.orjson is not None else 'not installed'})")
+    print(decode_times(files).to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+
+
+if __name__ == '__main__':
+    main()
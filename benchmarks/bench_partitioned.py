@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import click
+import pandas as pd
+
+from src.data.aggregate import AGGREGATIONS
+from src.data.incremental import load_state
+from src.data.make_dataset import (BASE_B_FILES, create_database_A, create_database_B, create_database_agg,
+                                   create_database_agg_partitioned)
+from src.data.storage import FORMATS, read_dataset
+
+OUTPUTS = {name: spec['key'] for name, spec in AGGREGATIONS.items()}
+OUTPUTS.update({'sessions_weekly': ['StudentId', 'week_year'], 'usage_weekly': ['StudentId'],
+                'fileViews_clients': ['StudentId', 'Studentclient'], 'usage_device': ['StudentId']})
+
+
+def sorted_output(output_filepath, name, fmt):
+    """ A written output in key order, with categories as plain strings since
+        their order depends on how the rows were read.
+    """
+    df = read_dataset(output_filepath, name, fmt=fmt)
+    df = df.astype({c: 'string' for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    return df.sort_values(OUTPUTS[name]).reset_index(drop=True)
+
+
+def run(func, *args, trace=False):
+    """ Wall time, or peak traced memory (MB) when `trace`, of one call. """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    if not trace:
+        return elapsed
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return peak
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.option('--partition-size', default=100000, help='Rows per partition.')
+@click.option('--workers', default=2)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(input_filepath, partition_size, workers, storage_format):
+    """ Checks that the out-of-core aggregates match the in-memory ones and
+        compares the time and peak memory of both.
+    """
+    fmt = storage_format
+    with tempfile.TemporaryDirectory() as in_memory, tempfile.TemporaryDirectory() as partitioned:
+        create_database_A(input_filepath, in_memory, fmt=fmt)
+        create_database_B(input_filepath, in_memory, fmt=fmt)
+        for name in ['premium_students'] + BASE_B_FILES:
+            shutil.copy(f'{in_memory}/{name}.{fmt}', partitioned)
+
+        print(f"{'mode':<26}{'seconds':>10}{'peak MB':>10}")
+        modes = [('in memory', create_database_agg, in_memory, ()),
+                 ('partitioned', create_database_agg_partitioned, partitioned, (partition_size, 1)),
+                 (f'partitioned, {workers} workers', create_database_agg_partitioned, partitioned,
+                  (partition_size, workers))]
+        for label, func, output_filepath, args in modes:
+            seconds = run(func, input_filepath, output_filepath, fmt, *args)
+            # worker processes are not traced, the peak is only reported in-process
+            peak = run(func, input_filepath, output_filepath, fmt, *args, trace=True) if label != modes[2][0] else None
+            print(f"{label:<26}{seconds:>10.2f}{peak if peak is not None else float('nan'):>10.0f}")
+
+        for name in OUTPUTS:
+            pd.testing.assert_frame_equal(sorted_output(partitioned, name, fmt), sorted_output(in_memory, name, fmt))
+        assert load_state(partitioned) == load_state(in_memory)
+    print('partitioned outputs match the in-memory build')
+
+
+if __name__ == '__main__':
+    main()
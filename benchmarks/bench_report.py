@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset, write_dataset
+from src.visualization.visualize import segment_report
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--students', default=2000000, help='Rows of the scaled ABT.')
+@click.option('--storage-format', type=click.Choice(FORMATS), default='parquet')
+def main(output_filepath, students, storage_format):
+    """ Builds the segment report from a copy of the ABT and predictions
+        scaled to `students` rows, and reports its time and size on disk.
+    """
+    abt = read_dataset(output_filepath, 'abt_segmentation')
+    predictions = read_dataset(output_filepath, 'predictions')
+    rows = np.arange(students) % len(abt)
+    abt = abt.iloc[rows].reset_index(drop=True)
+    abt['Id'] = np.arange(students, dtype=np.int32)
+    predictions = predictions.set_index('StudentId').reindex(read_dataset(output_filepath, 'abt_segmentation').Id)
+    predictions = predictions.iloc[rows].reset_index(drop=True)
+    predictions.insert(0, 'StudentId', abt.Id.values)
+
+    with tempfile.TemporaryDirectory() as scaled:
+        write_dataset(abt, scaled, 'abt_segmentation', storage_format)
+        write_dataset(predictions, scaled, 'predictions', storage_format)
+        start = time.perf_counter()
+        profile = segment_report(scaled, storage_format, f'{scaled}/report')
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(f'{scaled}/report/{name}') for name in os.listdir(f'{scaled}/report'))
+    assert profile.students.sum() == students
+    print(f'{students} students, {len(profile)} segments: report in {elapsed:.2f}s, {size / 2 ** 10:.0f} KB on disk')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset, write_dataset
+from src.models.predict_model import load_artifact, predict
+from src.models.train_model import MODEL_PATH
+
+
+def scaled_abt(output_filepath, n_students, fmt):
+    """ The ABT of `output_filepath` repeated up to `n_students` rows, with
+        fresh ids.
+    """
+    abt = read_dataset(output_filepath, 'abt_segmentation', fmt=fmt)
+    abt = abt.iloc[np.arange(n_students) % len(abt)].reset_index(drop=True)
+    abt['Id'] = np.arange(1, n_students + 1)
+    return abt
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--students', default=1000000, help='Rows of the scaled ABT.')
+@click.option('--chunk-size', default=100000)
+@click.option('--workers', default=max(2, os.cpu_count() or 1))
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(output_filepath, students, chunk_size, workers, model_path, storage_format):
+    """ Scores a scaled copy of the ABT serially and on a process pool,
+        checks both against one in-memory predict_proba and reports the
+        students scored per second.
+    """
+    fmt = storage_format
+    abt = scaled_abt(output_filepath, students, fmt)
+    artifact = load_artifact(model_path)
+    expected = artifact['classifier'].predict_proba(abt[artifact['features']])
+
+    with tempfile.TemporaryDirectory() as scoring:
+        write_dataset(abt, scoring, 'abt_segmentation', fmt)
+        for n in [1, workers]:
+            start = time.perf_counter()
+            rows = predict(scoring, fmt, model_path, chunk_size, n)
+            elapsed = time.perf_counter() - start
+            predictions = read_dataset(scoring, 'predictions', fmt=fmt)
+            assert (predictions.StudentId.values == abt.Id.values).all()
+            assert (predictions.cluster.values == artifact['classifier'].classes_[expected.argmax(axis=1)]).all()
+            np.testing.assert_allclose(predictions.probability.values, expected.max(axis=1), rtol=1e-6)
+            print(f'{n} worker(s): {rows} students in {elapsed:.2f}s ({rows / elapsed:.0f} students/s)')
+    print('chunked predictions match the in-memory model')
+
+
+if __name__ == '__main__':
+    main()
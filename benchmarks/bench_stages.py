@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import click
+from sklearn.ensemble import RandomForestClassifier
+
+from src.data import make_dataset
+from src.data.generate_dataset import generate
+from src.data.storage import FORMATS, read_dataset
+from src.features.build_features import create_database_ABT
+from src.models.train_model import get_features, segment
+
+COUNTS = ['count_session_by_studentId', 'count_fileview_by_studentId', 'count_question_by_studentId',
+          'count_payment', 'count_cancellation', 'count_subject']
+# dataset each count reads
+COUNT_INPUTS = dict(zip(COUNTS, ['sessions', 'fileViews', 'questions', 'premium_payments', 'premium_cancellations',
+                                 'subjects']))
+# changes below these are noise, whatever the tolerance
+MIN_DELTA = {'seconds': 0.05, 'peak_mb': 1.0}
+
+
+def run(func, *args, trace=False):
+    """ Wall time, or peak traced memory (MB) when `trace`, of one call;
+        the stage's own progress prints are dropped.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        func(*args)
+    elapsed = time.perf_counter() - start
+    if not trace:
+        return elapsed
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return peak
+
+
+def stages(input_filepath, output_filepath, fmt):
+    """ (name, function, args) of each timed stage, in pipeline order; the
+        arguments are read lazily, once the previous stages wrote them.
+    """
+    def dataset(name):
+        return lambda: read_dataset(output_filepath, name, fmt=fmt)
+
+    yield 'create_database_A', make_dataset.create_database_A, lambda: (input_filepath, output_filepath, None, fmt)
+    yield 'create_database_B', make_dataset.create_database_B, lambda: (input_filepath, output_filepath, None, fmt)
+    for count in COUNTS:
+        yield count, getattr(make_dataset, count), lambda count=count: (dataset(COUNT_INPUTS[count])(),)
+    yield 'get_usage_weekly', make_dataset.get_usage_weekly, lambda: (dataset('students')(), dataset('sessions')())
+    yield 'get_device_profile', make_dataset.get_device_profile, lambda: (dataset('fileViews')(),)
+    yield 'create_database_agg', make_dataset.create_database_agg, lambda: (input_filepath, output_filepath, fmt)
+    yield 'create_database_ABT', create_database_ABT, lambda: (input_filepath, output_filepath, fmt)
+
+    def features():
+        return get_features(dataset('abt_segmentation')())
+
+    yield 'kmeans_fit', segment, lambda: (features(),)
+
+    def forest():
+        x = features()
+        return RandomForestClassifier(n_estimators=200, n_jobs=-1, class_weight='balanced_subsample',
+                                      random_state=42), x, segment(x)[2]
+
+    yield 'forest_fit', lambda rf, x, y: rf.fit(x, y), forest
+
+    def fitted():
+        rf, x, y = forest()
+        return rf.fit(x, y), x
+
+    yield 'forest_predict', lambda rf, x: rf.predict_proba(x), fitted
+
+
+def benchmark(input_filepath, fmt='csv', memory=True, repeat=1):
+    """ Seconds (the best of `repeat` runs) and peak traced memory of every
+        stage on the raw exports of `input_filepath`, built in a temporary
+        directory. The memory is measured on a separate, traced run, so
+        tracing does not slow the timed ones.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as output_filepath:
+        for name, func, args in stages(input_filepath, output_filepath, fmt):
+            arguments = args()
+            results[name] = {'seconds': min(run(func, *arguments) for _ in range(repeat))}
+            if memory:
+                results[name]['peak_mb'] = run(func, *arguments, trace=True)
+            peak = f'{results[name]["peak_mb"]:10.1f} MB' if memory else ''
+            print(f'{name:<30} {results[name]["seconds"]:8.2f}s {peak}')
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """ Stages whose seconds or peak memory grew by more than `tolerance`
+        over the baseline.
+    """
+    found = []
+    for name, result in results.items():
+        for metric, value in result.items():
+            previous = baseline.get('stages', {}).get(name, {}).get(metric)
+            if previous and value > previous * (1 + tolerance) and value - previous > MIN_DELTA[metric]:
+                found.append(f'{name} {metric}: {previous:.2f} -> {value:.2f} ({value / previous - 1:+.0%})')
+    return found
+
+
+@click.command()
+@click.option('--input-filepath', type=click.Path(exists=True), default=None,
+              help='Raw exports to benchmark; generated at --scale when omitted.')
+@click.option('--scale', type=click.FloatRange(min=0, max=100, min_open=True), default=0.1,
+              help='Size of the generated dataset relative to the real one.')
+@click.option('--seed', default=0)
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+@click.option('--repeat', type=click.IntRange(min=1), default=1, help='Timed runs per stage, the best is kept.')
+@click.option('--no-memory', is_flag=True, help='Skip the traced runs measuring the peak memory.')
+@click.option('--save', type=click.Path(), default=None, help='Write the results to this JSON file.')
+@click.option('--compare', type=click.Path(exists=True), default=None,
+              help='Baseline JSON written by --save; fails on regressions.')
+@click.option('--tolerance', default=0.2, help='Allowed growth over the baseline.')
+def main(input_filepath, scale, seed, storage_format, repeat, no_memory, save, compare, tolerance):
+    """ Times every stage of the pipeline, from the JSON conversion to the
+        forest predictions, and records its peak memory.
+    """
+    report = {'input': input_filepath or f'generated at {scale}x, seed {seed}', 'storage_format': storage_format}
+    with tempfile.TemporaryDirectory() as raw:
+        if input_filepath is None:
+            input_filepath = raw
+            print(f'generating a {scale}x dataset')
+            generate(raw, scale, seed)
+        results = benchmark(input_filepath, storage_format, not no_memory, repeat)
+
+    report['stages'] = results
+    if save:
+        with open(save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if compare:
+        with open(compare) as f:
+            found = regressions(results, json.load(f), tolerance)
+        if found:
+            raise click.ClickException('regressions over the baseline:\n' + '\n'.join(found))
+        print(f'no stage regressed by more than {tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
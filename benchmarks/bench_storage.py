@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+from src.data.storage import FORMATS
+
+project_dir = Path(__file__).resolve().parents[1]
+
+
+def directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).iterdir() if f.is_file())
+
+
+def run_pipeline(input_filepath, output_filepath, fmt):
+    """ Runs the same commands as `make data features` and returns the wall
+        time in seconds.
+    """
+    start = time.perf_counter()
+    for script in ['src/data/make_dataset.py', 'src/features/build_features.py']:
+        subprocess.run([sys.executable, str(project_dir / script), input_filepath, output_filepath,
+                        '--storage-format', fmt],
+                       check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.option('--repeat', default=1, help='Runs per format, the best one is reported.')
+def main(input_filepath, repeat):
+    """ Compares wall time and bytes on disk of `make data features` for each
+        storage format.
+    """
+    print(f"{'format':<10}{'seconds':>10}{'MB on disk':>12}")
+    for fmt in FORMATS:
+        timings = []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as output_filepath:
+                timings.append(run_pipeline(os.path.abspath(input_filepath), output_filepath, fmt))
+                size = directory_size(output_filepath)
+        print(f"{fmt:<10}{min(timings):>10.2f}{size / 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
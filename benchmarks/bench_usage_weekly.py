@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.make_dataset import get_usage_weekly
+
+
+def legacy_get_usage_weekly(student, sessions):
+    """ The per-student implementation replaced by the vectorized one, kept as
+        the reference. The weekly count column is selected explicitly because
+        newer pandas refuses the mean of the week string column.
+    """
+    sessions = sessions.copy()
+    sessions['week_year'] = pd.to_datetime(sessions.SessionStartTime).map(lambda x: x.strftime("%Y-%V"))
+    session_agg = sessions.groupby(['week_year', 'StudentId']).agg({'week_year': ['count']}).reset_index()
+    student_ids = student.Id.unique()
+    lista = [session_agg.loc[session_agg.StudentId == id][('week_year', 'count')].agg(['count', 'mean']).values
+             for id in student_ids]
+    df = pd.DataFrame(lista)
+    df.columns = ['usage_weekly_count', 'usage_weekly_mean']
+    df['StudentId'] = student_ids
+    return df
+
+
+def make_sessions(n_students, sessions_per_student, seed=0):
+    rng = np.random.default_rng(seed)
+    student = pd.DataFrame({'Id': rng.permutation(n_students * 10)[:n_students] + 1})
+    n_sessions = n_students * sessions_per_student
+    # a few students never log in, and the range crosses ISO year boundaries
+    active = student.Id.values[:max(1, int(n_students * 0.9))]
+    start = pd.Timestamp('2015-12-20') + pd.to_timedelta(rng.integers(0, 900 * 86400, n_sessions), unit='s')
+    sessions = pd.DataFrame({'StudentId': rng.choice(active, n_sessions),
+                             'SessionStartTime': start.strftime('%Y-%m-%d %H:%M:%S')})
+    return student, sessions
+
+
+def boundary_sessions():
+    """ Sessions around ISO year boundaries, where "%Y-%V" mixes the calendar
+        year with the ISO week: 2015-12-31 and 2016-01-01 are both ISO week
+        53 but different keys, and 2018-12-31 (ISO week 1 of 2019) shares the
+        key of 2018-01-02.
+    """
+    student = pd.DataFrame({'Id': [1, 2, 3, 4]})
+    sessions = pd.DataFrame({'StudentId': [1, 1, 1, 2, 2, 2, 3],
+                             'SessionStartTime': ['2015-12-31 23:59:59', '2016-01-01 00:00:00', '2016-01-04 08:00:00',
+                                                  '2018-01-02 10:00:00', '2018-12-31 10:00:00',
+                                                  '2018-12-30 10:00:00', '2016-01-03 12:00:00']})
+    # weeks 2015-53, 2016-53 and 2016-01; weeks 2018-01 (twice) and 2018-52; week 2016-53; none
+    counts = pd.DataFrame({'usage_weekly_count': [3, 2, 1, 0], 'usage_weekly_mean': [1, 1.5, 1, np.nan],
+                           'StudentId': [1, 2, 3, 4]})
+    return student, sessions, counts
+
+
+def check_equivalence(n_students=2000, sessions_per_student=5):
+    """ The equivalence test of get_usage_weekly: it must match the legacy
+        implementation on the ISO year boundaries and on random sessions.
+    """
+    student, sessions, counts = boundary_sessions()
+    pd.testing.assert_frame_equal(legacy_get_usage_weekly(student, sessions), counts, check_dtype=False)
+    pd.testing.assert_frame_equal(get_usage_weekly(student, sessions), counts, check_dtype=False)
+
+    student, sessions = make_sessions(n_students, sessions_per_student, seed=1)
+    expected = legacy_get_usage_weekly(student, sessions)
+    result = get_usage_weekly(student, sessions)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    print(f'vectorized output matches the legacy implementation on the ISO year boundaries and {n_students} '
+          f'students')
+
+
+@click.command()
+@click.option('--sizes', default='10000,100000,1000000', help='Comma separated student counts.')
+@click.option('--sessions-per-student', default=5)
+@click.option('--legacy-max', default=10000, help='Largest size also timed with the legacy implementation.')
+def main(sizes, sessions_per_student, legacy_max):
+    """ Checks get_usage_weekly against the legacy implementation and times
+        both as the number of students grows.
+    """
+    check_equivalence()
+    print(f"{'students':>10}{'sessions':>12}{'vectorized s':>14}{'legacy s':>12}")
+    for n in [int(size) for size in sizes.split(',')]:
+        student, sessions = make_sessions(n, sessions_per_student)
+        start = time.perf_counter()
+        get_usage_weekly(student, sessions)
+        vectorized = time.perf_counter() - start
+        legacy = float('nan')
+        if n <= legacy_max:
+            start = time.perf_counter()
+            legacy_get_usage_weekly(student, sessions)
+            legacy = time.perf_counter() - start
+        print(f"{n:>10}{len(sessions):>12}{vectorized:>14.3f}{legacy:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data.catalog import load
+from src.data.storage import FORMATS, read_dataset
+from src.features.windows import LAST_ACTIVITY, WINDOW_EVENTS, WINDOWS, load_window_indexes, window_features
+
+
+def groupby_windows(student_ids, events, max_time, windows):
+    """ The reference: one filter and groupby per table and window. """
+    max_time = pd.Timestamp(max_time)
+    columns, last = {}, []
+    for table, (time_column, prefix) in WINDOW_EVENTS.items():
+        df = events[table].dropna()
+        df = df.loc[df[time_column] <= max_time]
+        for window in windows:
+            recent = df.loc[df[time_column] > max_time - pd.Timedelta(days=window)]
+            counts = recent.groupby('StudentId').size().reindex(student_ids, fill_value=0)
+            columns[f'{prefix}_count_{window}d'] = counts.values.astype(np.int32)
+        last.append(df.groupby('StudentId')[time_column].max().reindex(student_ids))
+    last = pd.concat(last, axis=1).max(axis=1)
+    columns[LAST_ACTIVITY] = (max_time - last).dt.days.fillna(0).values.astype(np.int32)
+    return pd.DataFrame(columns)
+
+
+def timed(func, *args, repeat=3):
+    """ Result and best wall time of `repeat` calls. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+def main(output_filepath, storage_format):
+    """ Checks the window features against per-window groupbys and times
+        both with the default windows and with four times as many.
+    """
+    student_ids = read_dataset(output_filepath, 'students', columns=['Id'], fmt=storage_format).Id.dropna().unique()
+    max_time = read_dataset(output_filepath, 'sessions_agg', columns=['last_session'],
+                            fmt=storage_format).last_session.max()
+    events = {table: load(output_filepath, table, columns=['StudentId', time_column], fmt=storage_format)
+              for table, (time_column, _) in WINDOW_EVENTS.items()}
+    indexes = load_window_indexes(output_filepath, storage_format)
+    rows = sum(len(df) for df in events.values())
+    for windows in [WINDOWS, tuple(range(3, 3 * 4 * len(WINDOWS) + 1, 3))]:
+        expected, groupby_time = timed(groupby_windows, student_ids, events, max_time, windows)
+        result, search_time = timed(window_features, student_ids, indexes, max_time, windows)
+        pd.testing.assert_frame_equal(result, expected[result.columns])
+        print(f'{len(windows):>3} windows over {rows} events: groupby {groupby_time:.2f}s, '
+              f'binary search {search_time:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+import click
+import numpy as np
+
+from src.data.storage import FORMATS, read_dataset
+
+
+async def request(reader, writer, host, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, student_ids, latencies):
+    """ One keep-alive connection sending its requests one after another. """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for student_id in student_ids:
+            start = time.perf_counter()
+            status, payload = await request(reader, writer, host, f'/segment/{student_id}')
+            latencies.append(time.perf_counter() - start)
+            assert status == 200, payload
+    finally:
+        writer.close()
+
+
+async def run(host, port, student_ids, concurrency):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, ids, latencies) for ids in np.array_split(student_ids, concurrency)])
+    elapsed = time.perf_counter() - start
+    reader, writer = await asyncio.open_connection(host, port)
+    _, metrics = await request(reader, writer, host, '/metrics')
+    writer.close()
+    return np.array(latencies) * 1000, elapsed, metrics
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--requests', 'n_requests', default=20000)
+@click.option('--concurrency', default=64, help='Concurrent connections.')
+def main(output_filepath, storage_format, host, port, n_requests, concurrency):
+    """ Sends segment requests for random students of the ABT to a running
+        `src/models/serve_model.py` and reports the client latency, the
+        throughput and the server metrics.
+    """
+    ids = read_dataset(output_filepath, 'abt_segmentation', columns=['Id'], fmt=storage_format).Id.to_numpy()
+    student_ids = np.random.default_rng(0).choice(ids, n_requests)
+    latencies, elapsed, metrics = asyncio.run(run(host, port, student_ids, concurrency))
+    print(f'{n_requests} requests on {concurrency} connections in {elapsed:.2f}s '
+          f'({n_requests / elapsed:.0f} requests/s)')
+    print(f'client latency p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms')
+    print(f'server metrics {json.dumps(metrics)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+
+
+AGGREGATES = ['count', 'size', 'nunique', 'sum', 'min', 'max', 'first', 'last']
+
+# Per-student aggregates written by `create_database_agg`. Each entry names
+# its source table, the group key and the output columns as
+# `name: (source column, aggregate)`.
+AGGREGATIONS = {
+    'fileViews_agg': {
+        'source': 'fileViews',
+        'key': ['StudentId'],
+        'aggregates': {'fileview_count': ('FileName', 'count')},
+    },
+    'cancellations_agg': {
+        'source': 'premium_cancellations',
+        'key': ['StudentId'],
+        'aggregates': {'cancelation_count': ('CancellationDate', 'count')},
+    },
+    'payments_agg': {
+        'source': 'premium_payments',
+        'key': ['StudentId', 'PlanType'],
+        'aggregates': {'payment_count': ('PaymentDate', 'count')},
+    },
+    'questions_agg': {
+        'source': 'questions',
+        'key': ['StudentId'],
+        'aggregates': {'question_count': ('QuestionDate', 'count')},
+    },
+    'sessions_agg': {
+        'source': 'sessions',
+        'key': ['StudentId'],
+        'aggregates': {'session_count': ('SessionStartTime', 'count'),
+                       'first_session': ('SessionStartTime', 'min'),
+                       'last_session': ('SessionStartTime', 'max')},
+    },
+    'subjects_agg': {
+        'source': 'subjects',
+        'key': ['StudentId'],
+        'aggregates': {'subject_count': ('SubjectName', 'count')},
+    },
+}
+
+
+def source_columns(source, aggregations=AGGREGATIONS):
+    """ Columns of `source` referenced by the aggregations reading it. """
+    columns = []
+    for spec in aggregations.values():
+        if spec['source'] != source:
+            continue
+        for column in spec['key'] + [column for column, _ in spec['aggregates'].values()]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def aggregate(df, spec):
+    """ Computes every aggregate of `spec` over `df` in one grouped pass. """
+    named = {}
+    for name, (column, func) in spec['aggregates'].items():
+        if func not in AGGREGATES:
+            raise ValueError(f"unknown aggregate '{func}' for '{name}', expected one of {AGGREGATES}")
+        named[name] = pd.NamedAgg(column=column, aggfunc=func)
+    return df.groupby(spec['key']).agg(**named).reset_index()
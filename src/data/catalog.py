@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from src.data.schema import SCHEMAS, memory_usage
+from src.data.storage import FORMATS, apply_filters, dataset_path, read_dataset
+
+# bytes of loaded frames each catalog keeps
+MEMORY_BUDGET = 2 ** 30
+
+logger = logging.getLogger(__name__)
+
+# shared catalog of each (output_filepath, fmt) in this process
+_catalogs = {}
+
+
+def _freeze(filters):
+    """ Hashable form of `filters`, the values of 'in' sorted. """
+    if not filters:
+        return ()
+    frozen = []
+    for column, op, value in filters:
+        if op == 'in':
+            try:
+                value = tuple(sorted(set(value)))
+            except TypeError:
+                value = tuple(value)
+        frozen.append((column, op, value))
+    return tuple(frozen)
+
+
+class Catalog:
+    """ Lazy loads of the processed datasets of `output_filepath`, memoized
+        in memory.
+
+        `load` reads only the requested columns and rows, pushing them down
+        to the reader, and keeps the result. A later load of the same
+        dataset is served from memory when a kept frame has every column it
+        needs and either the same filters or none; a rewritten file
+        invalidates its frames. Least recently used frames are dropped once
+        they hold more than `memory_budget` bytes.
+    """
+
+    def __init__(self, output_filepath, fmt='csv', memory_budget=MEMORY_BUDGET):
+        self.output_filepath = output_filepath
+        self.fmt = fmt
+        self.memory_budget = memory_budget
+        self.frames = OrderedDict()  # (name, columns, filters) -> (file version, frame, bytes)
+        self.nbytes = 0
+        self.hits = self.misses = 0
+
+    def datasets(self):
+        """ Known datasets that exist in `output_filepath`. """
+        return [name for name in SCHEMAS if os.path.exists(dataset_path(self.output_filepath, name, self.fmt))]
+
+    def _version(self, name):
+        stat = os.stat(dataset_path(self.output_filepath, name, self.fmt))
+        return stat.st_mtime_ns, stat.st_size
+
+    def _lookup(self, name, columns, filters, version):
+        """ Kept frame answering the load, projected and filtered. """
+        for key, (kept_version, df, _) in list(self.frames.items()):
+            if key[0] != name:
+                continue
+            if kept_version != version:
+                self._drop(key)
+                continue
+            kept_columns, kept_filters = key[1:]
+            if kept_filters not in (filters, ()):
+                continue
+            # filtering a kept frame in memory needs the filtered columns too
+            refilter = filters and kept_filters != filters
+            needed = None if columns is None else set(columns) | {c for c, _, _ in filters if refilter}
+            if kept_columns is not None and (needed is None or not needed <= set(kept_columns)):
+                continue
+            self.frames.move_to_end(key)
+            if refilter:
+                df = apply_filters(df, filters)
+                # as read_dataset: parquet numbers the filtered rows afresh, csv keeps their positions
+                if self.fmt != 'csv':
+                    df = df.reset_index(drop=True)
+            return df if columns is None else df[list(columns)]
+        return None
+
+    def _drop(self, key):
+        self.nbytes -= self.frames.pop(key)[2]
+
+    def load(self, name, columns=None, filters=None):
+        """ The `name` dataset, only `columns` and the rows matching
+            `filters` (see `read_dataset`). The frame is a shallow copy of
+            the kept one; with copy-on-write, changing it leaves the kept
+            frame as it was.
+        """
+        if name not in SCHEMAS:
+            raise KeyError(f'unknown dataset {name!r}, the catalog knows {sorted(SCHEMAS)}')
+        columns = None if columns is None else tuple(columns)
+        filters = _freeze(filters)
+        version = self._version(name)
+        df = self._lookup(name, columns, filters, version)
+        if df is not None:
+            self.hits += 1
+            return df.copy(deep=False)
+
+        self.misses += 1
+        df = read_dataset(self.output_filepath, name, columns=None if columns is None else list(columns),
+                          filters=list(filters) or None, fmt=self.fmt)
+        nbytes = memory_usage(df)
+        if nbytes <= self.memory_budget:
+            self.frames[(name, columns, filters)] = (version, df, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.memory_budget:
+                self._drop(next(iter(self.frames)))
+        else:
+            logger.debug(f'{name}: {nbytes} bytes exceed the memory budget, not kept')
+        return df.copy(deep=False)
+
+    def clear(self):
+        self.frames.clear()
+        self.nbytes = 0
+
+    def info(self):
+        """ The kept frames, most recently used last. """
+        return pd.DataFrame([{'dataset': name, 'columns': 'all' if columns is None else ', '.join(columns),
+                              'filters': len(filters), 'rows': len(df), 'mb': nbytes / 2 ** 20}
+                             for (name, columns, filters), (_, df, nbytes) in self.frames.items()],
+                            columns=['dataset', 'columns', 'filters', 'rows', 'mb'])
+
+
+def get_catalog(output_filepath, fmt='csv', memory_budget=None):
+    """ The catalog of `output_filepath` shared by every caller in this
+        process; `memory_budget` replaces its budget when given.
+    """
+    key = (os.path.abspath(output_filepath), fmt)
+    if key not in _catalogs:
+        _catalogs[key] = Catalog(output_filepath, fmt)
+    if memory_budget is not None:
+        _catalogs[key].memory_budget = memory_budget
+    return _catalogs[key]
+
+
+def load(output_filepath, name, columns=None, filters=None, fmt='csv'):
+    """ `Catalog.load` on the shared catalog of `output_filepath`. """
+    return get_catalog(output_filepath, fmt).load(name, columns, filters)
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+def main(output_filepath, storage_format):
+    """ Lists the processed datasets the catalog can load and their columns. """
+    catalog = get_catalog(output_filepath, storage_format)
+    for name in catalog.datasets():
+        print(f'{name}: {", ".join(SCHEMAS[name])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import click
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from src.data.incremental import EVENT_TIME
+from src.data.storage import FORMATS, dataset_path, read_dataset
+from src.instrumentation import instrumented
+
+INDEX_DIR = 'event_index'
+INDEXED_TABLES = ['sessions', 'fileViews', 'questions']
+ARRAYS = ['student_ids', 'offsets', 'times', 'rows']
+# int64 of NaT
+NAT = np.iinfo(np.int64).min
+
+logger = logging.getLogger(__name__)
+
+
+def index_path(output_filepath, table):
+    return f'{output_filepath}/{INDEX_DIR}/{table}'
+
+
+def source_version(output_filepath, table, fmt='csv'):
+    """ mtime and size of the indexed dataset, to tell a stale index. """
+    stat = os.stat(dataset_path(output_filepath, table, fmt))
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+@instrumented
+def build_event_index(output_filepath, table, fmt='csv'):
+    """ Writes the events of `table` in CSR layout, one .npy file per array
+        so they can be memory mapped: the sorted `student_ids`, the
+        `offsets` of each student's events (n + 1 of them), the event
+        `times` as int64 nanoseconds sorted by student then time, and the
+        `rows` of the dataset they come from. Events without a StudentId
+        are left out. Returns the index directory.
+    """
+    time_column = EVENT_TIME[table]
+    df = read_dataset(output_filepath, table, columns=['StudentId', time_column], fmt=fmt)
+    ids = df.StudentId.to_numpy(dtype=np.int64, na_value=-1)
+    times = df[time_column].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    rows = np.flatnonzero(ids >= 0)
+    rows = rows[np.lexsort((times[rows], ids[rows]))]
+    student_ids, starts = np.unique(ids[rows], return_index=True)
+    arrays = {'student_ids': student_ids, 'offsets': np.append(starts, len(rows)).astype(np.int64),
+              'times': times[rows], 'rows': rows.astype(np.int64)}
+
+    path = index_path(output_filepath, table)
+    tmp = f'{path}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ARRAYS:
+        np.save(f'{tmp}/{name}.npy', arrays[name])
+    with open(f'{tmp}/meta.json', 'w') as f:
+        json.dump({'table': table, 'time_column': time_column, 'fmt': fmt, 'students': len(student_ids),
+                   'events': len(rows), 'source': source_version(output_filepath, table, fmt)}, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    return path
+
+
+def load_event_index(output_filepath, table, fmt='csv', mmap_mode='r'):
+    """ The event index of `table`, built first when missing or older than
+        the dataset.
+    """
+    path = index_path(output_filepath, table)
+    try:
+        with open(f'{path}/meta.json') as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = {}
+    if meta.get('fmt') != fmt or meta.get('source') != source_version(output_filepath, table, fmt):
+        build_event_index(output_filepath, table, fmt)
+    return EventIndex(path, mmap_mode)
+
+
+class EventIndex:
+    """ The events of one table grouped by student in CSR layout.
+
+        The events of the i-th student of `student_ids` are positions
+        offsets[i]:offsets[i + 1] of `times` and `rows`, sorted by time, so
+        a student's events are an O(1) slice and per-student reductions are
+        one ufunc.reduceat over the events.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(f'{path}/meta.json') as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(f'{path}/{name}.npy', mmap_mode=mmap_mode))
+        self._keys = None
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def position(self, student_id):
+        """ Position of a student in `student_ids`, None when it has no events. """
+        i = np.searchsorted(self.student_ids, student_id)
+        return i if i < len(self.student_ids) and self.student_ids[i] == student_id else None
+
+    def slice(self, student_id):
+        """ Positions of the events of a student, an empty slice without any. """
+        i = self.position(student_id)
+        return slice(0, 0) if i is None else slice(self.offsets[i], self.offsets[i + 1])
+
+    def events(self, student_id):
+        """ Event times of a student, as datetime64[ns]. """
+        return np.asarray(self.times[self.slice(student_id)]).view('datetime64[ns]')
+
+    def counts(self):
+        """ Events per student. """
+        return np.diff(self.offsets)
+
+    def reduce(self, values, ufunc=np.add, empty=0):
+        """ `ufunc` reduction of the per-event `values` of every student;
+            students without events get `empty`.
+        """
+        counts = self.counts()
+        starts = np.minimum(self.offsets[:-1], max(len(values) - 1, 0))
+        if not len(values):
+            return np.full(len(counts), empty)
+        reduced = ufunc.reduceat(np.asarray(values), starts)
+        return np.where(counts > 0, reduced, empty)
+
+    def first_time(self):
+        """ Time of the first event of every student, NAT without one. """
+        return self.reduce(self.times, np.minimum, NAT)
+
+    def last_time(self):
+        """ Time of the last event of every student, NAT without one. """
+        return self.reduce(self.times, np.maximum, NAT)
+
+    def distinct(self, values):
+        """ Distinct `values` of every student, for values that are sorted
+            within each student like a floor of the event time.
+        """
+        values = np.asarray(values)
+        changed = np.ones(len(values), dtype=np.int64)
+        changed[1:] = values[1:] != values[:-1]
+        # each student's first event starts a new value
+        changed[self.offsets[:-1][self.counts() > 0]] = 1
+        return self.reduce(changed)
+
+    def keys(self):
+        """ student position * (events + 1) + time rank of every event, the
+            rank being the number of events strictly earlier. They are in
+            CSR order and sorted, so the events of every student after a
+            time are found with one binary search per student.
+        """
+        if self._keys is None:
+            order = np.argsort(self.times)
+            self._sorted_times = np.asarray(self.times)[order]
+            # equal times share the rank of the first of them
+            first = np.r_[True, self._sorted_times[1:] != self._sorted_times[:-1]]
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+            self._stride = len(order) + 1
+            self._keys = np.repeat(np.arange(len(self), dtype=np.int64) * self._stride, self.counts()) + ranks
+        return self._keys
+
+    def after(self, time):
+        """ Position of the first event of every student after `time` (ns),
+            its offsets[i + 1] when there is none.
+        """
+        keys = self.keys()
+        starts = np.arange(len(self), dtype=np.int64) * self._stride
+        return np.searchsorted(keys, starts + np.searchsorted(self._sorted_times, time, side='right'))
+
+    def count_between(self, start, end):
+        """ Events of every student in (start, end]. """
+        return self.after(end) - self.after(start)
+
+    def last_before(self, end):
+        """ Time of the last event at or before `end` of every student, NAT
+            without one.
+        """
+        last = self.after(end) - 1
+        own = last >= self.offsets[:-1]
+        return np.where(own, np.asarray(self.times)[np.maximum(last, 0)] if len(self.times) else NAT, NAT)
+
+    def align(self, values, student_ids, fill=0):
+        """ Per-student `values` of this index reordered to `student_ids`,
+            `fill` for the students without events.
+        """
+        positions = np.minimum(np.searchsorted(self.student_ids, student_ids), max(len(self) - 1, 0))
+        found = (self.student_ids[positions] == student_ids) if len(self) else np.zeros(len(student_ids), bool)
+        return np.where(found, np.asarray(values)[positions] if len(self) else fill, fill)
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--table', 'tables', type=click.Choice(list(EVENT_TIME)), multiple=True, default=INDEXED_TABLES)
+def main(output_filepath, storage_format, tables):
+    """ Builds the per-student event index of the event tables. """
+    for table in tables:
+        index = EventIndex(build_event_index(output_filepath, table, storage_format))
+        print(f'{table}: {index.meta["events"]} events of {index.meta["students"]} students')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data.make_dataset import BASE_B_FILES
+
+# rows of each export in the real dataset, the 1x scale
+BASE_ROWS = {'students': 60000, 'premium_students': 6260, 'fileViews': 3028988, 'sessions': 1399062,
+             'subjects': 315766, 'premium_payments': 7276, 'questions': 3906, 'premium_cancellations': 844}
+CHUNK_ROWS = 1000000
+START = np.datetime64('2012-05-29', 'us')
+END = np.datetime64('2018-06-08', 'us')
+# registrations stop before the last sessions, so every registered_time is positive
+REGISTRATION_END = np.datetime64('2018-05-31', 'us')
+# events start with the exports the notebooks explored
+EVENTS_START = np.datetime64('2016-01-01', 'us')
+
+UNIVERSITIES = ['PUC-RIO', 'UFF', 'UNB', 'UERJ', 'UFU', 'USP', 'UFRJ', 'UFMG', 'UNICAMP', 'UFPR', 'UFBA', 'UFRGS']
+COURSES = ['Administração', 'Direito', 'Medicina', 'Engenharia Civil', 'Engenharia de Produção',
+           'Ciências Contábeis', 'Psicologia', 'Arquitetura e Urbanismo', 'Economia',
+           'Direito do Trabalho e Segurança Social']
+CAPITALS = {'Acre': 'Rio Branco', 'Amapa': 'Macapá', 'Amazonas': 'Manaus', 'Pará': 'Belém',
+            'Rondonia': 'Porto Velho', 'Roraima': 'Boa Vista', 'Tocantins': 'Palmas', 'Alagoas': 'Maceió',
+            'Bahia': 'Salvador', 'Ceara': 'Fortaleza', 'Maranhão': 'São Luís', 'Paraíba': 'João Pessoa',
+            'Pernambuco': 'Recife', 'Piauí': 'Teresina', 'Rio Grande do Norte': 'Natal', 'Sergipe': 'Aracaju',
+            'Goias': 'Goiânia', 'Mato Grosso': 'Cuiabá', 'Mato Grosso do Sul': 'Campo Grande',
+            'Distrito Federal': 'Brasília', 'Rio Grande do Sul': 'Porto Alegre', 'Santa Catarina': 'Florianópolis',
+            'Paraná': 'Curitiba', 'Espirito Santo': 'Vitória', 'Minas Gerais': 'Belo Horizonte',
+            'Rio de Janeiro': 'Rio de Janeiro', 'São Paulo': 'São Paulo'}
+# most populous first, as they are drawn with Zipf weights
+STATES = ['São Paulo', 'Minas Gerais', 'Rio de Janeiro', 'Bahia', 'Paraná', 'Rio Grande do Sul', 'Pernambuco',
+          'Ceara', 'Pará', 'Santa Catarina', 'Maranhão', 'Goias', 'Amazonas', 'Espirito Santo', 'Paraíba',
+          'Rio Grande do Norte', 'Mato Grosso', 'Alagoas', 'Piauí', 'Distrito Federal', 'Mato Grosso do Sul',
+          'Sergipe', 'Rondonia', 'Tocantins', 'Acre', 'Amapa', 'Roraima']
+SIGNUP_SOURCES = ['Email', 'Facebook', 'Google']
+# clients as the exports write them: 'Website', 'Android | version | sdk NN' or 'iOS | version'
+CLIENTS = ['Website', 'Android | 7.0 | sdk 24', 'Android | 6.0.1 | sdk 23', 'Android | 5.0.2 | sdk 21',
+           'iOS | 11.2.5', 'iOS | 10.2.1']
+CLIENT_WEIGHTS = [0.6, 0.12, 0.1, 0.06, 0.07, 0.05]
+FILE_NAMES = ['CALCULO I', 'Exercicios Resolvidos do Halliday sobre Rotação', 'Resumo de Direito Civil',
+              'Lista de Exercícios de Estatística', 'Apostila de Contabilidade', 'Anatomia Humana']
+SUBJECTS = ['Cálculo I', 'Pesquisa Operacional', 'Introdução à Administração', 'Disciplina Integradora II',
+            'Contabilidade Aplicada à Administração', 'Física I', 'Direito Constitucional']
+QUESTIONS = ['O que é mais importante para um projeto: escopo ou prazo?', 'Como calcular o limite?',
+             'Custos com consultoria para planejar um projeto', 'Qual a diferença entre dolo e culpa?']
+
+logger = logging.getLogger(__name__)
+
+
+def zipf_weights(n, exponent=1.0):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def format_times(times, unit='us'):
+    """ Times formatted like the exports, '2017-02-23 10:46:03.047000', or
+        to the second with unit='s'.
+    """
+    return pd.Series(np.datetime_as_string(times, unit=unit)).str.replace('T', ' ', regex=False).values
+
+
+def timestamps(start, end, rng, unit='us'):
+    """ Uniform times between `start` and `end`, formatted. """
+    span = (end - start).astype(np.int64)
+    return format_times(start + (rng.random(len(span)) * span).astype('timedelta64[us]'), unit)
+
+
+def write_json_array(path, chunks):
+    """ Writes the records of the frames `chunks` as one JSON array, one
+        chunk in memory at a time. Returns the number of records.
+    """
+    rows = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for df in chunks:
+            if len(df):
+                f.write(',' if rows else '')
+                f.write(df.to_json(orient='records', force_ascii=False)[1:-1])
+                rows += len(df)
+        f.write(']')
+    return rows
+
+
+def chunk_sizes(n):
+    return [min(CHUNK_ROWS, n - start) for start in range(0, n, CHUNK_ROWS)]
+
+
+class Population:
+    """ The students of a generated dataset: their ids, registration and
+        subscription dates and how active they are.
+
+        Activity is log-normal, so few students produce most of the events
+        as in the real exports; the premium students are a random subset.
+    """
+
+    def __init__(self, n_students, n_premium, rng):
+        self.ids = 1000 + rng.choice(99999000, n_students, replace=False)
+        self.registered = START + (rng.random(n_students) * (REGISTRATION_END - START).astype(np.int64)).astype('timedelta64[us]')
+        activity = rng.lognormal(0, 1.5, n_students)
+        self.cumulative = np.cumsum(activity / activity.sum())
+        self.premium = rng.choice(n_students, min(n_premium, n_students), replace=False)
+        wait = rng.exponential(30 * 86400e6, len(self.premium)).astype('timedelta64[us]')
+        self.subscribed = np.minimum(self.registered[self.premium] + wait, END)
+
+    def sample(self, n, rng):
+        """ Positions of the students of `n` events, by activity. """
+        return np.minimum(np.searchsorted(self.cumulative, rng.random(n)), len(self.ids) - 1)
+
+    def sample_premium(self, n, rng):
+        """ Positions among the premium students of `n` events. """
+        return rng.integers(0, len(self.premium), n)
+
+    def event_start(self, students):
+        return np.maximum(self.registered[students], EVENTS_START)
+
+
+def students(population, rng):
+    n = len(population.ids)
+    for start, size in zip(range(0, n, CHUNK_ROWS), chunk_sizes(n)):
+        rows = slice(start, start + size)
+        state = np.array(STATES, dtype=object)[rng.choice(len(STATES), size, p=zipf_weights(len(STATES), 0.8))]
+        state[rng.random(size) < 0.1] = None
+        city = np.array([CAPITALS.get(value) for value in state], dtype=object)
+        city[rng.random(size) < 0.3] = None
+        client = np.where(rng.random(size) < 0.2, 'Website', None)
+        yield pd.DataFrame({'Id': population.ids[rows],
+                            'RegisteredDate': format_times(population.registered[rows]),
+                            'UniversityName': rng.choice(UNIVERSITIES, size, p=zipf_weights(len(UNIVERSITIES))),
+                            'CourseName': rng.choice(COURSES, size, p=zipf_weights(len(COURSES))),
+                            'State': state, 'SignupSource': rng.choice(SIGNUP_SOURCES, size), 'City': city,
+                            'StudentClient': client})
+
+
+def premium_students(population):
+    premium = population.premium
+    yield pd.DataFrame({'StudentId': population.ids[premium],
+                        'RegisteredDate': format_times(population.registered[premium]),
+                        'SubscriptionDate': format_times(population.subscribed)})
+
+
+def events(population, n, rng, date_column, columns, unit='us'):
+    """ Chunks of `n` events of the students by activity, with their dates
+        between each student's registration and the end of the exports and
+        the columns returned by `columns(size)`.
+    """
+    for size in chunk_sizes(n):
+        students = population.sample(size, rng)
+        df = pd.DataFrame({'StudentId': population.ids[students]})
+        df[date_column] = timestamps(population.event_start(students), np.full(size, END), rng, unit)
+        for column, values in columns(size).items():
+            df[column] = values
+        yield df
+
+
+def premium_events(population, n, rng, date_column, columns):
+    """ Chunks of `n` events of the premium students, after their
+        subscription.
+    """
+    for size in chunk_sizes(n):
+        premium = population.sample_premium(size, rng)
+        df = pd.DataFrame({'StudentId': population.ids[population.premium[premium]]})
+        df[date_column] = timestamps(population.subscribed[premium], np.full(size, END), rng)
+        for column, values in columns(size).items():
+            df[column] = values
+        yield df
+
+
+def generate(output_filepath, scale=1.0, seed=0):
+    """ Writes the BASE A and BASE B JSON exports of a synthetic dataset
+        `scale` times the size of the real one. Returns the records written
+        per export.
+    """
+    rows = {name: max(1, round(base * scale)) for name, base in BASE_ROWS.items()}
+    rngs = {name: np.random.default_rng([seed, i]) for i, name in enumerate(['population'] + list(BASE_ROWS))}
+    population = Population(rows['students'], rows['premium_students'], rngs['population'])
+
+    tables = {
+        'students': lambda: students(population, rngs['students']),
+        'premium_students': lambda: premium_students(population),
+        'fileViews': lambda: events(population, rows['fileViews'], rngs['fileViews'], 'ViewDate', lambda size: {
+            'FileName': rngs['fileViews'].choice(FILE_NAMES, size, p=zipf_weights(len(FILE_NAMES))),
+            'Studentclient': rngs['fileViews'].choice(CLIENTS, size, p=CLIENT_WEIGHTS)}),
+        'sessions': lambda: events(population, rows['sessions'], rngs['sessions'], 'SessionStartTime', lambda size: {
+            'StudentClient': rngs['sessions'].choice(CLIENTS, size, p=CLIENT_WEIGHTS)}, unit='s'),
+        'subjects': lambda: events(population, rows['subjects'], rngs['subjects'], 'FollowDate', lambda size: {
+            'SubjectName': rngs['subjects'].choice(SUBJECTS, size)}),
+        'questions': lambda: events(population, rows['questions'], rngs['questions'], 'QuestionDate', lambda size: {
+            'QuestionSnippet': rngs['questions'].choice(QUESTIONS, size), 'StudentClient': None}),
+        'premium_payments': lambda: premium_events(
+            population, rows['premium_payments'], rngs['premium_payments'], 'PaymentDate',
+            lambda size: {'PlanType': rngs['premium_payments'].choice(['Mensal', 'Anual'], size, p=[0.85, 0.15])}),
+        'premium_cancellations': lambda: premium_events(
+            population, rows['premium_cancellations'], rngs['premium_cancellations'], 'CancellationDate',
+            lambda size: {}),
+    }
+
+    os.makedirs(f'{output_filepath}/BASE A', exist_ok=True)
+    os.makedirs(f'{output_filepath}/BASE B', exist_ok=True)
+    written = {}
+    for name, chunks in tables.items():
+        base = 'BASE B' if name in BASE_B_FILES else 'BASE A'
+        written[name] = write_json_array(f'{output_filepath}/{base}/{name}.json', chunks())
+        logger.info(f'{name}: {written[name]} records')
+    return written
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path())
+@click.option('--scale', type=click.FloatRange(min=0, max=100, min_open=True), default=1.0,
+              help='Size relative to the real dataset (60k students, 3M file views).')
+@click.option('--seed', default=0)
+def main(output_filepath, scale, seed):
+    """ Generates synthetic BASE A and BASE B JSON exports in
+        OUTPUT_FILEPATH (e.g. data/raw).
+    """
+    generate(output_filepath, scale, seed)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pandas as pd
+
+from src.data.storage import read_dataset
+
+
+# append-only event tables and their event-time column
+EVENT_TIME = {'fileViews': 'ViewDate',
+              'premium_cancellations': 'CancellationDate',
+              'premium_payments': 'PaymentDate',
+              'questions': 'QuestionDate',
+              'sessions': 'SessionStartTime'}
+
+# how stored and partial results of an aggregate are combined
+MERGES = {'count': 'sum', 'size': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+STATE_FILE = 'incremental_state.json'
+AFFECTED_STUDENTS = 'affected_students'
+
+
+def load_state(output_filepath):
+    """ Watermarks of the last run plus whether the ABT needs a full rebuild;
+        empty when no aggregates were built yet.
+    """
+    path = f'{output_filepath}/{STATE_FILE}'
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(output_filepath, state):
+    path = f'{output_filepath}/{STATE_FILE}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def event_times(df, table):
+    return pd.to_datetime(df[EVENT_TIME[table]], errors='coerce', format='ISO8601')
+
+
+def row_hashes(df):
+    """ Hash of every row of `df`, equal for rows with equal values. """
+    return pd.util.hash_pandas_object(df, index=False)
+
+
+def hash_counts(hashes):
+    """ Occurrences of each row hash, keyed by the hash as a string for JSON. """
+    return {str(key): int(count) for key, count in hashes.value_counts().items()}
+
+
+def add_counts(counts, other):
+    """ Occurrences of the row hashes of two `hash_counts`. """
+    counts = dict(counts)
+    for key, count in other.items():
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def event_mark(df, table):
+    """ Watermark of `df`: its latest event time as an ISO string, with the
+        `hash_counts` of the rows at that time ('at') and of the rows without
+        a valid event time ('missing'), so a later run can tell which of
+        those rows it already folded in.
+    """
+    times = event_times(df, table)
+    latest = times.max()
+    hashes = row_hashes(df)
+    return {'watermark': None if pd.isna(latest) else latest.isoformat(),
+            'at': hash_counts(hashes[(times == latest).values]),
+            'missing': hash_counts(hashes[times.isna().values])}
+
+
+def merge_marks(mark, other):
+    """ Watermark of the rows of two marks together. """
+    if mark is None or other is None:
+        return other if mark is None else mark
+    missing = add_counts(mark['missing'], other['missing'])
+    if mark['watermark'] == other['watermark']:
+        return {'watermark': mark['watermark'], 'at': add_counts(mark['at'], other['at']), 'missing': missing}
+    latest = max([mark, other], key=lambda m: pd.Timestamp(m['watermark']) if m['watermark'] else pd.Timestamp.min)
+    return {'watermark': latest['watermark'], 'at': latest['at'], 'missing': missing}
+
+
+def read_new_events(output_filepath, table, mark, columns, fmt='csv'):
+    """ Rows of an event table not folded into the aggregates yet (every row
+        when there is no `mark`), with `columns` plus the event-time column.
+
+        Rows after the watermark are new. Rows at the watermark time or
+        without a valid event time are new unless the `mark` recorded them:
+        of n equal such rows, the mark's count of them are skipped.
+    """
+    time_column = EVENT_TIME[table]
+    read_columns = columns if time_column in columns else columns + [time_column]
+    df = read_dataset(output_filepath, table, columns=read_columns, fmt=fmt)[read_columns]
+    if mark is None:
+        return df
+    times = event_times(df, table)
+    boundary = times.isna()
+    if mark['watermark'] is not None:
+        since = pd.Timestamp(mark['watermark'])
+        boundary |= times == since
+        keep = boundary | (times > since)
+        df, boundary = df.loc[keep], boundary.loc[keep]
+    recorded = add_counts(mark['at'], mark['missing'])
+    recorded = pd.Series(list(recorded.values()), index=pd.Index([int(key) for key in recorded], dtype='uint64'),
+                         dtype='int64')
+    hashes = row_hashes(df.loc[boundary])
+    seen = hashes.groupby(hashes).cumcount() < hashes.map(recorded).fillna(0)
+    return df.drop(seen.index[seen.values])
+
+
+def merge_aggregates(stored, partial, spec):
+    """ Combines a stored aggregate with the aggregate of newer events. """
+    merges = {}
+    for name, (_, func) in spec['aggregates'].items():
+        if func not in MERGES:
+            raise ValueError(f"aggregate '{func}' of '{name}' can not be updated incrementally")
+        merges[name] = MERGES[func]
+    return pd.concat([stored, partial], ignore_index=True).groupby(spec['key']).agg(merges).reset_index()
+
+
+def merge_counts(stored, partial, key, value):
+    """ Adds the `value` counts of two tables keyed by `key`. """
+    return pd.concat([stored, partial], ignore_index=True).groupby(key)[value].sum().reset_index()
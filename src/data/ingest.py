@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from src.data.storage import DatasetWriter, write_dataset
+from src.instrumentation import stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+READ_SIZE = 1 << 20
+# peak memory of loading a JSON export whole, per byte of file
+MEMORY_FACTOR = 10
+# rough size of one raw record, to bound the memory of a batched conversion
+RECORD_BYTES = 512
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def iter_json_records(path, batch_size, read_size=READ_SIZE):
+    """ Yields lists of at most `batch_size` records from a JSON file.
+
+        Both a top level JSON array of records and line-delimited JSON are
+        accepted. The file is decoded incrementally, so memory is bound by
+        `batch_size` (plus one read buffer) and not by the file size.
+    """
+    with open(path, encoding='utf-8') as f:
+        head = f.read(read_size)
+        stripped = head.lstrip()
+        if stripped.startswith('['):
+            records = _iter_array(f, stripped[1:], read_size)
+        else:
+            records = _iter_lines(f, head, read_size)
+
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _iter_array(f, buffer, read_size):
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+        pos = end
+        if pos >= len(buffer) and not eof:
+            buffer = f.read(read_size)
+            eof = not buffer
+            pos = 0
+
+
+def _iter_lines(f, head, read_size):
+    pending = ''
+    chunk = head
+    while chunk:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield loads(line)
+        chunk = f.read(read_size)
+    if pending.strip():
+        yield loads(pending)
+
+
+def read_json_records(json_path):
+    """ A whole JSON array export as a frame, decoded with orjson when it is
+        installed.
+    """
+    if orjson is None:
+        return pd.read_json(json_path)
+    with open(json_path, 'rb') as f:
+        return pd.DataFrame.from_records(orjson.loads(f.read()))
+
+
+def json_keys(json_path, batch_size):
+    """ Keys of the records of a JSON export, in order of first appearance. """
+    keys = {}
+    for batch in iter_json_records(json_path, batch_size):
+        for record in batch:
+            keys.update(dict.fromkeys(record))
+    return list(keys)
+
+
+def convert_json(json_path, output_filepath, name, batch_size=None, fmt='csv'):
+    """ Converts a raw JSON export into the `name` dataset and returns its
+        row count.
+
+        Without `batch_size` the whole file is loaded at once.
+        With it, records are streamed in batches and appended to the output;
+        the columns are those of the first batch, or, when a later batch has
+        keys the first one lacks, every key of the file as in the whole-file
+        conversion. Either way the dataset is written typed by its schema
+        (see src/data/schema.py).
+    """
+    with stage('convert_json', dataset=name):
+        if not batch_size:
+            df = read_json_records(json_path)
+            write_dataset(df, output_filepath, name, fmt)
+            return len(df)
+
+        with DatasetWriter(output_filepath, name, fmt) as writer:
+            for batch in iter_json_records(json_path, batch_size):
+                df = pd.DataFrame.from_records(batch)
+                if writer.columns is not None and not set(df.columns).issubset(writer.columns):
+                    break
+                writer.write(df)
+            else:
+                return writer.rows
+
+        # ragged records: convert again with the keys of the whole file
+        with DatasetWriter(output_filepath, name, fmt, json_keys(json_path, batch_size)) as writer:
+            for batch in iter_json_records(json_path, batch_size):
+                writer.write(pd.DataFrame.from_records(batch))
+        return writer.rows
+
+
+def memory_estimate(json_path, batch_size=None):
+    """ Peak memory (bytes) expected for converting `json_path`. """
+    size = os.path.getsize(json_path)
+    if batch_size:
+        size = min(size, batch_size * RECORD_BYTES)
+    return size * MEMORY_FACTOR
+
+
+def physical_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def timed_convert(json_path, output_filepath, name, batch_size=None, fmt='csv'):
+    start = time.perf_counter()
+    rows = convert_json(json_path, output_filepath, name, batch_size, fmt)
+    return {'file': name, 'records': rows, 'mb': os.path.getsize(json_path) / 2 ** 20,
+            'seconds': time.perf_counter() - start}
+
+
+def convert_files(files, output_filepath, batch_size=None, fmt='csv', workers=1, memory_budget=None):
+    """ Converts the raw `files` ({dataset name: JSON path}) and prints the
+        throughput of each one.
+
+        With more than one worker the files are converted in a process pool,
+        largest first. A file only starts while the estimated memory of the
+        running conversions stays within `memory_budget` bytes (half of the
+        physical memory by default), so the largest files do not run at the
+        same time; a file over the budget runs alone.
+    """
+    if workers <= 1:
+        results = [timed_convert(path, output_filepath, name, batch_size, fmt) for name, path in files.items()]
+        return throughput_report(results)
+
+    if memory_budget is None:
+        memory_budget = physical_memory() // 2
+    estimates = {name: memory_estimate(path, batch_size) for name, path in files.items()}
+    pending = sorted(files, key=estimates.get, reverse=True)
+    running, results = {}, []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            in_use = sum(estimates[name] for name in running.values())
+            for name in list(pending):
+                if len(running) >= workers:
+                    break
+                if running and in_use + estimates[name] > memory_budget:
+                    continue
+                pending.remove(name)
+                future = pool.submit(timed_convert, files[name], output_filepath, name, batch_size, fmt)
+                running[future] = name
+                in_use += estimates[name]
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                del running[future]
+                results.append(future.result())
+    return throughput_report(results)
+
+
+def throughput_report(results):
+    report = pd.DataFrame(results, columns=['file', 'records', 'mb', 'seconds'])
+    report['records_s'] = report.records / report.seconds
+    report['mb_s'] = report.mb / report.seconds
+    print(report.to_string(index=False, float_format=lambda x: f'{x:.2f}'))
+    return report
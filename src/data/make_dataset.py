@@ -5,119 +5,354 @@ from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 import pandas as pd
 
-
+from src.data.aggregate import AGGREGATIONS, aggregate, source_columns
+from src.data.incremental import (AFFECTED_STUDENTS, EVENT_TIME, event_mark, load_state, merge_aggregates,
+                                  merge_counts, merge_marks, read_new_events, save_state)
+from src.data.ingest import convert_files, convert_json
+from src.data.partitioned import map_reduce
+from src.data.storage import FORMATS, dataset_exists, read_dataset, write_dataset
+from src.instrumentation import instrumented, stage
 
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--batch-size', type=click.IntRange(min=1), default=None,
+              help='Stream the raw JSON files in batches of this many records '
+                   'instead of loading each file at once.')
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--incremental', is_flag=True,
+              help='Only aggregate the events the previous run did not see.')
+@click.option('--workers', type=click.IntRange(min=1), default=1,
+              help='Convert the raw files (and aggregate the partitions) in this many processes.')
+@click.option('--memory-budget', type=click.IntRange(min=1), default=None,
+              help='MB the parallel conversions may use together, defaults to half of the physical memory.')
+@click.option('--partition-size', type=click.IntRange(min=1), default=None,
+              help='Aggregate the tables out of core, in partitions of this many rows.')
+def main(input_filepath, output_filepath, batch_size, storage_format, incremental, workers, memory_budget,
+         partition_size):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
-    create_database_A(input_filepath, output_filepath)
-    create_database_B(input_filepath, output_filepath)
-    create_database_agg(input_filepath, output_filepath)
-
-
-def create_database_A(input_filepath, output_filepath):
-    df = pd.read_json(f'{input_filepath}/BASE A/premium_students.json')
-    df.to_csv(f"{output_filepath}/premium_students.csv", index=False)
-
-def create_database_B(input_filepath, output_filepath):
-    files = ['fileViews', 'premium_cancellations', 'premium_payments', 'questions', 'sessions', 'students', 'subjects']
-    for file in files:
-        pd.read_json(f'{input_filepath}/BASE B/{file}.json'). \
-            to_csv(f"{output_filepath}/{file}.csv", index=False)
-
-def create_database_agg(input_filepath, output_filepath):
-    files = ['fileViews',
-             'premium_cancellations',
-             'premium_payments',
-             'questions',
-             'sessions',
-             'students',
-             'subjects'
-             ]
+    convert_files(raw_files(input_filepath), output_filepath, batch_size, storage_format, workers,
+                  memory_budget * 2 ** 20 if memory_budget else None)
+    if incremental:
+        update_database_agg(input_filepath, output_filepath, storage_format)
+    elif partition_size:
+        create_database_agg_partitioned(input_filepath, output_filepath, storage_format, partition_size, workers)
+    else:
+        create_database_agg(input_filepath, output_filepath, storage_format)
+
+
+@instrumented
+def create_database_A(input_filepath, output_filepath, batch_size=None, fmt='csv'):
+    convert_json(f'{input_filepath}/BASE A/premium_students.json',
+                 output_filepath, 'premium_students', batch_size, fmt)
+
+BASE_B_FILES = ['fileViews', 'premium_cancellations', 'premium_payments', 'questions', 'sessions', 'students',
+                'subjects']
+
+
+@instrumented
+def create_database_B(input_filepath, output_filepath, batch_size=None, fmt='csv'):
+    for file in BASE_B_FILES:
+        convert_json(f'{input_filepath}/BASE B/{file}.json',
+                     output_filepath, file, batch_size, fmt)
+
+def raw_files(input_filepath):
+    """ JSON export of each raw dataset, BASE A and BASE B. """
+    files = {'premium_students': f'{input_filepath}/BASE A/premium_students.json'}
+    files.update({file: f'{input_filepath}/BASE B/{file}.json' for file in BASE_B_FILES})
+    return files
+
+# columns read by the helpers that are not driven by AGGREGATIONS
+HELPER_COLUMNS = {'fileViews': ['StudentId', 'Studentclient'],
+                  'sessions': ['StudentId', 'SessionStartTime'],
+                  'students': ['Id']}
+
+
+def _agg_columns(table):
+    columns = source_columns(table)
+    return columns + [column for column in HELPER_COLUMNS.get(table, []) if column not in columns]
+
+def _event_columns(table):
+    """ Columns read from a table: the aggregated ones, then its event time. """
+    columns = _agg_columns(table)
+    if table in EVENT_TIME and EVENT_TIME[table] not in columns:
+        columns.append(EVENT_TIME[table])
+    return columns
+
+@instrumented
+def create_database_agg(input_filepath, output_filepath, fmt='csv'):
+    tables = list(HELPER_COLUMNS) + [spec['source'] for spec in AGGREGATIONS.values()]
 
     datasets = {}
-    for file in files:
-        datasets[file] = pd.read_csv(f"{output_filepath}/{file}.csv")  # ,parse_dates=[1,2],index_col=[0])
-    print('init agg datasets')
-    count_fileview_by_studentId(datasets.get('fileViews')).to_csv(f"{output_filepath}/fileViews_agg.csv", index=False)
-    print('fileViews')
-    count_cancellation(datasets.get('premium_cancellations')).to_csv(f"{output_filepath}/cancellations_agg.csv", index=False)
-    print('premium_cancellations')
-    count_payment(datasets.get('premium_payments')).to_csv(f"{output_filepath}/payments_agg.csv", index=False)
-    print('premium_payments')
-    count_question_by_studentId(datasets.get('questions')).to_csv(f"{output_filepath}/questions_agg.csv", index=False)
-    print('questions')
-    count_session_by_studentId(datasets.get('sessions')).to_csv(f"{output_filepath}/sessions_agg.csv", index=False)
-    print('sessions')
-    count_subject(datasets.get('subjects')).to_csv(f"{output_filepath}/subjects_agg.csv", index=False)
-    print('subjects')
-    get_usage_weekly(datasets.get('students'), datasets.get('sessions')).to_csv(f"{output_filepath}/usage_weekly.csv", index=False)
-    print('weekly')
-
-    mobile_only, desktop_only = get_device_type(datasets.get('fileViews'))
-    mobile_only.to_csv(f"{output_filepath}/usage_mobile_only.csv", index=False)
-    desktop_only.to_csv(f"{output_filepath}/usage_desktop_only.csv", index=False)
-    print('get_device_type agg datasets')
-    print('end agg datasets')
-
-def get_device_type(file_views):
-    file_views['is_mobile'] = [0 if item == 'Website' else 1 for item in file_views.Studentclient.values]
-    file_views['OS_mobile'] = [0 if item == 'Website' else 1 for item in file_views.Studentclient.values]
-    df_desktop = file_views.loc[file_views.is_mobile == 0].reset_index()
-    df_mobile_version = pd.DataFrame(
-        file_views.loc[file_views.is_mobile == 1].Studentclient.str.split('|', expand=True).values,
-        columns=['OS', 'version', 'sdk']
-        )
-    df_mobile_orig = file_views.loc[file_views.is_mobile == 1].reset_index()
-    df_mobile = pd.concat([df_mobile_orig, df_mobile_version], axis=1)
-
-    desk_mobile = pd.DataFrame(
-        set(df_mobile.StudentId).intersection(set(df_desktop.StudentId))
-    ).count().values[0] / len(file_views.StudentId.unique())
-
-    return (df_mobile,df_desktop)
+    for file in dict.fromkeys(tables):
+        datasets[file] = read_dataset(output_filepath, file, columns=_event_columns(file), fmt=fmt)
+    for name, spec in AGGREGATIONS.items():
+        with stage('aggregate', dataset=name):
+            write_dataset(aggregate(datasets[spec['source']], spec), output_filepath, name, fmt)
 
+    with stage('usage_weekly'):
+        sessions_weekly = count_sessions_by_week(datasets.get('sessions'))
+        write_dataset(sessions_weekly, output_filepath, 'sessions_weekly', fmt)
+        write_dataset(usage_from_weekly(datasets.get('students'), sessions_weekly), output_filepath, 'usage_weekly',
+                      fmt)
+
+    with stage('usage_device'):
+        client_views = count_views_by_client(datasets.get('fileViews'))
+        write_dataset(client_views, output_filepath, 'fileViews_clients', fmt)
+        write_dataset(device_profile(client_views), output_filepath, 'usage_device', fmt)
+
+    marks = {table: event_mark(datasets[table], table) for table in EVENT_TIME}
+    save_state(output_filepath, {'marks': marks, 'full_rebuild': True})
+
+@instrumented
+def update_database_agg(input_filepath, output_filepath, fmt='csv'):
+    """ Folds the events not seen by the previous run (see
+        `read_new_events`) into the stored aggregates, and records the
+        StudentIds whose features changed for `update_database_ABT`. Tables
+        that are not append-only are fully recomputed. Without a previous run
+        this is `create_database_agg`.
+    """
+    state = load_state(output_filepath)
+    # marks of older runs kept the boundary row hashes as lists
+    if 'marks' not in state or any(isinstance(mark['at'], list) for mark in state['marks'].values()):
+        create_database_agg(input_filepath, output_filepath, fmt)
+        return
+    marks = state['marks']
+
+    new_events = {}
+    for table in EVENT_TIME:
+        with stage('new_events', dataset=table) as record:
+            new_events[table] = read_new_events(output_filepath, table, marks.get(table), _agg_columns(table), fmt)
+            record.add_output(new_events[table])
+    affected = [events.StudentId for events in new_events.values()]
+
+    for name, spec in AGGREGATIONS.items():
+        source = spec['source']
+        stored = read_dataset(output_filepath, name, fmt=fmt)
+        if source in new_events:
+            df = merge_aggregates(stored, aggregate(new_events[source], spec), spec)
+        else:
+            df = aggregate(read_dataset(output_filepath, source, columns=_agg_columns(source), fmt=fmt), spec)
+            changed = stored.merge(df, how='outer', indicator=True)
+            affected.append(changed.loc[changed._merge != 'both', 'StudentId'])
+        write_dataset(df, output_filepath, name, fmt)
+
+    students = read_dataset(output_filepath, 'students', columns=['Id'], fmt=fmt)
+    sessions_weekly = merge_counts(read_dataset(output_filepath, 'sessions_weekly', fmt=fmt),
+                                   count_sessions_by_week(new_events['sessions']),
+                                   ['StudentId', 'week_year'], 'sessions')
+    write_dataset(sessions_weekly, output_filepath, 'sessions_weekly', fmt)
+    write_dataset(usage_from_weekly(students, sessions_weekly), output_filepath, 'usage_weekly', fmt)
+
+    client_views = merge_counts(read_dataset(output_filepath, 'fileViews_clients', fmt=fmt),
+                                count_views_by_client(new_events['fileViews']),
+                                ['StudentId', 'Studentclient'], 'views')
+    write_dataset(client_views, output_filepath, 'fileViews_clients', fmt)
+    write_dataset(device_profile(client_views), output_filepath, 'usage_device', fmt)
+
+    if dataset_exists(output_filepath, AFFECTED_STUDENTS, fmt):
+        affected.append(read_dataset(output_filepath, AFFECTED_STUDENTS, fmt=fmt).StudentId)
+    affected = pd.to_numeric(pd.concat(affected, ignore_index=True), errors='coerce').dropna().unique()
+    with stage('affected_students'):
+        write_dataset(pd.DataFrame({'StudentId': affected.astype('int64')}), output_filepath, AFFECTED_STUDENTS, fmt)
+
+    state['marks'] = {table: merge_marks(marks.get(table), event_mark(new_events[table], table))
+                      for table in EVENT_TIME}
+    save_state(output_filepath, state)
+
+# Builders of a single processed output, run as separate pipeline nodes by
+# src/pipeline.py. They produce the same files as create_database_agg.
+
+def create_aggregate(output_filepath, name, fmt='csv'):
+    spec = AGGREGATIONS[name]
+    with stage('create_aggregate', dataset=name):
+        df = read_dataset(output_filepath, spec['source'], columns=source_columns(spec['source']), fmt=fmt)
+        write_dataset(aggregate(df, spec), output_filepath, name, fmt)
+
+@instrumented
+def create_usage_weekly(output_filepath, fmt='csv'):
+    students = read_dataset(output_filepath, 'students', columns=HELPER_COLUMNS['students'], fmt=fmt)
+    sessions = read_dataset(output_filepath, 'sessions', columns=HELPER_COLUMNS['sessions'], fmt=fmt)
+    sessions_weekly = count_sessions_by_week(sessions)
+    write_dataset(sessions_weekly, output_filepath, 'sessions_weekly', fmt)
+    write_dataset(usage_from_weekly(students, sessions_weekly), output_filepath, 'usage_weekly', fmt)
+
+@instrumented
+def create_usage_device(output_filepath, fmt='csv'):
+    file_views = read_dataset(output_filepath, 'fileViews', columns=HELPER_COLUMNS['fileViews'], fmt=fmt)
+    client_views = count_views_by_client(file_views)
+    write_dataset(client_views, output_filepath, 'fileViews_clients', fmt)
+    write_dataset(device_profile(client_views), output_filepath, 'usage_device', fmt)
+
+@instrumented
+def create_incremental_state(output_filepath, fmt='csv'):
+    marks = {table: event_mark(read_dataset(output_filepath, table, columns=_event_columns(table), fmt=fmt), table)
+             for table in EVENT_TIME}
+    save_state(output_filepath, {'marks': marks, 'full_rebuild': True})
+
+# Out-of-core build: each source table is mapped partition by partition into
+# partial results that are reduced exactly (counts are summed, min/max kept).
+
+MARK = 'mark'
+
+
+def map_events(table, df):
+    """ Partial results of one partition of `table`. """
+    partials = {name: aggregate(df, spec) for name, spec in AGGREGATIONS.items() if spec['source'] == table}
+    if table == 'sessions':
+        partials['sessions_weekly'] = count_sessions_by_week(df)
+    if table == 'fileViews':
+        partials['fileViews_clients'] = count_views_by_client(df)
+    if table in EVENT_TIME:
+        partials[MARK] = event_mark(df, table)
+    return partials
+
+def reduce_events(result, partial):
+    """ Combines the partial results of two partitions. """
+    combined = {}
+    for name, df in partial.items():
+        if name in AGGREGATIONS:
+            combined[name] = merge_aggregates(result[name], df, AGGREGATIONS[name])
+        elif name == 'sessions_weekly':
+            combined[name] = merge_counts(result[name], df, ['StudentId', 'week_year'], 'sessions')
+        elif name == 'fileViews_clients':
+            combined[name] = merge_counts(result[name], df, ['StudentId', 'Studentclient'], 'views')
+        elif name == MARK:
+            combined[name] = merge_marks(result[name], df)
+    return combined
+
+@instrumented
+def create_database_agg_partitioned(input_filepath, output_filepath, fmt='csv', partition_size=1000000, workers=1):
+    """ Same outputs as `create_database_agg`, reading the source tables in
+        partitions of `partition_size` rows mapped on `workers` processes, so
+        memory is bound by the partition size and the number of students.
+    """
+    results, marks = {}, {}
+    for table in dict.fromkeys(spec['source'] for spec in AGGREGATIONS.values()):
+        columns = _event_columns(table)
+        with stage('map_reduce', dataset=table):
+            partials = map_reduce(output_filepath, table, columns, map_events, reduce_events, fmt, partition_size,
+                                  workers)
+        if table in EVENT_TIME:
+            marks[table] = partials.pop(MARK)
+        results.update(partials)
+
+    for name in AGGREGATIONS:
+        write_dataset(results[name], output_filepath, name, fmt)
+
+    students = read_dataset(output_filepath, 'students', columns=HELPER_COLUMNS['students'], fmt=fmt)
+    write_dataset(results['sessions_weekly'], output_filepath, 'sessions_weekly', fmt)
+    write_dataset(usage_from_weekly(students, results['sessions_weekly']), output_filepath, 'usage_weekly', fmt)
+    write_dataset(results['fileViews_clients'], output_filepath, 'fileViews_clients', fmt)
+    write_dataset(device_profile(results['fileViews_clients']), output_filepath, 'usage_device', fmt)
+
+    save_state(output_filepath, {'marks': marks, 'full_rebuild': True})
+
+
+def count_views_by_client(file_views):
+    """ File views per (StudentId, Studentclient); views without a client are
+        not counted.
+    """
+    return file_views.groupby(['StudentId', 'Studentclient']).size().reset_index(name='views')
+
+def device_profile(client_views):
+    """ Per-student device profile from the views per client: mobile/desktop
+        flags, views per client type and the OS, app version and sdk of the
+        student's most used mobile client.
+
+        `Studentclient` is either 'Website' or 'OS | version[ | sdk]'; only
+        the distinct client strings are parsed.
+    """
+    codes, clients = pd.factorize(client_views.Studentclient)
+    clients = pd.Series(clients, dtype=object)
+    parsed = clients.str.split('|', expand=True).reindex(columns=range(3))
+    parsed = parsed.astype(object).apply(lambda column: column.str.strip())
+    parsed.columns = ['OS', 'version', 'sdk']
+    is_mobile = (clients != 'Website').values
+
+    views = pd.DataFrame({'StudentId': client_views.StudentId.values,
+                          'client': codes,
+                          'views': client_views.views.values})
+    views['mobile'] = is_mobile[views.client.values]
+
+    df = views.pivot_table(index='StudentId', columns='mobile', values='views', aggfunc='sum', fill_value=0)
+    df = df.reindex(columns=[False, True], fill_value=0)
+    df.columns = ['desktop_views', 'mobile_views']
+    df['mobile'] = (df.mobile_views > 0).astype(int)
+    df['desktop'] = (df.desktop_views > 0).astype(int)
+
+    # ties go to the first client by name, so the profile does not depend on the row order
+    views['name_rank'] = clients.rank(method='dense').values[views.client.values]
+    dominant = views.loc[views.mobile].sort_values(['StudentId', 'views', 'name_rank'],
+                                                   ascending=[True, False, True])
+    dominant = dominant.drop_duplicates('StudentId').set_index('StudentId').client
+    for column in parsed.columns:
+        values = parsed[column].values[dominant.values]
+        df[column] = pd.Series(values, index=dominant.index).reindex(df.index).astype('category')
+
+    df = df.reset_index()
+    return df[['StudentId', 'mobile', 'desktop', 'desktop_views', 'mobile_views', 'OS', 'version', 'sdk']]
+
+@instrumented
+def get_device_profile(file_views):
+    return device_profile(count_views_by_client(file_views))
+
+
+def count_sessions_by_week(sessions):
+    """ Sessions per (StudentId, week_year), weeks keyed like "%Y-%V"
+        (calendar year * 100 + ISO week number).
+    """
+    start = pd.to_datetime(sessions.SessionStartTime, format='ISO8601')
+    week_year = start.dt.year * 100 + start.dt.isocalendar().week.astype('Int64')
+    weekly = pd.DataFrame({'StudentId': sessions.StudentId, 'week_year': week_year}).dropna()
+    return weekly.groupby(['StudentId', 'week_year']).size().reset_index(name='sessions')
+
+def usage_from_weekly(student, sessions_weekly):
+    """ Number of active weeks and mean sessions per active week of each
+        student, aligned to `student.Id`.
+    """
+    usage = sessions_weekly.groupby('StudentId').sessions.agg(['count', 'mean'])
 
-def get_usage_weekly(student, sessions):
-    sessions['week_year'] = pd.to_datetime(sessions.SessionStartTime).map(lambda x: x.strftime("%Y-%V"))
-    session_agg = sessions.groupby(['week_year', 'StudentId']).agg({'week_year': ['count']}).reset_index()
     student_ids = student.Id.unique()
-    lista = [session_agg.loc[session_agg.StudentId == id].week_year.agg(['count','mean'])['count'].values for id in student_ids]
-    df = pd.DataFrame(lista)
-    df.columns = ['usage_weekly_count', 'usage_weekly_mean']
+    usage = usage.reindex(student_ids)
+    df = pd.DataFrame({'usage_weekly_count': usage['count'].fillna(0).astype(int).values,
+                       'usage_weekly_mean': usage['mean'].values})
     df['StudentId'] = student_ids
     return df
 
+@instrumented
+def get_usage_weekly(student, sessions):
+    return usage_from_weekly(student, count_sessions_by_week(sessions))
+
+@instrumented
 def count_session_by_studentId(sessions):
-    df = sessions.groupby(['StudentId']).count().reset_index()
-    return df
+    return aggregate(sessions, AGGREGATIONS['sessions_agg'])
 
+@instrumented
 def count_fileview_by_studentId(file_views):
-    df = file_views.groupby(['StudentId']).count().reset_index()
-    return df
+    return aggregate(file_views, AGGREGATIONS['fileViews_agg'])
 
+@instrumented
 def count_question_by_studentId(questions):
-    df = questions.groupby(['StudentId']).count().reset_index()
-    return df
+    return aggregate(questions, AGGREGATIONS['questions_agg'])
 
+@instrumented
 def count_payment(payments):
-    df = payments.groupby(['StudentId', "PlanType"]).count().reset_index()
-    return df
+    return aggregate(payments, AGGREGATIONS['payments_agg'])
 
+@instrumented
 def count_cancellation(cancelation):
-    df = cancelation.groupby(['StudentId']).count().reset_index()
-    return df
+    return aggregate(cancelation, AGGREGATIONS['cancellations_agg'])
 
+@instrumented
 def count_subject(subjects):
-    df = subjects.groupby(['StudentId']).count().reset_index()
-    return df
+    return aggregate(subjects, AGGREGATIONS['subjects_agg'])
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
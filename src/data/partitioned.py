@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from src.data.storage import iter_dataset
+
+
+PARTITION_SIZE = 1000000
+
+
+def map_reduce(output_filepath, table, columns, mapper, reducer, fmt='csv', partition_size=PARTITION_SIZE,
+               workers=1):
+    """ Folds `reducer(result, mapper(table, partition))` over the partitions
+        of a dataset, in partition order.
+
+        With more than one worker the partitions are mapped in a process
+        pool. At most two partitions per worker are read ahead, so memory is
+        bound by the partition size and not by the table size. `mapper` and
+        `reducer` must be module-level functions.
+    """
+    partitions = iter_dataset(output_filepath, table, columns, partition_size, fmt)
+    result = None
+
+    def fold(partial):
+        return partial if result is None else reducer(result, partial)
+
+    if workers <= 1:
+        for df in partitions:
+            result = fold(mapper(table, df))
+        return result
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for df in partitions:
+            in_flight.append(pool.submit(mapper, table, df))
+            if len(in_flight) >= 2 * workers:
+                result = fold(in_flight.popleft().result())
+        while in_flight:
+            result = fold(in_flight.popleft().result())
+    return result
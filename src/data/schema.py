@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import click
+import os
+import re
+
+import pandas as pd
+
+from src.data.aggregate import AGGREGATIONS
+
+
+ID = 'Int32'  # student ids; malformed ids become missing
+COUNT = 'int32'
+FLAG = 'int8'
+RATE = 'float32'
+TIMESTAMP = 'datetime64[ns]'
+CATEGORY = 'category'
+TEXT = 'string'
+
+# column types of the datasets converted from the raw JSON exports
+RAW_SCHEMAS = {
+    'premium_students': {'StudentId': ID, 'RegisteredDate': TIMESTAMP, 'SubscriptionDate': TIMESTAMP},
+    'fileViews': {'StudentId': ID, 'FileName': TEXT, 'ViewDate': TIMESTAMP, 'Studentclient': CATEGORY},
+    'premium_cancellations': {'StudentId': ID, 'CancellationDate': TIMESTAMP},
+    'premium_payments': {'StudentId': ID, 'PaymentDate': TIMESTAMP, 'PlanType': CATEGORY},
+    'questions': {'StudentId': ID, 'QuestionDate': TIMESTAMP, 'QuestionSnippet': TEXT, 'StudentClient': CATEGORY},
+    'sessions': {'StudentId': ID, 'SessionStartTime': TIMESTAMP, 'StudentClient': CATEGORY},
+    'students': {'Id': ID, 'RegisteredDate': TIMESTAMP, 'UniversityName': CATEGORY, 'CourseName': CATEGORY,
+                 'State': CATEGORY, 'SignupSource': CATEGORY, 'City': CATEGORY, 'StudentClient': CATEGORY},
+    'subjects': {'StudentId': ID, 'SubjectName': CATEGORY, 'FollowDate': TIMESTAMP},
+}
+
+# aggregates whose type does not follow their source column
+AGGREGATE_TYPES = {'count': COUNT, 'size': COUNT, 'nunique': COUNT}
+
+
+def aggregate_schema(spec):
+    """ Column types of an AGGREGATIONS entry, from the types of its source. """
+    source = RAW_SCHEMAS[spec['source']]
+    schema = {key: source[key] for key in spec['key']}
+    for name, (column, func) in spec['aggregates'].items():
+        schema[name] = AGGREGATE_TYPES.get(func, source[column])
+    return schema
+
+
+SCHEMAS = dict(RAW_SCHEMAS)
+SCHEMAS.update({name: aggregate_schema(spec) for name, spec in AGGREGATIONS.items()})
+SCHEMAS.update({
+    'sessions_weekly': {'StudentId': ID, 'week_year': 'int32', 'sessions': COUNT},
+    'usage_weekly': {'usage_weekly_count': COUNT, 'usage_weekly_mean': RATE, 'StudentId': ID},
+    'fileViews_clients': {'StudentId': ID, 'Studentclient': CATEGORY, 'views': COUNT},
+    'usage_device': {'StudentId': ID, 'mobile': FLAG, 'desktop': FLAG, 'desktop_views': COUNT,
+                     'mobile_views': COUNT, 'OS': CATEGORY, 'version': CATEGORY, 'sdk': CATEGORY},
+    'affected_students': {'StudentId': ID},
+    'predictions': {'StudentId': ID, 'cluster': 'int32', 'probability': RATE},
+    'abt_segmentation': {'Id': ID, 'UniversityName': CATEGORY, 'CourseName': CATEGORY, 'City': CATEGORY,
+                         'State': CATEGORY, 'registered_time': 'int32',
+                         'usage_weekly_count': COUNT, 'usage_weekly_mean': RATE,
+                         'session_count': COUNT, 'session_rate': RATE, 'fileview_count': COUNT,
+                         'fileview_rate': RATE, 'question_count': COUNT, 'question_rate': RATE,
+                         'region': CATEGORY, 'mobile': FLAG, 'desktop': FLAG,
+                         'payment_total': COUNT, 'payment_monthly': COUNT, 'payment_yearly': COUNT,
+                         'cancelation_count': COUNT, 'subject_count': COUNT,
+                         'days_since_last_activity': 'int32'},
+})
+
+# columns declared by name pattern, for the ones that vary with the build
+# options: the src/features/windows.py counts of any --windows
+PATTERN_SCHEMAS = {
+    'abt_segmentation': {r'_count_\d+d$': COUNT},
+}
+
+# types csv can parse directly; ids and timestamps are parsed after reading
+CSV_TYPES = (CATEGORY, TEXT, RATE)
+
+
+def column_schema(name, columns):
+    """ Types of the `columns` of the `name` dataset, declared by name or by
+        pattern.
+    """
+    schema = {column: dtype for column, dtype in SCHEMAS.get(name, {}).items() if column in columns}
+    for pattern, dtype in PATTERN_SCHEMAS.get(name, {}).items():
+        schema.update({column: dtype for column in columns if column not in schema and re.search(pattern, column)})
+    return schema
+
+
+def csv_dtypes(name):
+    return {column: dtype for column, dtype in SCHEMAS.get(name, {}).items() if dtype in CSV_TYPES}
+
+
+def cast_column(values, dtype):
+    if dtype == ID:
+        return pd.to_numeric(values, errors='coerce').astype(dtype)
+    if dtype == TIMESTAMP:
+        return pd.to_datetime(values, errors='coerce', format='ISO8601').astype(TIMESTAMP)
+    return values.astype(dtype)
+
+
+def apply_schema(df, name):
+    """ Casts the columns of `df` declared in the schema of the `name`
+        dataset, by name or pattern; undeclared columns are left as they are.
+    """
+    casts = {}
+    for column, dtype in column_schema(name, df.columns).items():
+        if df[column].dtype != dtype:
+            casts[column] = cast_column(df[column], dtype)
+    if casts:
+        df = df.assign(**casts)
+    return df
+
+
+def memory_usage(df):
+    """ Bytes held by `df`, counting the Python objects of object columns. """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def memory_report(output_filepath, fmt='csv'):
+    """ Memory of each processed dataset as pandas loads it by default and
+        once typed by its schema.
+    """
+    rows = []
+    for name in SCHEMAS:
+        path = f'{output_filepath}/{name}.{fmt}'
+        if not os.path.exists(path):
+            continue
+        df = pd.read_csv(path, low_memory=False) if fmt == 'csv' else pd.read_parquet(path)
+        before = memory_usage(df)
+        after = memory_usage(apply_schema(df, name))
+        rows.append({'dataset': name, 'rows': len(df), 'default_mb': before / 2 ** 20,
+                     'schema_mb': after / 2 ** 20, 'saved': 1 - after / before if before else 0})
+    report = pd.DataFrame(rows, columns=['dataset', 'rows', 'default_mb', 'schema_mb', 'saved'])
+    print(report.to_string(index=False, float_format=lambda x: f'{x:.2f}'))
+    return report
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.option('--storage-format', type=click.Choice(['csv', 'parquet']), default='csv',
+              help='Format of the processed datasets.')
+def main(output_filepath, storage_format):
+    """ Prints the memory of each processed dataset before and after its
+        schema is applied.
+    """
+    memory_report(output_filepath, storage_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pandas as pd
+
+from src.data.schema import apply_schema, csv_dtypes
+from src.instrumentation import record_input, record_output
+
+
+FORMATS = ['csv', 'parquet']
+EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet'}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("the 'parquet' storage format needs pyarrow, "
+                          "install it with `pip install pyarrow`") from e
+    return pyarrow
+
+
+def dataset_path(output_filepath, name, fmt='csv'):
+    return f"{output_filepath}/{name}.{EXTENSIONS[fmt]}"
+
+
+def dataset_exists(output_filepath, name, fmt='csv'):
+    return os.path.exists(dataset_path(output_filepath, name, fmt))
+
+
+def remove_dataset(output_filepath, name, fmt='csv'):
+    if dataset_exists(output_filepath, name, fmt):
+        os.remove(dataset_path(output_filepath, name, fmt))
+
+
+def _string_objects(df, categories=False):
+    columns = [c for c in df.columns
+               if df[c].dtype == object or (categories and isinstance(df[c].dtype, pd.CategoricalDtype))]
+    if columns:
+        df = df.astype({c: 'string' for c in columns})
+    return df
+
+
+def write_dataset(df, output_filepath, name, fmt='csv'):
+    """ Writes a whole dataset typed by its schema; csv keeps the text
+        round-trip, parquet stores typed and compressed columns.
+    """
+    path = dataset_path(output_filepath, name, fmt)
+    df = apply_schema(df, name)
+    record_output(df)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        _require_pyarrow()
+        _string_objects(df).to_parquet(path, index=False, compression='zstd')
+    return path
+
+
+FILTER_OPS = {'==': '__eq__', '!=': '__ne__', '<': '__lt__', '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+
+
+def apply_filters(df, filters):
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op == 'in':
+            mask &= df[column].isin(value)
+        else:
+            mask &= getattr(df[column], FILTER_OPS[op])(value)
+    return df.loc[mask]
+
+
+def read_dataset(output_filepath, name, columns=None, filters=None, fmt='csv'):
+    """ Reads a dataset, loading only `columns` when given.
+
+        `filters` is a list of `(column, op, value)` row conditions combined
+        with AND (op in ==, !=, <, <=, >, >=, in); parquet applies them while
+        reading, csv after parsing. The columns are typed by the dataset
+        schema.
+    """
+    path = dataset_path(output_filepath, name, fmt)
+    if fmt == 'csv':
+        read_columns = columns
+        if columns is not None and filters:
+            read_columns = columns + [c for c, _, _ in filters if c not in columns]
+        df = pd.read_csv(path, usecols=read_columns, dtype=csv_dtypes(name), low_memory=False)
+        df = apply_schema(df, name)
+        if filters:
+            df = apply_filters(df, filters)
+        if columns is not None:
+            df = df[columns]
+    else:
+        _require_pyarrow()
+        df = apply_schema(pd.read_parquet(path, columns=columns, filters=filters), name)
+    record_input(df)
+    return df
+
+
+def iter_dataset(output_filepath, name, columns=None, partition_size=1000000, fmt='csv'):
+    """ Reads a dataset in partitions of at most `partition_size` rows, each
+        typed by the dataset schema, so memory is bound by the partition
+        size. An empty dataset yields one empty partition.
+    """
+    path = dataset_path(output_filepath, name, fmt)
+    empty = True
+    if fmt == 'csv':
+        with pd.read_csv(path, usecols=columns, dtype=csv_dtypes(name), chunksize=partition_size) as reader:
+            for df in reader:
+                empty = False
+                df = apply_schema(df, name)
+                df = df if columns is None else df[columns]
+                record_input(df)
+                yield df
+    else:
+        pa = _require_pyarrow()
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=partition_size, columns=columns):
+            empty = False
+            df = apply_schema(batch.to_pandas(), name)
+            record_input(df)
+            yield df
+    if empty:
+        yield read_dataset(output_filepath, name, columns=columns, fmt=fmt)
+
+
+class DatasetWriter:
+    """ Appends batches to a dataset, so a large file can be written without
+        holding it in memory. The columns are `columns`, or fixed by the
+        first batch, and typed by the dataset schema; a batch lacking some of
+        them gets them empty.
+    """
+
+    def __init__(self, output_filepath, name, fmt='csv', columns=None):
+        self.output_filepath = output_filepath
+        self.name = name
+        self.path = dataset_path(output_filepath, name, fmt)
+        self.fmt = fmt
+        self.columns = None if columns is None else list(columns)
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif not set(df.columns).issubset(self.columns):
+            raise ValueError(f'{self.path}: columns {sorted(set(df.columns) - set(self.columns))} '
+                             f'are not among the columns {self.columns} of the dataset')
+        # columns the batch lacks are empty text unless the schema types them
+        missing = {column: object for column in self.columns if column not in df.columns}
+        df = apply_schema(df.reindex(columns=self.columns).astype(missing), self.name)
+        record_output(df)
+        if self.fmt == 'csv':
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a',
+                      header=self.rows == 0, index=False)
+        else:
+            # categories differ between batches, parquet dictionary-encodes
+            # the strings anyway
+            self._write_parquet(_string_objects(df, categories=True))
+        self.rows += len(df)
+
+    def _write_parquet(self, df):
+        pa = _require_pyarrow()
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._schema = table.schema
+            self._writer = pa.parquet.ParquetWriter(self.path, self._schema, compression='zstd')
+        else:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        elif self.rows == 0:
+            write_dataset(pd.DataFrame(columns=self.columns or []),
+                          self.output_filepath, self.name, self.fmt)
@@ -7,46 +7,88 @@ from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 import pandas as pd
 
+from src.data.catalog import load
+from src.data.incremental import AFFECTED_STUDENTS, load_state, save_state
+from src.data.storage import FORMATS, dataset_exists, read_dataset, remove_dataset, write_dataset
+from src.features.feature_store import write_feature_store
+from src.features.windows import WINDOWS, load_window_indexes, window_features
+from src.instrumentation import instrumented
 
+logger = logging.getLogger(__name__)
 
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--incremental', is_flag=True,
+              help='Only rebuild the rows of students affected since the previous run.')
+@click.option('--windows', type=click.IntRange(min=1), multiple=True, default=WINDOWS,
+              help='Trailing windows (days) of the recent activity features.')
+def main(input_filepath, output_filepath, storage_format, incremental, windows):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
-    logger = logging.getLogger(__name__)
     logger.info('making features data set from process data')
-    create_database_ABT(input_filepath, output_filepath)
+    if incremental:
+        update_database_ABT(input_filepath, output_filepath, storage_format, windows)
+    else:
+        create_database_ABT(input_filepath, output_filepath, storage_format, windows)
+
+
+REGIONS = {
+    'norte': ['Acre', 'Amapa', 'Amazonas', 'Pará', 'Rondonia', 'Roraima', 'Tocantins'],
+    'nordeste': ['Alagoas', 'Bahia', 'Ceara', 'Maranhão', 'Paraíba', 'Pernambuco', 'Piauí', 'Rio Grande do Norte',
+                 'Sergipe'],
+    'centro_oeste': ['Goias', 'Mato Grosso', 'Mato Grosso do Sul', 'Distrito Federal'],
+    'sul': ['Rio Grande do Sul', 'Santa Catarina', 'Paraná'],
+    'sudeste': ['Espirito Santo', 'Minas Gerais', 'Rio de Janeiro', 'São Paulo'],
+}
+UNKNOWN_REGION = 'na'
+STATE_REGION = {state: region for region, states in REGIONS.items() for state in states}
+
+# columns of each processed dataset read by the ABT
+ABT_INPUTS = {'students': ['Id', 'RegisteredDate', 'UniversityName', 'CourseName', 'City', 'State'],
+              'cancellations_agg': ['StudentId', 'cancelation_count'],
+              'fileViews_agg': ['StudentId', 'fileview_count'],
+              'payments_agg': ['StudentId', 'PlanType', 'payment_count'],
+              'questions_agg': ['StudentId', 'question_count'],
+              'sessions_agg': ['StudentId', 'session_count', 'last_session'],
+              'subjects_agg': ['StudentId', 'subject_count'],
+              'usage_weekly': ['usage_weekly_count', 'usage_weekly_mean', 'StudentId'],
+              'usage_device': ['StudentId', 'mobile', 'desktop']
+              }
+ABT_COLUMNS = ['Id', 'UniversityName', 'CourseName', 'City', 'State', 'registered_time',
+               'usage_weekly_count', 'usage_weekly_mean',
+               'session_count', 'session_rate', 'fileview_count', 'fileview_rate',
+               'question_count', 'question_rate', 'region', 'mobile', 'desktop',
+               'payment_total', 'payment_monthly', 'payment_yearly',
+               'cancelation_count', 'subject_count']
+RATES = {'session_rate': 'session_count', 'fileview_rate': 'fileview_count', 'question_rate': 'question_count'}
+# value of a missing text attribute in the ABT
+MISSING_TEXT = '0'
 
 
 def get_registered_time(df, max_time):
-    tempos = []
-    for student_reg_date in df.RegisteredDate:
-        diff_time = pd.to_timedelta(pd.to_datetime(max_time) - pd.to_datetime(student_reg_date)).days
-        tempos.append(diff_time)
-    return tempos
+    """ Whole days between each student's registration and `max_time`. """
+    registered = pd.to_datetime(df.RegisteredDate, format='ISO8601')
+    return (pd.to_datetime(max_time) - registered).dt.days
 
 def get_region(df):
-
-    norte = ['Acre', 'Amapa', 'Amazonas', 'Pará', 'Rondonia', 'Roraima', 'Tocantins']
-    nordeste = ['Alagoas', 'Bahia', 'Ceara', 'Maranhão', 'Paraíba', 'Pernambuco', 'Piauí', 'Rio Grande do Norte',
-                'Sergipe']
-    centro_oeste = ['Goias', 'Mato Grosso', 'Mato Grosso do Sul', 'Distrito Federal']
-    sul = ['Rio Grande do Sul', 'Santa Catarina', 'Paraná']
-    sudeste = ['Espirito Santo', 'Minas Gerais', 'Rio de Janeiro', 'São Paulo']
-    na = ['NA']
-
-    regions = []
-    for student_state in df.State.fillna("NA"):
-        region = next(
-            n for n, v in filter(lambda t: isinstance(t[1], list), locals().items()) if student_state in v)
-        regions.append(region)
-    return regions
-
-def create_database_ABT(input_filepath, output_filepath):
+    """ Region of each student's State; missing or unknown states fall back
+        to UNKNOWN_REGION.
+    """
+    regions = df.State.astype(object).map(STATE_REGION)
+    unknown = df.State.notna() & regions.isna()
+    if unknown.any():
+        logging.getLogger(__name__).warning(
+            'states without a region: %s', sorted(df.State[unknown].unique()))
+    categories = list(REGIONS) + [UNKNOWN_REGION]
+    return pd.Categorical(regions.fillna(UNKNOWN_REGION), categories=categories)
+
+@instrumented
+def create_database_ABT(input_filepath, output_filepath, fmt='csv', windows=WINDOWS):
     '''
 
     ## Features
@@ -70,181 +112,150 @@ def create_database_ABT(input_filepath, output_filepath):
     - count_paymant_anual
     - count_cancellation
     - count_subject
+    - sessions, file views and questions in the trailing `windows`
+    - days since the last activity
 
     '''
 
-    
-    files = ['fileViews',
-             'premium_cancellations',
-             'premium_payments',
-             'questions',
-             'sessions',
-             'students',
-             'subjects',
-             'cancellations_agg',
-             'fileViews_agg',
-             'payments_agg',
-             'questions_agg',
-             'sessions_agg',
-             'subjects_agg',
-             'usage_weekly',
-             'usage_desktop_only',
-             'usage_mobile_only'
-             ]
+    datasets = load_abt_inputs(output_filepath, fmt)
+    max_time = datasets['sessions_agg'].last_session.max()
+    df_abt = add_windows(assemble_abt(datasets, max_time), output_filepath, max_time, fmt, windows)
+    write_dataset(df_abt, output_filepath, 'abt_segmentation', fmt)
+    write_feature_store(df_abt, output_filepath)
 
+
+@instrumented
+def load_abt_inputs(output_filepath, fmt='csv', student_ids=None):
+    """ Reads the columns of each processed dataset used by the ABT, only for
+        `student_ids` when given.
+    """
     datasets = {}
-    for file in files:
-        datasets[file] = pd.read_csv(f"{output_filepath}/{file}.csv")  # ,parse_dates=[1,2],index_col=[0])
-        print(f'*********{file}***********')
-        print(datasets[file].shape)
-        print(datasets[file].head(2))
-        print("____________\n\n")
-    
-    fileViews = datasets.get('fileViews')
-    cancellation = datasets.get('premium_cancellations')
-    payment = datasets.get('premium_payments')
-    questions = datasets['questions']
-    sessions = datasets['sessions']
-    student = datasets.get('students')
-    subjects = datasets.get('subjects')
-    cancellation_agg = datasets.get('cancellations_agg')
-    fileViews_agg = datasets.get('fileViews_agg')
-    payments_agg = datasets.get('payments_agg')
-    questions_agg = datasets.get('questions_agg')
-    sessions_agg = datasets.get('sessions_agg')
-    subjects_agg = datasets.get('subjects_agg')
-    usage_weekly = datasets.get('usage_weekly')
-    usage_mobile = datasets.get('usage_mobile_only')
-    usage_desktop = datasets.get('usage_desktop_only')
-
-    
-    max_time = sessions.SessionStartTime.max()
-    sessions_agg = sessions_agg[['StudentId', 'SessionStartTime']]
-    sessions_agg.columns = ['StudentId', 'session_count']
-    
-    fileViews_agg = fileViews_agg[['StudentId', 'FileName']]
-    fileViews_agg.columns = ['StudentId', 'fileview_count']
-    fileViews_agg.drop([45975, 45976], inplace=True)
-    fileViews_agg.head()
-    fileViews_agg['StudentId'] = fileViews_agg.StudentId.astype(int)
-    
-    questions_agg = questions_agg[['StudentId', 'QuestionDate']]
-    questions_agg.columns = ['StudentId', 'question_count']
-
-    
-    cancellation_agg = cancellation_agg[['StudentId', 'CancellationDate']]
-    cancellation_agg.columns = ['StudentId', 'cancelation_count']
-
-    
-    subjects_agg = subjects_agg[['StudentId', 'SubjectName']]
-    subjects_agg.columns = ['StudentId', 'subject_count']
-
-
-    
-    student['registered_time'] = get_registered_time(student, max_time)
-    student_usage = pd.merge(student,
-                             usage_weekly,
-                             left_on='Id',
-                             right_on='StudentId',
-                             how='left')
-    
-
-    
-    student_usage_sessions = pd.merge(student_usage,
-                                      sessions_agg,
-                                      on='StudentId',
-                                      suffixes='',
-                                      how='left')
-
-    student_usage_sessions['session_rate'] = student_usage_sessions['session_count'] / student_usage_sessions[
-        'registered_time']
-    
-    student_usage_sessions_fileViews = pd.merge(student_usage_sessions,
-                                                fileViews_agg[['StudentId', 'fileview_count']],
-                                                on='StudentId',
-                                                how='left')
-
-    student_usage_sessions_fileViews['fileview_rate'] = student_usage_sessions_fileViews['fileview_count'] / \
-                                                        student_usage_sessions_fileViews['registered_time']
-
-    
-    student_usage_sessions_fileViews_question = pd.merge(student_usage_sessions_fileViews,
-                                                         questions_agg[['StudentId', 'question_count']],
-                                                         on='StudentId',
-                                                         how='left')
-
-    student_usage_sessions_fileViews_question['question_rate'] = student_usage_sessions_fileViews_question[
-                                                                     'question_count'] / \
-                                                                 student_usage_sessions_fileViews_question[
-                                                                     'registered_time']
-
-    
-    student_usage_sessions_fileViews_question['region'] = get_region(student_usage_sessions_fileViews_question)
-
-    
-    list_desktop = usage_desktop.StudentId.unique()
-    list_mobile = usage_mobile.StudentId.unique()
-
-    student_usage_sessions_fileViews_question['mobile'] = 0
-    student_usage_sessions_fileViews_question['desktop'] = 0
-
-    student_usage_sessions_fileViews_question.loc[
-        student_usage_sessions_fileViews_question.StudentId.isin(list_mobile), 'mobile'] = 1
-    student_usage_sessions_fileViews_question.loc[
-        student_usage_sessions_fileViews_question.StudentId.isin(list_desktop), 'desktop'] = 1
-
-    
-    df_payment_total = payments_agg.groupby(['StudentId']).PaymentDate.sum().reset_index()
-    df_payment_total_mensal = payments_agg.loc[payments_agg.PlanType == 'Mensal'].groupby(
-        ['StudentId']).PaymentDate.sum().reset_index()
-    df_payment_total_anual = payments_agg.loc[payments_agg.PlanType == 'Anual'].groupby(
-        ['StudentId']).PaymentDate.sum().reset_index()
-    df_payment_total.columns = ['StudentId', "payment_total"]
-    df_payment_total_mensal.columns = ['StudentId', "payment_monthly"]
-    df_payment_total_anual.columns = ['StudentId', "payment_yearly"]
-
-    
-    student_usage_sessions_fileViews_question_payment = pd.merge(student_usage_sessions_fileViews_question,
-                                                                 df_payment_total,
-                                                                 on='StudentId',
-                                                                 how='left')
-    student_usage_sessions_fileViews_question_payment_month = pd.merge(
-        student_usage_sessions_fileViews_question_payment,
-        df_payment_total_mensal,
-        on='StudentId',
-        how='left')
-    student_usage_sessions_fileViews_question_payment_year = pd.merge(
-        student_usage_sessions_fileViews_question_payment_month,
-        df_payment_total_anual,
-        on='StudentId',
-        how='left')
-
-    
-    student_usage_sessions_fileViews_question_payment_year_cancellation = pd.merge(
-        student_usage_sessions_fileViews_question_payment_year,
-        cancellation_agg,
-        on='StudentId',
-        how='left')
-    
-    student_usage_sessions_fileViews_question_payment_year_cancellation_subject = pd.merge(
-        student_usage_sessions_fileViews_question_payment_year_cancellation,
-        subjects_agg,
-        on='StudentId',
-        how='left')
-
-    
-    df_abt = student_usage_sessions_fileViews_question_payment_year_cancellation_subject.fillna(0).copy()
-    df_abt = df_abt[
-         ['Id','UniversityName','CourseName','City','State','registered_time',
-          'usage_weekly_count','usage_weekly_mean',
-          'session_count','session_rate','fileview_count','fileview_rate',
-          'question_count','question_rate','region','mobile','desktop',
-          'payment_total','payment_monthly','payment_yearly',
-          'cancelation_count','subject_count']
-    ]
-    df_abt.to_csv(f"{output_filepath}/abt_segmentation.csv", index=False)
-
-    print("ABT criada")
+    for file, columns in ABT_INPUTS.items():
+        filters = None
+        if student_ids is not None:
+            filters = [('Id' if file == 'students' else 'StudentId', 'in', list(student_ids))]
+        datasets[file] = load(output_filepath, file, columns=columns, filters=filters, fmt=fmt)
+    return datasets
+
+
+def fill_missing(df):
+    """ Missing text attributes become MISSING_TEXT and every other missing
+        value 0.
+    """
+    text = [column for column in df.columns
+            if isinstance(df[column].dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(df[column])]
+    casts = {column: df[column].cat.add_categories([MISSING_TEXT]) for column in text
+             if isinstance(df[column].dtype, pd.CategoricalDtype) and df[column].isna().any()
+             and MISSING_TEXT not in df[column].cat.categories}
+    return df.assign(**casts).fillna({column: MISSING_TEXT for column in text}).fillna(0)
+
+
+def add_rates(df):
+    """ Per-day rates of the lifetime counts; they change with `max_time` for
+        every student, not only the ones with new events.
+    """
+    for rate, count in RATES.items():
+        df[rate] = df[count] / df['registered_time']
+    return df
+
+
+def student_block(df, columns):
+    """ `columns` of a per-student dataset indexed by StudentId. Rows whose
+        StudentId is not a numeric student key are dropped.
+    """
+    ids = pd.to_numeric(df.StudentId, errors='coerce')
+    valid = ids.notna()
+    return df.loc[valid, columns].set_index(pd.Index(ids[valid].astype('int64'), name='StudentId'))
+
+
+def payment_totals(payments_agg):
+    """ Payments per student in total and per PlanType, from one pivot. """
+    payments = student_block(payments_agg, ['PlanType', 'payment_count'])
+    by_plan = payments.pivot_table(index='StudentId', columns='PlanType', values='payment_count',
+                                   aggfunc='sum', dropna=False)
+    by_plan = by_plan.reindex(columns=by_plan.columns.union(['Mensal', 'Anual'], sort=False))
+    return pd.DataFrame({'payment_total': by_plan.sum(axis=1).astype(payments.payment_count.dtype),
+                         'payment_monthly': by_plan['Mensal'],
+                         'payment_yearly': by_plan['Anual']})
+
+
+@instrumented
+def assemble_abt(datasets, max_time):
+    """ Aligns every feature block with the students in one concat, each
+        block reindexed on the student ids, then derives the time features.
+    """
+    student = datasets['students']
+    student_ids = pd.Index(student.Id.values, name='StudentId')
+
+    device = student_block(datasets['usage_device'], ['mobile', 'desktop'])
+    blocks = [student_block(datasets['usage_weekly'], ['usage_weekly_count', 'usage_weekly_mean']),
+              student_block(datasets['sessions_agg'], ['session_count']),
+              student_block(datasets['fileViews_agg'], ['fileview_count']),
+              student_block(datasets['questions_agg'], ['question_count']),
+              (device == 1).astype(int),
+              payment_totals(datasets['payments_agg']),
+              student_block(datasets['cancellations_agg'], ['cancelation_count']),
+              student_block(datasets['subjects_agg'], ['subject_count'])]
+    features = pd.concat([block.reindex(student_ids) for block in blocks], axis=1)
+    features[['mobile', 'desktop']] = features[['mobile', 'desktop']].fillna(0).astype(int)
+
+    df_abt = pd.concat([student.reset_index(drop=True), features.reset_index(drop=True)], axis=1)
+    df_abt['registered_time'] = get_registered_time(df_abt, max_time)
+    df_abt['region'] = get_region(df_abt)
+    df_abt = add_rates(df_abt)
+    return fill_missing(df_abt)[ABT_COLUMNS]
+
+
+def add_windows(df_abt, output_filepath, max_time, fmt='csv', windows=WINDOWS):
+    """ The ABT followed by the trailing-window features of its students,
+        which change with `max_time` for every student.
+    """
+    features = window_features(df_abt.Id.values, load_window_indexes(output_filepath, fmt), max_time, windows,
+                               df_abt.registered_time.values)
+    return pd.concat([df_abt.reset_index(drop=True), features], axis=1)
+
+
+@instrumented
+def update_database_ABT(input_filepath, output_filepath, fmt='csv', windows=WINDOWS):
+    """ Rebuilds the ABT rows of the students recorded by
+        `update_database_agg` plus new students and students whose attributes
+        changed, then refreshes registered_time, the rates and the window
+        features of every row for the new max_time. Falls back to
+        `create_database_ABT` after a full aggregate rebuild.
+    """
+    state = load_state(output_filepath)
+    if not state or state.get('full_rebuild') or not dataset_exists(output_filepath, 'abt_segmentation', fmt):
+        create_database_ABT(input_filepath, output_filepath, fmt, windows)
+    else:
+        # loaded with the ABT columns, so the affected rows are filtered from memory
+        max_time = load(output_filepath, 'sessions_agg', columns=ABT_INPUTS['sessions_agg'], fmt=fmt).last_session.max()
+        student = load(output_filepath, 'students', columns=ABT_INPUTS['students'], fmt=fmt)
+        stored = read_dataset(output_filepath, 'abt_segmentation', fmt=fmt).set_index('Id')
+
+        affected = set()
+        if dataset_exists(output_filepath, AFFECTED_STUDENTS, fmt):
+            affected.update(read_dataset(output_filepath, AFFECTED_STUDENTS, fmt=fmt).StudentId)
+        attributes = ['UniversityName', 'CourseName', 'City', 'State']
+        current = fill_missing(student.set_index('Id')[attributes]).astype(str)
+        previous = stored[attributes].reindex(current.index)
+        changed = previous.isna().any(axis=1) | (previous.astype(str) != current).any(axis=1)
+        affected.update(current.index[changed])
+        logger.info(f'{len(affected)} affected students')
+
+        fresh = assemble_abt(load_abt_inputs(output_filepath, fmt, student_ids=affected), max_time)
+        df_abt = pd.concat([stored.loc[~stored.index.isin(affected)], fresh.set_index('Id')])
+        df_abt = df_abt.reindex(student.Id.values)
+        df_abt['registered_time'] = get_registered_time(student, max_time).values
+        time_features = ['registered_time'] + list(RATES)
+        df_abt[time_features] = add_rates(df_abt)[time_features].fillna(0)
+        df_abt = add_windows(df_abt.reset_index()[ABT_COLUMNS], output_filepath, max_time, fmt, windows)
+        write_dataset(df_abt, output_filepath, 'abt_segmentation', fmt)
+        write_feature_store(df_abt, output_filepath)
+
+    remove_dataset(output_filepath, AFFECTED_STUDENTS, fmt)
+    if state:
+        state['full_rebuild'] = False
+        save_state(output_filepath, state)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import click
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.data.schema import apply_schema
+from src.instrumentation import instrumented
+
+STORE_DIR = 'feature_store'
+CURRENT = 'CURRENT'
+KEEP_VERSIONS = 2
+
+logger = logging.getLogger(__name__)
+
+
+def store_path(output_filepath):
+    return f'{output_filepath}/{STORE_DIR}'
+
+
+def versions(output_filepath):
+    path = store_path(output_filepath)
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(name[1:]) for name in os.listdir(path) if name.startswith('v') and name[1:].isdigit())
+
+
+def current_version(output_filepath):
+    path = f'{store_path(output_filepath)}/{CURRENT}'
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return int(f.read())
+
+
+@instrumented
+def write_feature_store(df_abt, output_filepath, keep=KEEP_VERSIONS):
+    """ Writes the numeric ABT columns as a new store version and makes it
+        current, returning the version.
+
+        The features are one float64 array in column-major order, rows sorted
+        by StudentId, next to the sorted ids. The version is written to a
+        temporary directory, renamed, and then published by atomically
+        replacing the CURRENT file, so readers see either the previous or
+        the new version, never a partial one. Only the last `keep` versions
+        are kept. Values are typed by the ABT schema first, so the store
+        holds what abt_segmentation holds.
+    """
+    root = store_path(output_filepath)
+    os.makedirs(root, exist_ok=True)
+    version = max(versions(output_filepath), default=0) + 1
+
+    df = apply_schema(df_abt, 'abt_segmentation')
+    df = df.loc[df.Id.notna()]
+    columns = [column for column in df.select_dtypes('number').columns if column != 'Id']
+    ids = df.Id.to_numpy(dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    first = np.r_[True, ids[1:] != ids[:-1]]
+    if not first.all():
+        logger.warning(f'{(~first).sum()} duplicated StudentIds, keeping their first row')
+        order, ids = order[first], ids[first]
+
+    tmp = f'{root}/v{version}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(f'{tmp}/ids.npy', ids)
+    values = np.lib.format.open_memmap(f'{tmp}/features.npy', mode='w+', dtype=np.float64,
+                                       shape=(len(ids), len(columns)), fortran_order=True)
+    for j, column in enumerate(columns):
+        values[:, j] = df[column].to_numpy(dtype=np.float64)[order]
+    values.flush()
+    del values
+    with open(f'{tmp}/meta.json', 'w') as f:
+        json.dump({'version': version, 'columns': columns, 'rows': len(ids),
+                   'created': datetime.now().isoformat()}, f, indent=2)
+    os.rename(tmp, f'{root}/v{version}')
+
+    with open(f'{root}/{CURRENT}.tmp', 'w') as f:
+        f.write(str(version))
+    os.replace(f'{root}/{CURRENT}.tmp', f'{root}/{CURRENT}')
+
+    # readers still mapping a removed version keep their pages until they close
+    for old in versions(output_filepath)[:-keep]:
+        shutil.rmtree(f'{root}/v{old}')
+    return version
+
+
+class FeatureStore:
+    """ Read-only, memory-mapped view of one store version (the current one
+        by default). Opening it maps the files, nothing is parsed or copied.
+    """
+
+    def __init__(self, output_filepath, version=None):
+        self.version = version if version is not None else current_version(output_filepath)
+        if self.version is None:
+            raise FileNotFoundError(f'no feature store in {output_filepath}, run build_features first')
+        path = f'{store_path(output_filepath)}/v{self.version}'
+        with open(f'{path}/meta.json') as f:
+            self.meta = json.load(f)
+        self.columns = self.meta['columns']
+        self.positions = {column: j for j, column in enumerate(self.columns)}
+        self.ids = np.load(f'{path}/ids.npy', mmap_mode='r')
+        self.values = np.load(f'{path}/features.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, student_id):
+        """ Position of `student_id`, found by binary search; KeyError when
+            it is not in the store.
+        """
+        position = int(np.searchsorted(self.ids, student_id))
+        if position == len(self.ids) or self.ids[position] != student_id:
+            raise KeyError(student_id)
+        return position
+
+    def lookup(self, student_id):
+        """ Features of one student. """
+        return pd.Series(self.values[self.row(student_id)], index=self.columns, name=student_id)
+
+    def gather(self, student_ids, columns=None):
+        """ Features of many students in one vectorized search, in the order
+            of `student_ids`; unknown students get missing values.
+        """
+        keys = np.asarray(student_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, keys)
+        positions[positions == len(self.ids)] = 0
+        found = self.ids[positions] == keys
+        columns = self.columns if columns is None else columns
+        out = np.full((len(keys), len(columns)), np.nan)
+        out[found] = self.values[np.ix_(positions[found], [self.positions[column] for column in columns])]
+        return pd.DataFrame(out, index=pd.Index(keys, name='Id'), columns=columns)
+
+    def column(self, name):
+        """ One feature of every student, in StudentId order, as a zero-copy
+            view of the mapped file.
+        """
+        return self.values[:, self.positions[name]]
+
+
+@click.command()
+@click.argument('output_filepath', type=click.Path(exists=True))
+@click.argument('student_ids', type=int, nargs=-1)
+def main(output_filepath, student_ids):
+    """ Prints the stored features of STUDENT_IDS. """
+    store = FeatureStore(output_filepath)
+    print(f'feature store v{store.version}: {len(store)} students, {len(store.columns)} features')
+    if student_ids:
+        print(store.gather(student_ids).T.to_string())
+
+
+if __name__ == '__main__':
+    main()
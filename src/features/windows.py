@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.data.event_index import NAT, load_event_index
+
+# trailing windows, in days before max_time
+WINDOWS = (7, 30, 90)
+# event tables counted per window, their time column and the feature prefix
+WINDOW_EVENTS = {'sessions': ('SessionStartTime', 'session'),
+                 'fileViews': ('ViewDate', 'fileview'),
+                 'questions': ('QuestionDate', 'question')}
+LAST_ACTIVITY = 'days_since_last_activity'
+DAY = np.timedelta64(1, 'D').astype('timedelta64[ns]').astype(np.int64)
+
+
+def window_columns(windows=WINDOWS):
+    """ Names of the window features, in ABT order. """
+    counts = [f'{prefix}_count_{window}d' for _, prefix in WINDOW_EVENTS.values() for window in windows]
+    return counts + [LAST_ACTIVITY]
+
+
+def load_window_indexes(output_filepath, fmt='csv'):
+    """ Per-student event index of every table counted per window. """
+    return {table: load_event_index(output_filepath, table, fmt) for table in WINDOW_EVENTS}
+
+
+def window_features(student_ids, indexes, max_time, windows=WINDOWS, registered_time=None):
+    """ Events of each student in the trailing `windows` (days) ending at
+        `max_time`, per table of `indexes` (src/data/event_index.py), and the
+        whole days since their last event up to `max_time`, aligned to the
+        unique `student_ids`.
+
+        Each window costs two binary searches per student of the index.
+        Students without activity get `registered_time` as days since their
+        last activity, 0 without it.
+    """
+    student_ids = pd.Series(student_ids).to_numpy(dtype=np.int64, na_value=-1)
+    end = pd.Timestamp(max_time).as_unit('ns').value
+    columns, last = {}, np.full(len(student_ids), NAT)
+    for table, (_, prefix) in WINDOW_EVENTS.items():
+        index = indexes[table]
+        for window in windows:
+            counts = index.count_between(end - window * DAY, end)
+            columns[f'{prefix}_count_{window}d'] = index.align(counts, student_ids).astype(np.int32)
+        last = np.maximum(last, index.align(index.last_before(end), student_ids, NAT))
+    active = last != NAT
+    days = (end - np.where(active, last, end)) // DAY
+    inactive = 0 if registered_time is None else np.asarray(registered_time)
+    columns[LAST_ACTIVITY] = np.where(active, days, inactive).astype(np.int32)
+    return pd.DataFrame(columns)[window_columns(windows)]
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX, the textfile is written without a lock
+    fcntl = None
+
+# environment variables configuring the instrumentation, also read from .env
+METRICS_TEXTFILE = 'METRICS_TEXTFILE'  # Prometheus textfile updated after every stage
+PROFILE_STAGE = 'PROFILE_STAGE'  # comma separated stages to profile
+PROFILE_DIR = 'PROFILE_DIR'  # where the profiles are written, the working directory by default
+PROFILER = 'PROFILER'  # 'cprofile' (default) or 'py-spy'
+
+# Prometheus gauges of the last run of each stage: record field -> (metric, help)
+METRICS = {
+    'wall_seconds': ('pipeline_stage_wall_seconds', 'Wall-clock seconds of the last run of the stage.'),
+    'cpu_seconds': ('pipeline_stage_cpu_seconds', 'CPU seconds of the last run, its finished child processes '
+                                                  'included.'),
+    'peak_rss_delta_bytes': ('pipeline_stage_peak_rss_delta_bytes', 'Peak resident memory of the last run above '
+                                                                    'the resident memory at its start.'),
+    'rows_in': ('pipeline_stage_rows_in', 'Rows read by the last run.'),
+    'rows_out': ('pipeline_stage_rows_out', 'Rows produced by the last run.'),
+    'bytes_in': ('pipeline_stage_bytes_in', 'In-memory bytes of the frames read by the last run.'),
+    'bytes_out': ('pipeline_stage_bytes_out', 'In-memory bytes of the frames produced by the last run.'),
+    'timestamp': ('pipeline_stage_last_run_timestamp_seconds', 'Unix time the last run finished.'),
+}
+
+logger = logging.getLogger(__name__)
+
+# open stages of this process, innermost last
+_stack = []
+# last record of each stage and labels, for the textfile
+_latest = {}
+
+
+def rss():
+    """ Resident memory of the process, in bytes. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss():
+    """ Peak resident memory of the process since it started, or since the
+        last `reset_peak_rss`, in bytes.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """ Resets the peak resident memory to the current one; only Linux
+        supports it. Returns whether it did.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def cpu_time():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def frame_size(value):
+    """ Rows and in-memory bytes of a frame, a series or an array, or of the
+        ones in a tuple, list or dict; strings are counted by their arrow
+        buffers, object columns by their pointers.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value), int(value.memory_usage(index=True).sum() if isinstance(value, pd.DataFrame)
+                               else value.memory_usage(index=True))
+    if isinstance(value, np.ndarray):
+        return (len(value) if value.ndim else 1), value.nbytes
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        sizes = [frame_size(item) for item in value]
+        return sum(rows for rows, _ in sizes), sum(nbytes for _, nbytes in sizes)
+    return 0, 0
+
+
+def record_input(df):
+    """ Counts a frame read from storage in every open stage. """
+    rows, nbytes = frame_size(df)
+    for record in _stack:
+        record.rows_in += rows
+        record.bytes_in += nbytes
+
+
+def record_output(df):
+    """ Counts a frame written to storage in every open stage. """
+    rows, nbytes = frame_size(df)
+    for record in _stack:
+        record.rows_out += rows
+        record.bytes_out += nbytes
+
+
+class Stage:
+    """ Measures one run of a pipeline stage, as a context manager.
+
+        It records the wall and CPU time, the peak resident memory above the
+        one at the start, and the rows and bytes read and written through
+        src.data.storage, which counts them in every open stage. The record
+        is logged as one JSON line and, when METRICS_TEXTFILE is set, merged
+        into that Prometheus textfile. The stages named by PROFILE_STAGE run
+        under cProfile, or py-spy with PROFILER=py-spy.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = {key: str(value) for key, value in labels.items()}
+        self.rows_in = self.rows_out = self.bytes_in = self.bytes_out = 0
+
+    def add_input(self, value):
+        rows, nbytes = frame_size(value)
+        self.rows_in += rows
+        self.bytes_in += nbytes
+
+    def add_output(self, value):
+        rows, nbytes = frame_size(value)
+        self.rows_out += rows
+        self.bytes_out += nbytes
+
+    def __enter__(self):
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, peak_rss())
+        _stack.append(self)
+        # without a resettable peak the stage only sees the process peak
+        self.start_rss = rss() if reset_peak_rss() else peak_rss()
+        self.peak = self.start_rss
+        self.profiler = start_profiler(self.name)
+        self.start_cpu, self.start = cpu_time(), time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = cpu_time() - self.start_cpu
+        stop_profiler(self.profiler)
+        self.peak = max(self.peak, peak_rss())
+        _stack.pop()
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, self.peak)
+
+        record = {'stage': self.name, **self.labels, 'status': 'error' if exc_type else 'ok', 'pid': os.getpid(),
+                  'started': datetime.fromtimestamp(time.time() - wall).isoformat(),
+                  'wall_seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6),
+                  'peak_rss_delta_bytes': max(0, self.peak - self.start_rss),
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                  'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+        logger.info(json.dumps(record))
+        _latest[(self.name, tuple(sorted(self.labels.items())))] = dict(record, timestamp=time.time())
+        if os.environ.get(METRICS_TEXTFILE):
+            write_textfile(os.environ[METRICS_TEXTFILE])
+        return False
+
+
+def stage(name, **labels):
+    """ Context manager measuring a block as the stage `name`. """
+    return Stage(name, **labels)
+
+
+def instrumented(func=None, *, name=None):
+    """ Decorator measuring every call of a stage function, named after the
+        function by default. Besides the storage reads and writes, the
+        frames passed to the function count as its input and the frames it
+        returns as its output.
+    """
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Stage(stage_name) as record:
+                record.add_input(list(args) + list(kwargs.values()))
+                result = func(*args, **kwargs)
+                record.add_output(result)
+                return result
+        return wrapper
+    return decorate(func) if func is not None else decorate
+
+
+def profiled_stages():
+    return {name.strip() for name in os.environ.get(PROFILE_STAGE, '').split(',') if name.strip()}
+
+
+def start_profiler(name):
+    """ Starts profiling the stage `name` when PROFILE_STAGE names it. """
+    if name not in profiled_stages():
+        return None
+    directory = os.environ.get(PROFILE_DIR, '.')
+    os.makedirs(directory, exist_ok=True)
+    path = f'{directory}/{name}.{os.getpid()}'
+    if os.environ.get(PROFILER, 'cprofile') == 'py-spy':
+        if shutil.which('py-spy') is None:
+            logger.warning('PROFILER=py-spy but py-spy is not installed, %s is not profiled', name)
+            return None
+        process = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--format', 'speedscope',
+                                    '--output', f'{path}.speedscope.json'])
+        logger.info('py-spy recording %s into %s.speedscope.json', name, path)
+        return {'process': process}
+    profile = cProfile.Profile()
+    profile.enable()
+    return {'profile': profile, 'path': f'{path}.prof'}
+
+
+def stop_profiler(profiler):
+    if profiler is None:
+        return
+    if 'process' in profiler:
+        # py-spy writes its output when interrupted
+        profiler['process'].send_signal(signal.SIGINT)
+        profiler['process'].wait(timeout=60)
+        return
+    profiler['profile'].disable()
+    profiler['profile'].dump_stats(profiler['path'])
+    logger.info('profile written to %s', profiler['path'])
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_textfile(path):
+    """ Merges the last record of each stage of this process into the
+        Prometheus textfile `path`, keeping the samples other processes
+        wrote, and replaces it atomically.
+    """
+    with open(f'{path}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        samples = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip() and not line.startswith('#'):
+                        key, value = line.rsplit(' ', 1)
+                        samples[key] = value.strip()
+        for (name, labels), record in _latest.items():
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in (('stage', name),) + labels)
+            for field, (metric, _) in METRICS.items():
+                samples[f'{metric}{{{label_text}}}'] = repr(float(record[field]))
+
+        lines = []
+        for metric, help_text in METRICS.values():
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+            lines += [f'{key} {value}' for key, value in sorted(samples.items()) if key.split('{')[0] == metric]
+        with open(f'{path}.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import click
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+from joblib import load
+
+from src.models.train_model import MODEL_PATH
+
+ARRAYS = ['feature', 'threshold', 'left', 'missing_left', 'value', 'roots']
+# (tree, row) pairs traversed together, bounds the memory of one batch
+BATCH_NODES = 1000000
+
+logger = logging.getLogger(__name__)
+
+
+def forest_path(model_path=MODEL_PATH):
+    """ Directory of the compiled forest next to the model artifact. """
+    return f'{os.path.splitext(model_path)[0]}_forest'
+
+
+def breadth_first(tree):
+    """ Nodes of `tree` in breadth-first order, the two children of a node
+        next to each other, and the position of each node in that order.
+    """
+    order, level = [], np.array([0])
+    while len(level):
+        order.append(level)
+        split = level[tree.children_left[level] != -1]
+        level = np.column_stack([tree.children_left[split], tree.children_right[split]]).ravel()
+    order = np.concatenate(order)
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    return order, position
+
+
+def compile_forest(classifier, features, path):
+    """ Writes the trees of a fitted RandomForestClassifier as flat node
+        arrays, one .npy file each so they can be memory mapped.
+
+        The nodes of every tree are renumbered breadth first, so the right
+        child of a node follows its left child, and the trees concatenated.
+        A leaf is its own left child and never goes right: its threshold is
+        infinite and it sends missing values left. `value` holds the class
+        fractions of each node, what the tree predicts for a row ending
+        there.
+    """
+    arrays = {name: [] for name in ARRAYS}
+    offset = 0
+    for estimator in classifier.estimators_:
+        tree = estimator.tree_
+        order, position = breadth_first(tree)
+        leaf = tree.children_left[order] == -1
+        arrays['roots'].append(offset)
+        arrays['feature'].append(np.where(leaf, 0, tree.feature[order]))
+        arrays['threshold'].append(np.where(leaf, np.inf, tree.threshold[order]))
+        arrays['left'].append(offset + np.where(leaf, np.arange(len(order)), position[tree.children_left[order]]))
+        arrays['missing_left'].append(leaf | tree.missing_go_to_left[order].astype(bool))
+        arrays['value'].append(tree.value[order, 0, :classifier.n_classes_])
+        offset += len(order)
+    arrays = {name: np.array(values) if name == 'roots' else np.concatenate(values) for name, values in arrays.items()}
+    arrays['feature'] = arrays['feature'].astype(np.int32)
+
+    tmp = f'{path}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ARRAYS:
+        np.save(f'{tmp}/{name}.npy', arrays[name])
+    with open(f'{tmp}/meta.json', 'w') as f:
+        json.dump({'features': list(features), 'classes': classifier.classes_.tolist(),
+                   'trees': len(arrays['roots']), 'nodes': offset,
+                   'max_depth': max(estimator.tree_.max_depth for estimator in classifier.estimators_)},
+                  f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    return path
+
+
+class CompiledForest:
+    """ RandomForestClassifier evaluated from the compiled node arrays.
+
+        predict_proba is bit-identical to the classifier's when it runs on
+        one thread: the rows are cast to float32 as sklearn does, every tree
+        is traversed level by level for the whole batch at once, and the
+        leaf values are summed tree by tree in the forest's order before
+        dividing by the number of trees.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(f'{path}/meta.json') as f:
+            self.meta = json.load(f)
+        self.features = self.meta['features']
+        self.classes_ = np.array(self.meta['classes'])
+        for name in ARRAYS:
+            setattr(self, name, np.load(f'{path}/{name}.npy', mmap_mode=mmap_mode))
+
+    def leaves(self, x):
+        """ Leaf reached by every row of `x` in every tree, shape
+            (trees, rows). Each level moves all the (tree, row) pairs one
+            node down: to the left child, or the node after it.
+        """
+        missing = np.isnan(x).any()
+        flat = x.astype(np.float64).ravel()
+        rows = (np.arange(len(x)) * x.shape[1])[None, :]
+        nodes = np.repeat(self.roots[:, None], len(x), axis=1)
+        for _ in range(self.meta['max_depth']):
+            values = flat[rows + self.feature[nodes]]
+            go_right = values > self.threshold[nodes]
+            if missing:
+                go_right |= np.isnan(values) & ~self.missing_left[nodes]
+            nodes = self.left[nodes] + go_right
+        return nodes
+
+    def predict_proba(self, df):
+        x = df[self.features].to_numpy(dtype=np.float32, na_value=np.nan)
+        proba = np.empty((len(x), len(self.classes_)))
+        batch = max(1, BATCH_NODES // len(self.roots))
+        for start in range(0, len(x), batch):
+            # summing over the leading axis adds the trees one after another,
+            # in the order the forest accumulates them
+            proba[start:start + batch] = self.value[self.leaves(x[start:start + batch])].sum(axis=0)
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, df):
+        return self.classes_[self.predict_proba(df).argmax(axis=1)]
+
+
+@click.command()
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH,
+              help='Model artifact written by train_model.')
+def main(model_path):
+    """ Compiles the classifier of the model artifact into node arrays. """
+    artifact = load(model_path)
+    path = compile_forest(artifact['classifier'], artifact['features'], forest_path(model_path))
+    forest = CompiledForest(path)
+    logger.info(f'{forest.meta["trees"]} trees, {forest.meta["nodes"]} nodes compiled in {path}')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
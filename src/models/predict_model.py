@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import click
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import find_dotenv, load_dotenv
+import numpy as np
+import pandas as pd
+from joblib import load
+
+from src.data.storage import FORMATS, DatasetWriter, iter_dataset
+from src.instrumentation import instrumented, stage
+from src.models.train_model import MODEL_PATH
+
+SCORERS = ['forest', 'centroid']
+# students of the first chunk the centroid scorer is checked against the classifier on
+AGREEMENT_ROWS = 10000
+
+logger = logging.getLogger(__name__)
+
+# artifact of the current worker process, loaded once by `init_worker`
+_artifact = None
+
+
+def load_artifact(path=MODEL_PATH, mmap_mode=None):
+    """ Model artifact written by train_model: a dict with the `features`
+        list, the `scaler` and `kmeans` that segment the students and the
+        `classifier` that scores them from the unscaled features.
+    """
+    artifact = load(path, mmap_mode=mmap_mode)
+    missing = {'features', 'scaler', 'kmeans', 'classifier'} - set(artifact)
+    if missing:
+        raise ValueError(f'{path} is not a model artifact, missing {sorted(missing)}; retrain with `make model`')
+    return artifact
+
+
+def score_forest(artifact, df):
+    """ Class probabilities of the classifier. """
+    return artifact['classifier'].predict_proba(df[artifact['features']])
+
+
+def score_centroid(artifact, df):
+    """ Soft assignment of each student to the KMeans centroids.
+
+        The features are standardized with the scaler's mean and scale and
+        the squared distances to every centroid computed in one vectorized
+        pass; the probabilities are a softmax of minus half the squared
+        distances, so the most probable cluster is the nearest centroid,
+        the assignment the classifier was trained to reproduce.
+    """
+    scaler, centers = artifact['scaler'], artifact['kmeans'].cluster_centers_
+    x = (df[artifact['features']].to_numpy(dtype=np.float64) - scaler.mean_) / scaler.scale_
+    distances = np.empty((len(x), len(centers)))
+    for j, center in enumerate(centers):
+        distances[:, j] = ((x - center) ** 2).sum(axis=1)
+    logits = -0.5 * (distances - distances.min(axis=1, keepdims=True))
+    probabilities = np.exp(logits)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def score(artifact, df, scorer='forest'):
+    """ Cluster and probability of the predicted cluster of each student of
+        an ABT chunk, from the classifier or the nearest centroid.
+    """
+    if scorer == 'centroid':
+        probabilities = score_centroid(artifact, df)
+        classes = np.arange(probabilities.shape[1])
+    else:
+        probabilities = score_forest(artifact, df)
+        classes = artifact['classifier'].classes_
+    best = probabilities.argmax(axis=1)
+    return pd.DataFrame({'StudentId': df.Id.values,
+                         'cluster': classes[best],
+                         'probability': probabilities.max(axis=1)})
+
+
+def agreement(artifact, df):
+    """ Share of the students of `df` the nearest centroid assigns to the
+        cluster the classifier predicts.
+    """
+    forest = artifact['classifier'].classes_[score_forest(artifact, df).argmax(axis=1)]
+    return float((score_centroid(artifact, df).argmax(axis=1) == forest).mean())
+
+
+def check_agreement(artifact, df):
+    """ Logs the `agreement` of the centroid scorer on the first
+        AGREEMENT_ROWS students of `df`, so a centroid run shows when it
+        drifts from the classifier.
+    """
+    sample = df.head(AGREEMENT_ROWS)
+    with stage('centroid_agreement') as record:
+        record.add_input(sample)
+        share = agreement(artifact, sample)
+    logger.info(f'centroid agrees with the classifier on {share:.2%} of {len(sample)} students')
+    return share
+
+
+def init_worker(path):
+    global _artifact
+    # the model arrays are memory mapped, so the workers share their pages
+    _artifact = load_artifact(path, mmap_mode='r')
+    _artifact['classifier'].set_params(n_jobs=1)
+
+
+def score_in_worker(df, scorer):
+    return score(_artifact, df, scorer)
+
+
+@instrumented
+def predict(output_filepath, fmt='csv', model_path=MODEL_PATH, chunk_size=100000, workers=1, scorer='forest'):
+    """ Scores the ABT in chunks of `chunk_size` students with `scorer`,
+        appending each chunk's predictions to the `predictions` dataset.
+        With more than one worker the chunks are scored in a process pool,
+        at most two chunks per worker in flight, and written in ABT order.
+        The centroid scorer is first checked against the classifier on the
+        first chunk (`check_agreement`). Returns the number of students
+        scored.
+    """
+    artifact = load_artifact(model_path)
+    chunks = iter_dataset(output_filepath, 'abt_segmentation', ['Id'] + artifact['features'], chunk_size, fmt)
+    if scorer == 'centroid':
+        first = next(chunks, None)
+        if first is not None:
+            check_agreement(artifact, first)
+            chunks = itertools.chain([first], chunks)
+    with DatasetWriter(output_filepath, 'predictions', fmt) as writer:
+        if workers <= 1:
+            for df in chunks:
+                writer.write(score(artifact, df, scorer))
+            return writer.rows
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_path,)) as pool:
+            in_flight = deque()
+            for df in chunks:
+                in_flight.append(pool.submit(score_in_worker, df, scorer))
+                if len(in_flight) >= 2 * workers:
+                    writer.write(in_flight.popleft().result())
+            while in_flight:
+                writer.write(in_flight.popleft().result())
+    return writer.rows
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH,
+              help='Model artifact written by train_model.')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=100000, help='Students scored per chunk.')
+@click.option('--workers', type=click.IntRange(min=1), default=1, help='Processes scoring the chunks.')
+@click.option('--scorer', type=click.Choice(SCORERS), default='forest',
+              help='The classifier, or the nearest KMeans centroid for cheap bulk runs.')
+def main(input_filepath, output_filepath, storage_format, model_path, chunk_size, workers, scorer):
+    """ Predicts the cluster of every student of the ABT into the
+        `predictions` dataset.
+    """
+    logger.info(f'scoring the students of the ABT with the {scorer} scorer')
+    start = time.perf_counter()
+    rows = predict(output_filepath, storage_format, model_path, chunk_size, workers, scorer)
+    elapsed = time.perf_counter() - start
+    print(f'{rows} students scored in {elapsed:.2f}s ({rows / elapsed:.0f} students/s)')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import click
+import hashlib
+import json
+import logging
+import os
+
+from dotenv import find_dotenv, load_dotenv
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from src.data.storage import FORMATS, read_dataset
+from src.models.train_model import get_features, optimal_number_of_clusters, score_ks
+
+WCSS_CACHE = 'wcss_cache.json'
+SCORES = ['k', 'wcss', 'silhouette']
+
+logger = logging.getLogger(__name__)
+
+
+def abt_hash(features):
+    """ sha256 of the feature values, columns and student ids. """
+    digest = hashlib.sha256(pd.util.hash_pandas_object(features, index=True).values.tobytes())
+    digest.update(json.dumps(list(features.columns)).encode())
+    return digest.hexdigest()
+
+
+def stratified_sample(features, strata, sample_size, random_state=0):
+    """ About `sample_size` rows of `features`, keeping the share of each
+        stratum.
+    """
+    if sample_size >= len(features):
+        return features
+    fraction = sample_size / len(features)
+    return features.groupby(strata.values, observed=True, group_keys=False).sample(frac=fraction,
+                                                                                   random_state=random_state)
+
+
+def load_cache(output_filepath):
+    path = f'{output_filepath}/{WCSS_CACHE}'
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(output_filepath, cache):
+    path = f'{output_filepath}/{WCSS_CACHE}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def select_k(df_abt, output_filepath, ks, workers=None, sample_size=None, stratify='region', minibatch=False,
+             silhouette_sample=None, random_state=0, use_cache=True):
+    """ Scores of each k and the elbow of the WCSS curve. The scores are
+        cached by the hash of the ABT features and the sweep settings;
+        without `use_cache` they are recomputed and their entry replaced.
+    """
+    features = get_features(df_abt)
+    settings = {'abt': abt_hash(features), 'ks': list(ks), 'sample_size': sample_size, 'stratify': stratify,
+                'minibatch': minibatch, 'silhouette_sample': silhouette_sample, 'random_state': random_state}
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    cache = load_cache(output_filepath)
+
+    if use_cache and key in cache:
+        logger.info('WCSS curve loaded from the cache')
+        scores = pd.DataFrame(cache[key], columns=[column for column in SCORES if column in cache[key]])
+    else:
+        data = pd.DataFrame(StandardScaler().fit_transform(features), index=features.index)
+        if sample_size:
+            strata = df_abt.set_index('Id')[stratify]
+            data = stratified_sample(data, strata, sample_size, random_state)
+        scores = pd.DataFrame(score_ks(data.values, ks, workers, minibatch, random_state, silhouette_sample))
+        cache[key] = scores.to_dict(orient='list')
+        save_cache(output_filepath, cache)
+    return scores, optimal_number_of_clusters(scores.wcss.tolist(), scores.k.tolist())
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--k-min', type=click.IntRange(min=2), default=2)
+@click.option('--k-max', type=click.IntRange(min=3), default=20)
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Parallel fits, defaults to the number of CPUs.')
+@click.option('--sample-size', type=click.IntRange(min=1), default=None,
+              help='Fit on a stratified sample of about this many students.')
+@click.option('--stratify', default='region', help='ABT column the sample is stratified on.')
+@click.option('--minibatch', is_flag=True, help='Fit with MiniBatchKMeans.')
+@click.option('--silhouette-sample', type=click.IntRange(min=2), default=None,
+              help='Also compute the silhouette score of each k on this many rows.')
+@click.option('--random-state', default=0)
+@click.option('--no-cache', is_flag=True, help='Recompute the WCSS curve even when it is cached.')
+def main(input_filepath, output_filepath, storage_format, k_min, k_max, workers, sample_size, stratify, minibatch,
+         silhouette_sample, random_state, no_cache):
+    """ Sweeps the number of k-means clusters of the ABT and prints the
+        WCSS curve, the silhouette scores and the elbow.
+    """
+    if k_max - k_min < 1:
+        raise click.BadParameter(f'must be above --k-min ({k_min}), the elbow needs at least two k',
+                                 param_hint='--k-max')
+    df_abt = read_dataset(output_filepath, 'abt_segmentation', fmt=storage_format)
+    scores, k = select_k(df_abt, output_filepath, range(k_min, k_max + 1), workers, sample_size, stratify,
+                         minibatch, silhouette_sample, random_state, not no_cache)
+    print(scores.to_string(index=False))
+    print(f'elbow k = {k}')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
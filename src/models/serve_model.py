@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import click
+import json
+import logging
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from dotenv import find_dotenv, load_dotenv
+import numpy as np
+import pandas as pd
+
+from src.data.storage import FORMATS, read_dataset
+from src.models.compiled_forest import CompiledForest, forest_path
+from src.models.predict_model import load_artifact
+from src.models.train_model import MODEL_PATH
+
+logger = logging.getLogger(__name__)
+
+# requests kept for the latency percentiles
+METRICS_WINDOW = 10000
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class SegmentService:
+    """ Serves the segment of a student from the warm model.
+
+        The ABT features are held in memory, indexed by student Id, so a
+        request only carries the StudentId. Concurrent requests are queued
+        and scored together: a batch is closed after `max_batch` rows or
+        `max_wait` seconds after its first row. `classifier` is the
+        artifact's forest or its CompiledForest, which scores such small
+        batches much faster.
+    """
+
+    def __init__(self, features, feature_names, classifier, max_batch=256, max_wait=0.002):
+        self.feature_names = feature_names
+        self.classifier = classifier
+        self.values = features[self.feature_names].to_numpy(dtype=np.float64)
+        self.index = {student_id: row for row, student_id in enumerate(features.index)}
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = None
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.batch_sizes = deque(maxlen=METRICS_WINDOW)
+        self.requests = 0
+        # first prediction outside of any request
+        self.predict(self.values[:1])
+
+    def predict(self, rows):
+        return self.classifier.predict_proba(pd.DataFrame(rows, columns=self.feature_names))
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # requests cancelled while waiting are not scored
+            batch = [(row, future) for row, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                rows = self.values[[row for row, _ in batch]]
+                probabilities = await loop.run_in_executor(None, self.predict, rows)
+            except Exception as e:
+                logger.exception(f'scoring a batch of {len(batch)} failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batch_sizes.append(len(batch))
+            for (_, future), probability in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(probability)
+
+    async def segment(self, student_id):
+        row = self.index.get(student_id)
+        if row is None:
+            return 404, {'error': f'unknown StudentId {student_id}'}
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, future))
+        probability = await future
+        best = int(probability.argmax())
+        return 200, {'StudentId': student_id, 'cluster': int(self.classifier.classes_[best]),
+                     'probability': float(probability[best])}
+
+    def metrics(self):
+        latencies = np.array(self.latencies) * 1000
+        batch_sizes = np.array(self.batch_sizes)
+        return {'requests': self.requests,
+                'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'batches': len(batch_sizes),
+                'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) else None,
+                'max_batch_size': int(batch_sizes.max()) if len(batch_sizes) else None}
+
+    async def route(self, method, target):
+        path = urlsplit(target).path.rstrip('/')
+        if method == 'GET' and path == '/metrics':
+            return 200, self.metrics()
+        if method == 'GET' and path.startswith('/segment/'):
+            try:
+                student_id = int(path.rsplit('/', 1)[1])
+            except ValueError:
+                return 400, {'error': 'StudentId must be an integer'}
+            start = time.perf_counter()
+            try:
+                status, payload = await self.segment(student_id)
+            except Exception:
+                # logged by run_batches
+                return 500, {'error': f'scoring StudentId {student_id} failed'}
+            self.latencies.append(time.perf_counter() - start)
+            self.requests += 1
+            return status, payload
+        return 404, {'error': f'no route for {method} {path}'}
+
+    async def handle(self, reader, writer):
+        """ HTTP/1.1 connection, kept alive until the client closes it. """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self.route(method, target)
+                body = json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.queue = asyncio.Queue()
+        batches = asyncio.create_task(self.run_batches())
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f'serving {len(self.index)} students on http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batches.cancel()
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=MODEL_PATH,
+              help='Model artifact written by train_model.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--max-batch', type=click.IntRange(min=1), default=256, help='Most requests scored together.')
+@click.option('--max-wait-ms', type=click.FloatRange(min=0), default=2.0,
+              help='Longest a request waits for its batch to fill.')
+@click.option('--compiled', is_flag=True,
+              help='Score with the compiled forest written by src/models/compiled_forest.py.')
+def main(input_filepath, output_filepath, storage_format, model_path, host, port, max_batch, max_wait_ms,
+         compiled):
+    """ Serves GET /segment/<StudentId> and GET /metrics from the model and
+        the ABT features.
+    """
+    if compiled:
+        classifier = CompiledForest(forest_path(model_path))
+        feature_names = classifier.features
+    else:
+        artifact = load_artifact(model_path)
+        classifier = artifact['classifier'].set_params(n_jobs=1)
+        feature_names = artifact['features']
+    features = read_dataset(output_filepath, 'abt_segmentation', columns=['Id'] + feature_names,
+                            fmt=storage_format).set_index('Id')
+    service = SegmentService(features, feature_names, classifier, max_batch, max_wait_ms / 1000)
+    asyncio.run(service.serve(host, port))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
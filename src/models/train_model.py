@@ -11,89 +11,115 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import f1_score, roc_auc_score
 
 from sklearn.model_selection import train_test_split
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from collections import Counter
-from sklearn.metrics import confusion_matrix
+from sklearn.metrics import confusion_matrix, silhouette_score
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from joblib import dump, load
+from joblib import Parallel, delayed, dump, load
+
+from src.data.storage import FORMATS, read_dataset
+from src.instrumentation import instrumented, stage
 
 # %% Kmeans
 
-def optimal_number_of_clusters(wcss):
-    x1, y1 = 2, wcss[0]
-    x2, y2 = 20, wcss[len(wcss) - 1]
+MODEL_PATH = f'{Path(__file__).resolve().parents[2]}/models/user_cluster.joblib'
+K_VALUES = range(2, 21)
+BEST_FEATURES = ['fileview_count',
+                 'session_count',
+                 'session_rate',
+                 'fileview_rate',
+                 'usage_weekly_mean',
+                 'usage_weekly_count',
+                 'payment_total',
+                 'payment_monthly',
+                 'cancelation_count',
+                 'mobile']
+
+
+def get_features(df_abt):
+    """ The clustering features of the ABT, indexed by student Id. """
+    return df_abt.set_index('Id')[BEST_FEATURES]
+
+
+@instrumented
+def segment(features, n_clusters=2):
+    """ Standardizes the features and clusters the students with KMeans,
+        returning the scaler, the KMeans and the cluster of each student.
+    """
+    scaler = StandardScaler()
+    kmeans = KMeans(n_clusters=n_clusters, init='random',
+                    n_init=10, max_iter=300,
+                    tol=1e-04, random_state=0)
+    return scaler, kmeans, kmeans.fit_predict(scaler.fit_transform(features))
+
+
+def optimal_number_of_clusters(wcss, ks=K_VALUES):
+    """ Elbow of the WCSS curve: the k farthest from the line joining the
+        first and the last point of the curve.
+    """
+    ks = list(ks)
+    x1, y1 = ks[0], wcss[0]
+    x2, y2 = ks[-1], wcss[-1]
 
     distances = []
-    for i in range(len(wcss)):
-        x0 = i + 2
-        y0 = wcss[i]
+    for x0, y0 in zip(ks, wcss):
         numerator = abs((y2 - y1) * x0 - (x2 - x1) * y0 + x2 * y1 - y2 * x1)
-        denominator = np.sqrt((y2 - y1) * 2 + (x2 - x1) * 2)
+        denominator = np.sqrt((y2 - y1) ** 2 + (x2 - x1) ** 2)
         distances.append(numerator / denominator)
 
-    return distances.index(max(distances)) + 2
+    return ks[distances.index(max(distances))]
 
 
-def calculate_wcss(data):
-    wcss = []
-    for n in range(2, 21):
-        kmeans = KMeans(n_clusters=n)
-        kmeans.fit(X=data)
-        wcss.append(kmeans.inertia_)
+def fit_kmeans(data, k, minibatch=False, random_state=0):
+    if minibatch:
+        kmeans = MiniBatchKMeans(n_clusters=k, n_init=3, random_state=random_state)
+    else:
+        kmeans = KMeans(n_clusters=k, n_init=10, random_state=random_state)
+    return kmeans.fit(data)
 
-    return wcss
 
+def score_k(data, k, minibatch=False, random_state=0, silhouette_sample=None):
+    """ WCSS of a k-means fit with k clusters and, when `silhouette_sample`
+        is given, its silhouette score on a sample of that many rows.
+    """
+    kmeans = fit_kmeans(data, k, minibatch, random_state)
+    score = {'k': k, 'wcss': kmeans.inertia_}
+    if silhouette_sample:
+        score['silhouette'] = silhouette_score(data, kmeans.labels_, sample_size=min(silhouette_sample, len(data)),
+                                               random_state=random_state)
+    return score
 
-@click.command()
-@click.argument('input_filepath', type=click.Path(exists=True))
-@click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
-    df_abt = pd.read_csv(f"{output_filepath}/abt_segmentation.csv")
-    df_abt.loc[df_abt.State=="0",'State'] = "NA"
-    df_abt.loc[df_abt.City=="0",'City'] = "NA"
-    df_abt.head()
 
-    #%%
+def score_ks(data, ks=K_VALUES, workers=None, minibatch=False, random_state=0, silhouette_sample=None):
+    """ `score_k` of each k, the fits running in `workers` processes (all
+        cores by default).
+    """
+    return Parallel(n_jobs=workers or -1)(delayed(score_k)(data, k, minibatch, random_state, silhouette_sample)
+                                          for k in ks)
 
-    categorical = ['CourseName']
-    df_abt_categorical = df_abt[categorical]
-    df_abt_categorical.index = df_abt.index
-    ohe = pd.get_dummies(df_abt_categorical)
-    df_train_full = pd.concat([df_abt,ohe],axis=1)
-
-    df_train_full.drop(categorical+['UniversityName','State','City',"region"], axis=1, inplace=True)
-    df_train_full.index = df_train_full["Id"]
-    df_train_full.head()
-    best_features = ["Id",
-                      'fileview_count',
-                     'session_count',
-                     'session_rate',
-                     'fileview_rate',
-                     'usage_weekly_mean',
-                     'usage_weekly_count',
-                     'payment_total',
-                     'payment_monthly',
-                     'cancelation_count',
-                     'mobile']
-    df_train_full = df_train_full[best_features]
-    ### Clusterização com Kmeans
 
+def calculate_wcss(data, ks=K_VALUES, workers=None, minibatch=False, random_state=0):
+    """ WCSS for each k. """
+    return [score['wcss'] for score in score_ks(data, ks, workers, minibatch, random_state)]
 
 
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+def main(input_filepath, output_filepath, storage_format):
+    df_abt = read_dataset(output_filepath, 'abt_segmentation', fmt=storage_format)
+    df_train_full = get_features(df_abt)
+    ### Clusterização com Kmeans
+
     #%%
 
-    df_classification = df_train_full.drop('Id',axis=1)
-    sc = StandardScaler()
-    df_classification_scaled = sc.fit_transform(df_classification)
-    n = 2
-    kmeans = KMeans(n_clusters=n, init='random',
-                    n_init=10, max_iter=300,
-                    tol=1e-04, random_state=0)
-    kmeans.fit(df_classification_scaled)
-    clusters = kmeans.fit_predict(df_classification_scaled).copy()
+    df_classification = df_train_full
+    sc, kmeans, clusters = segment(df_classification)
 
     clusters_list = list(clusters)
 
@@ -116,25 +142,25 @@ def main(input_filepath, output_filepath):
                                n_jobs = -1,
                                 class_weight='balanced_subsample',
                                random_state = 42)
-    rf.fit(X_train, y_train)
+    with stage('forest_fit') as record:
+        record.add_input(X_train)
+        rf.fit(X_train, y_train)
     print( f'score_train = {rf.score(X_train, y_train)}' )
 
     #%%
 
     print( f'score_validation = {rf.score(X_valid, y_valid)}'  )
 
-    path = Path(__file__).resolve().parents[2]
-
-    dump(rf, f'{path}/models/user_cluster.joblib')
-    print( f'model saved in = {path}/models'  )
+    # the scaler and KMeans segment the students, the classifier scores them
+    # from the unscaled features
+    artifact = {'features': list(df_classification.columns), 'scaler': sc, 'kmeans': kmeans, 'classifier': rf}
+    dump(artifact, MODEL_PATH)
+    print( f'model saved in = {MODEL_PATH}'  )
 
     y_pred = rf.predict(X_valid)
     y_pred_prob = rf.predict_proba(X_valid)
-    print(y_valid.values)
-    print(y_pred)
     df = pd.DataFrame(y_pred_prob)
     df.columns = ['a', 'b']
-    print(df)
     print( f'f1_score_validation = {f1_score(y_valid.values, y_pred.round())}'  )
     print( f'roc_curve_validation = {roc_auc_score(y_valid.values,df.b)}'  )
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import click
+import itertools
+import logging
+import math
+import os
+import time
+
+from dotenv import find_dotenv, load_dotenv
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, dump, load
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+from src.data.storage import FORMATS, read_dataset
+from src.models.select_k import abt_hash
+from src.models.train_model import get_features, segment
+
+TUNING_CACHE = 'tuning_cache'
+TUNING_REPORT = 'tuning_report.csv'
+N_ESTIMATORS = (25, 50, 100, 200)
+MAX_DEPTH = (4, 8, 0)
+MAX_FEATURES = ('sqrt', '0.5', '1.0')
+SCORES = ['f1', 'auc', 'fit_seconds', 'predict_us', 'nodes']
+REPORT = ['n_estimators', 'max_depth', 'max_features', 'rung', 'rows'] + SCORES
+
+logger = logging.getLogger(__name__)
+
+
+def candidates(n_estimators=N_ESTIMATORS, max_depth=MAX_DEPTH, max_features=MAX_FEATURES):
+    """ Forest settings of the grid; a max_depth of 0 grows the trees fully
+        and max_features is 'sqrt', 'log2' or a fraction of the features.
+    """
+    return [{'n_estimators': n, 'max_depth': depth or None,
+             'max_features': features if features in ('sqrt', 'log2') else float(features)}
+            for n, depth, features in itertools.product(n_estimators, max_depth, max_features)]
+
+
+def cached_folds(df_abt, output_filepath, n_folds=3, random_state=0):
+    """ Path of the features, KMeans segments and stratified folds of the
+        ABT, cached by the hash of the ABT features. Each training fold is
+        shuffled once, so a rung trains on a prefix of it.
+    """
+    features = get_features(df_abt)
+    path = f'{output_filepath}/{TUNING_CACHE}/{abt_hash(features)[:16]}_{n_folds}_{random_state}.joblib'
+    if os.path.exists(path):
+        logger.info(f'folds loaded from {path}')
+        return path
+
+    _, _, y = segment(features)
+    rng = np.random.default_rng(random_state)
+    splits = StratifiedKFold(n_folds, shuffle=True, random_state=random_state).split(features, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # the rows are cast to float32 once, as the forest would on every fit
+    dump({'x': features.to_numpy(dtype=np.float32), 'y': y,
+          'folds': [(rng.permutation(train), valid) for train, valid in splits]}, f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def fit_fold(x, y, train, valid, params, random_state=42):
+    """ Accuracy and cost of one candidate on one fold: validation F1 and
+        AUC, fit seconds, predict microseconds per row and tree nodes.
+    """
+    forest = RandomForestClassifier(**params, class_weight='balanced_subsample', n_jobs=1,
+                                    random_state=random_state)
+    start = time.process_time()
+    forest.fit(x[train], y[train])
+    fit_seconds = time.process_time() - start
+    start = time.perf_counter()
+    probabilities = forest.predict_proba(x[valid])
+    predict_seconds = time.perf_counter() - start
+    predicted = forest.classes_[probabilities.argmax(axis=1)]
+    if len(forest.classes_) == 2:
+        f1 = f1_score(y[valid], predicted)
+        auc = roc_auc_score(y[valid], probabilities[:, 1])
+    else:
+        f1 = f1_score(y[valid], predicted, average='macro')
+        auc = roc_auc_score(y[valid], probabilities, multi_class='ovr', labels=forest.classes_)
+    return {'f1': f1, 'auc': auc, 'fit_seconds': fit_seconds, 'predict_us': predict_seconds / len(valid) * 1e6,
+            'nodes': sum(estimator.tree_.node_count for estimator in forest.estimators_)}
+
+
+def successive_halving(path, grid, factor=3, min_rows=100, workers=None, budget_seconds=None,
+                       budget_cpu_seconds=None):
+    """ Successive halving over the forest settings of `grid`.
+
+        Each rung fits the surviving candidates on every fold, in parallel,
+        and keeps the best 1/`factor` by F1; the training rows grow by
+        `factor` per rung so the last rung trains on the full folds. The
+        cached arrays are memory mapped, so the workers share them instead
+        of receiving a copy per candidate. No rung starts once the
+        wall-clock or CPU budget is spent. Returns one row per candidate
+        and rung.
+    """
+    data = load(path, mmap_mode='r')
+    x, y, folds = data['x'], data['y'], data['folds']
+    full_rows = min(len(train) for train, _ in folds)
+    # the last rung keeps at least `factor` candidates to compare
+    n_rungs = max(1, int(math.log(len(grid), factor) + 1e-9))
+    start, cpu = time.perf_counter(), 0.0
+
+    def spent():
+        return ((budget_seconds is not None and time.perf_counter() - start >= budget_seconds)
+                or (budget_cpu_seconds is not None and cpu >= budget_cpu_seconds))
+
+    results, survivors = [], list(range(len(grid)))
+    with Parallel(n_jobs=workers or -1, return_as='generator') as parallel:
+        for rung in range(n_rungs):
+            rows = min(full_rows, max(min_rows, full_rows // factor ** (n_rungs - 1 - rung)))
+            scores = []
+            for score in parallel(delayed(fit_fold)(x, y, train[:rows], valid, grid[candidate])
+                                  for candidate in survivors for train, valid in folds):
+                scores.append(score)
+                cpu += score['fit_seconds']
+                if spent():
+                    break
+            # candidates whose folds all finished before the budget ran out
+            evaluated = survivors[:len(scores) // len(folds)]
+            scores = pd.DataFrame(scores[:len(evaluated) * len(folds)], columns=SCORES)
+            rung_results = scores.groupby(np.repeat(evaluated, len(folds))).mean()
+            for candidate, score in rung_results.iterrows():
+                results.append({**grid[candidate], 'rung': rung, 'rows': rows, **score.to_dict()})
+            logger.info(f'rung {rung}: {len(evaluated)} of {len(survivors)} candidates on {rows} rows')
+            if spent():
+                logger.info(f'budget spent after {time.perf_counter() - start:.1f}s and {cpu:.1f} CPU seconds')
+                break
+            survivors = rung_results.f1.nlargest(max(1, len(survivors) // factor)).index.tolist()
+
+    report = pd.DataFrame(results, columns=REPORT)
+    report['max_depth'] = report.max_depth.astype('Int64')
+    return report
+
+
+def cheapest(report, min_f1=0.0, min_auc=0.0):
+    """ Row of the candidate with the lowest predict cost meeting the F1 and
+        AUC bar on the last rung, None when none does.
+    """
+    last = report.loc[report.rung == report.rung.max()]
+    meets = last.loc[(last.f1 >= min_f1) & (last.auc >= min_auc)]
+    if meets.empty:
+        return None
+    return meets.sort_values(['predict_us', 'fit_seconds']).iloc[0]
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--n-estimators', type=click.IntRange(min=1), multiple=True, default=N_ESTIMATORS)
+@click.option('--max-depth', type=click.IntRange(min=0), multiple=True, default=MAX_DEPTH,
+              help='0 grows the trees fully.')
+@click.option('--max-features', multiple=True, default=MAX_FEATURES,
+              help="'sqrt', 'log2' or a fraction of the features.")
+@click.option('--folds', type=click.IntRange(min=2), default=3)
+@click.option('--factor', type=click.IntRange(min=2), default=3, help='Candidates kept per rung are 1/factor.')
+@click.option('--min-rows', type=click.IntRange(min=10), default=100, help='Training rows of the first rung.')
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Parallel fits, defaults to the number of CPUs.')
+@click.option('--budget-seconds', type=click.FloatRange(min=0), default=None, help='Wall-clock budget.')
+@click.option('--budget-cpu-seconds', type=click.FloatRange(min=0), default=None,
+              help='Budget of CPU seconds spent fitting.')
+@click.option('--min-f1', type=click.FloatRange(0, 1), default=0.95)
+@click.option('--min-auc', type=click.FloatRange(0, 1), default=0.95)
+@click.option('--random-state', default=0)
+def main(input_filepath, output_filepath, storage_format, n_estimators, max_depth, max_features, folds, factor,
+         min_rows, workers, budget_seconds, budget_cpu_seconds, min_f1, min_auc, random_state):
+    """ Tunes the forest that scores the segments and writes the accuracy
+        and cost of every candidate to tuning_report.csv.
+    """
+    df_abt = read_dataset(output_filepath, 'abt_segmentation', fmt=storage_format)
+    path = cached_folds(df_abt, output_filepath, folds, random_state)
+    grid = candidates(n_estimators, max_depth, max_features)
+    report = successive_halving(path, grid, factor, min_rows, workers, budget_seconds, budget_cpu_seconds)
+    report.to_csv(f'{output_filepath}/{TUNING_REPORT}', index=False)
+
+    print(report.sort_values(['rung', 'f1'], ascending=False).to_string(index=False))
+    best = cheapest(report, min_f1, min_auc)
+    if best is None:
+        print(f'no candidate reaches f1 >= {min_f1} and auc >= {min_auc}')
+    else:
+        print(f'cheapest candidate with f1 >= {min_f1} and auc >= {min_auc}:')
+        print(best.to_string())
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import click
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dotenv import find_dotenv, load_dotenv
+
+from src.data import make_dataset
+from src.data.aggregate import AGGREGATIONS
+from src.data.incremental import EVENT_TIME, STATE_FILE
+from src.data.ingest import convert_json
+from src.data.storage import FORMATS, dataset_path
+from src.features import build_features
+from src.features.feature_store import CURRENT, STORE_DIR
+from src.features.windows import WINDOW_EVENTS
+from src.models import compiled_forest, train_model
+
+CACHE_FILE = 'pipeline_cache.json'
+
+logger = logging.getLogger(__name__)
+
+
+def train_model_node(input_filepath, output_filepath, fmt):
+    train_model.main.callback(input_filepath, output_filepath, fmt)
+    compiled_forest.main.callback(train_model.MODEL_PATH)
+
+
+def _node(func, args, inputs, outputs):
+    return {'func': func, 'args': args, 'inputs': inputs, 'outputs': outputs}
+
+
+def build_graph(input_filepath, output_filepath, fmt='csv'):
+    """ Pipeline nodes keyed by name. Each node declares the files it reads
+        and writes; a node depends on the nodes writing its inputs.
+    """
+    def processed(name):
+        return dataset_path(output_filepath, name, fmt)
+
+    raw_files = {'premium_students': 'BASE A'}
+    raw_files.update({file: 'BASE B' for file in make_dataset.BASE_B_FILES})
+
+    nodes = {}
+    for name, base in raw_files.items():
+        json_path = f'{input_filepath}/{base}/{name}.json'
+        nodes[f'ingest_{name}'] = _node(convert_json, (json_path, output_filepath, name, None, fmt),
+                                        [json_path], [processed(name)])
+    for name, spec in AGGREGATIONS.items():
+        nodes[name] = _node(make_dataset.create_aggregate, (output_filepath, name, fmt),
+                            [processed(spec['source'])], [processed(name)])
+    nodes['usage_weekly'] = _node(make_dataset.create_usage_weekly, (output_filepath, fmt),
+                                  [processed('students'), processed('sessions')],
+                                  [processed('sessions_weekly'), processed('usage_weekly')])
+    nodes['usage_device'] = _node(make_dataset.create_usage_device, (output_filepath, fmt),
+                                  [processed('fileViews')],
+                                  [processed('fileViews_clients'), processed('usage_device')])
+    built = [path for node in list(nodes.values())[len(raw_files):] for path in node['outputs']]
+    nodes['incremental_state'] = _node(make_dataset.create_incremental_state, (output_filepath, fmt),
+                                       [processed(table) for table in EVENT_TIME] + built,
+                                       [f'{output_filepath}/{STATE_FILE}'])
+    nodes['abt_segmentation'] = _node(build_features.create_database_ABT, (input_filepath, output_filepath, fmt),
+                                      [processed(name) for name in build_features.ABT_INPUTS]
+                                      + [processed(table) for table in WINDOW_EVENTS],
+                                      [processed('abt_segmentation'), f'{output_filepath}/{STORE_DIR}/{CURRENT}'])
+    nodes['model'] = _node(train_model_node, (input_filepath, output_filepath, fmt),
+                           [processed('abt_segmentation')],
+                           [train_model.MODEL_PATH, f'{compiled_forest.forest_path()}/meta.json'])
+    return nodes
+
+
+def code_files(func):
+    """ Source files of the `src` modules `func` is built from, following the
+        names each module imports.
+    """
+    files = {}
+    stack = [inspect.getmodule(func)]
+    while stack:
+        module = stack.pop()
+        if module is None or module.__name__ in files or not module.__name__.startswith('src'):
+            continue
+        files[module.__name__] = module.__file__
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+            if isinstance(name, str) and name.startswith('src'):
+                stack.append(inspect.getmodule(value))
+    return sorted(files.values())
+
+
+def file_digest(path, memo):
+    """ sha256 of a file, reusing the memoized digest while its size and
+        modification time are unchanged.
+    """
+    stat = os.stat(path)
+    signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+    if memo.get(path, {}).get('signature') != signature:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        memo[path] = {'signature': signature, 'sha256': digest.hexdigest()}
+    return memo[path]['sha256']
+
+
+def node_key(node, memo):
+    """ Content address of a node run: its code, its arguments and the
+        content of its inputs.
+    """
+    content = {'code': {path: file_digest(path, memo) for path in code_files(node['func'])},
+               'args': repr(node['args']),
+               'inputs': {path: file_digest(path, memo) for path in node['inputs']}}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def outputs_digest(node, memo):
+    if not all(os.path.exists(path) for path in node['outputs']):
+        return None
+    return {path: file_digest(path, memo) for path in node['outputs']}
+
+
+def load_cache(output_filepath):
+    path = f'{output_filepath}/{CACHE_FILE}'
+    if not os.path.exists(path):
+        return {'nodes': {}, 'files': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(output_filepath, cache):
+    path = f'{output_filepath}/{CACHE_FILE}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def run_pipeline(nodes, output_filepath, workers=None, force=False):
+    """ Runs the nodes in dependency order on a process pool. A node is
+        skipped when its key and its outputs match the previous run.
+    """
+    cache = load_cache(output_filepath)
+    memo = cache['files']
+    producers = {path: name for name, node in nodes.items() for path in node['outputs']}
+    depends = {name: {producers[path] for path in node['inputs'] if path in producers}
+               for name, node in nodes.items()}
+
+    done, running = set(), {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(done) < len(nodes):
+            ready = [name for name in nodes if name not in done and name not in running.values()
+                     and depends[name] <= done]
+            for name in ready:
+                node = nodes[name]
+                missing = [path for path in node['inputs'] if not os.path.exists(path)]
+                if missing:
+                    raise FileNotFoundError(f'{name}: missing inputs {missing}')
+                key = node_key(node, memo)
+                previous = cache['nodes'].get(name, {})
+                if not force and previous.get('key') == key and previous.get('outputs') == outputs_digest(node, memo):
+                    logger.info(f'{name}: up to date')
+                    done.add(name)
+                    continue
+                logger.info(f'{name}: running')
+                future = pool.submit(node['func'], *node['args'])
+                future.started = time.perf_counter()
+                running[future] = name
+                cache['nodes'][name] = {'key': key}
+            if not running:
+                if not ready:
+                    raise RuntimeError(f'dependency cycle between {sorted(set(nodes) - done)}')
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                cache['nodes'][name]['outputs'] = outputs_digest(nodes[name], memo)
+                save_cache(output_filepath, cache)
+                done.add(name)
+                logger.info(f'{name}: done in {time.perf_counter() - future.started:.2f}s')
+    save_cache(output_filepath, cache)
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Worker processes, defaults to the number of CPUs.')
+@click.option('--force', is_flag=True, help='Run every node, ignoring the cache.')
+@click.option('--until', type=click.Choice(['data', 'features', 'model']), default='model',
+              help='Last stage to build.')
+def main(input_filepath, output_filepath, storage_format, workers, force, until):
+    """ Builds the processed datasets, the ABT and the model, skipping the
+        outputs whose inputs and code did not change since the last run.
+    """
+    os.makedirs(output_filepath, exist_ok=True)
+    nodes = build_graph(input_filepath, output_filepath, storage_format)
+    if until != 'model':
+        nodes.pop('model')
+    if until == 'data':
+        nodes.pop('abt_segmentation')
+    run_pipeline(nodes, output_filepath, workers, force)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
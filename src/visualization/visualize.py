@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import os
+from pathlib import Path
+
+from dotenv import find_dotenv, load_dotenv
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from src.data.catalog import load
+from src.data.storage import FORMATS, dataset_exists
+from src.features.build_features import REGIONS, UNKNOWN_REGION
+from src.instrumentation import instrumented
+
+REPORT_DIR = f'{Path(__file__).resolve().parents[2]}/reports/segments'
+BINS = 20
+# ABT features profiled by their distribution in each segment
+HISTOGRAM_FEATURES = ['registered_time', 'usage_weekly_count', 'usage_weekly_mean', 'session_count', 'session_rate',
+                      'fileview_count', 'fileview_rate', 'question_count', 'question_rate', 'payment_total',
+                      'cancelation_count', 'subject_count']
+REGION_NAMES = list(REGIONS) + [UNKNOWN_REGION]
+DEVICES = ['mobile_only', 'desktop_only', 'both', 'none']
+PAYMENTS = ['paying', 'monthly', 'yearly', 'cancelled']
+QUANTILES = {'p50': 0.5, 'p90': 0.9}
+
+logger = logging.getLogger(__name__)
+
+
+def segment_frame(output_filepath, fmt='csv'):
+    """ The profiled ABT columns of every scored student with its cluster. """
+    if not dataset_exists(output_filepath, 'predictions', fmt):
+        raise click.ClickException(f'no predictions in {output_filepath}, run `make predict` first')
+    columns = ['Id', 'region', 'mobile', 'desktop', 'payment_monthly', 'payment_yearly'] + HISTOGRAM_FEATURES
+    abt = load(output_filepath, 'abt_segmentation', columns=columns, fmt=fmt)
+    labels = load(output_filepath, 'predictions', columns=['StudentId', 'cluster'], fmt=fmt)
+    return abt.merge(labels, left_on='Id', right_on='StudentId', how='inner')
+
+
+def indicators(df):
+    """ 0/1 columns whose mean over a segment is its region, device and
+        payment mix.
+    """
+    region = pd.Categorical(df.region, categories=REGION_NAMES).codes
+    mobile, desktop = df.mobile.values == 1, df.desktop.values == 1
+    columns = {f'region_{name}': region == i for i, name in enumerate(REGION_NAMES)}
+    columns.update({'mobile_only': mobile & ~desktop, 'desktop_only': desktop & ~mobile, 'both': mobile & desktop,
+                    'none': ~mobile & ~desktop,
+                    'paying': df.payment_total.values > 0, 'monthly': df.payment_monthly.values > 0,
+                    'yearly': df.payment_yearly.values > 0, 'cancelled': df.cancelation_count.values > 0})
+    return pd.DataFrame({name: values.astype(np.int8) for name, values in columns.items()}, index=df.index)
+
+
+def segment_stats(df):
+    """ Size, feature moments and mix shares of every cluster, from one
+        grouped aggregation.
+    """
+    frame = pd.concat([df[['cluster'] + HISTOGRAM_FEATURES], indicators(df)], axis=1)
+    aggregations = {'students': ('cluster', 'size'), 'payments': ('payment_total', 'sum')}
+    for feature in HISTOGRAM_FEATURES:
+        for func in ['mean', 'std', 'min', 'max']:
+            aggregations[f'{feature}_{func}'] = (feature, func)
+    for column in frame.columns[len(HISTOGRAM_FEATURES) + 1:]:
+        aggregations[column] = (column, 'mean')
+    stats = frame.groupby('cluster', sort=True).agg(**aggregations)
+    stats['share'] = stats.students / stats.students.sum()
+    stats['payments_per_payer'] = stats.payments / (stats.paying * stats.students).replace(0, np.nan)
+    return stats
+
+
+def bin_edges(low, high, bins=BINS):
+    """ Edges of `bins` bins between `low` and `high`, even on a log1p
+        scale above `low` as the counts and rates are heavy tailed.
+    """
+    return low + np.expm1(np.linspace(0, np.log1p(high - low), bins + 1))
+
+
+def histograms(df, stats, bins=BINS):
+    """ Students per (cluster, feature, bin), the bins shared by every
+        cluster. Each feature is binned once and counted with one bincount
+        over the (cluster, bin) pairs.
+    """
+    clusters = stats.index.values
+    codes = np.searchsorted(clusters, df.cluster.values)
+    rows = []
+    for feature in HISTOGRAM_FEATURES:
+        low, high = stats[f'{feature}_min'].min(), stats[f'{feature}_max'].max()
+        edges = bin_edges(low, high, bins)
+        binned = np.clip(np.searchsorted(edges, df[feature].values, side='right') - 1, 0, bins - 1)
+        counts = np.bincount(codes * bins + binned, minlength=len(clusters) * bins).reshape(len(clusters), bins)
+        rows.append(pd.DataFrame({'cluster': np.repeat(clusters, bins), 'feature': feature,
+                                  'bin': np.tile(np.arange(bins), len(clusters)),
+                                  'left': np.tile(edges[:-1], len(clusters)),
+                                  'right': np.tile(edges[1:], len(clusters)), 'students': counts.ravel()}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def histogram_quantile(histogram, q):
+    """ Quantile `q` of one binned distribution, interpolated in its bin. """
+    cumulative = histogram.students.cumsum().values
+    target = q * cumulative[-1]
+    i = min(np.searchsorted(cumulative, target), len(cumulative) - 1)
+    before = cumulative[i - 1] if i else 0
+    inside = histogram.students.values[i]
+    fraction = (target - before) / inside if inside else 0
+    return histogram.left.values[i] + fraction * (histogram.right.values[i] - histogram.left.values[i])
+
+
+def profile_table(stats, hist):
+    """ One row per cluster: size, payment behaviour, the mean and binned
+        median and p90 of every feature and the region and device mix.
+    """
+    quantiles = {(cluster, f'{feature}_{name}'): histogram_quantile(group, q)
+                 for (cluster, feature), group in hist.groupby(['cluster', 'feature'], sort=False)
+                 for name, q in QUANTILES.items()}
+    profile = stats[['students', 'share', 'payments_per_payer'] + PAYMENTS + DEVICES
+                    + [f'region_{name}' for name in REGION_NAMES]].copy()
+    for feature in HISTOGRAM_FEATURES:
+        profile[f'{feature}_mean'] = stats[f'{feature}_mean']
+        for name in QUANTILES:
+            profile[f'{feature}_{name}'] = [quantiles[(cluster, f'{feature}_{name}')] for cluster in stats.index]
+    return profile
+
+
+def plot_report(profile, hist, path):
+    """ Share of each cluster per bin of every feature, and the mix bars. """
+    n_plots = len(HISTOGRAM_FEATURES) + 3
+    n_columns = 4
+    fig, axes = plt.subplots((n_plots + n_columns - 1) // n_columns, n_columns, figsize=(4 * n_columns, 14))
+    axes = axes.ravel()
+    for ax, feature in zip(axes, HISTOGRAM_FEATURES):
+        for cluster, group in hist.loc[hist.feature == feature].groupby('cluster'):
+            share = group.students.values / max(group.students.sum(), 1)
+            edges = np.append(group.left.values, group.right.values[-1])
+            ax.stairs(share, edges, label=f'cluster {cluster}')
+        # the scale the bins are even on
+        low = edges[0]
+        ax.set_xscale('function', functions=(lambda x, low=low: np.log1p(np.maximum(x - low, 0)),
+                                             lambda y, low=low: low + np.expm1(y)))
+        ax.set_xlim(edges[0], edges[-1])
+        ax.set_title(feature, fontsize=10)
+    mixes = {'region': [f'region_{name}' for name in REGION_NAMES], 'device': DEVICES, 'payment': PAYMENTS}
+    for ax, (title, columns) in zip(axes[len(HISTOGRAM_FEATURES):], mixes.items()):
+        profile[columns].T.rename(index=lambda name: name.replace('region_', '')).plot.bar(ax=ax, legend=False)
+        ax.set_title(f'{title} mix', fontsize=10)
+        ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+    for ax in axes[n_plots:]:
+        ax.axis('off')
+    axes[0].legend(fontsize=8)
+    fig.tight_layout()
+    fig.savefig(path, dpi=80)
+    plt.close(fig)
+
+
+@instrumented
+def segment_report(output_filepath, fmt='csv', report_dir=REPORT_DIR, bins=BINS):
+    """ Writes the profile of every segment (profile.csv), the binned
+        feature distributions (histograms.csv) and their plot
+        (segments.png) to `report_dir`; their size depends on the number of
+        clusters and bins, not of students. Returns the profile.
+    """
+    df = segment_frame(output_filepath, fmt)
+    stats = segment_stats(df)
+    hist = histograms(df, stats, bins)
+    profile = profile_table(stats, hist)
+
+    os.makedirs(report_dir, exist_ok=True)
+    profile.to_csv(f'{report_dir}/profile.csv', float_format='%.6g')
+    hist.to_csv(f'{report_dir}/histograms.csv', index=False, float_format='%.6g')
+    plot_report(profile, hist, f'{report_dir}/segments.png')
+    return profile
+
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--storage-format', type=click.Choice(FORMATS), default='csv',
+              help='Format of the processed datasets.')
+@click.option('--report-dir', type=click.Path(), default=REPORT_DIR)
+@click.option('--bins', type=click.IntRange(min=2), default=BINS, help='Bins of every feature histogram.')
+def main(input_filepath, output_filepath, storage_format, report_dir, bins):
+    """ Profiles the segments of the scored students: feature distributions,
+        region and device mix and payment behaviour of every cluster.
+    """
+    profile = segment_report(output_filepath, storage_format, report_dir, bins)
+    columns = ['students', 'share', 'paying', 'payments_per_payer', 'mobile_only', 'desktop_only']
+    print(profile[columns + [f'{feature}_p50' for feature in HISTOGRAM_FEATURES[:6]]].T.to_string(
+        float_format=lambda x: f'{x:.3f}'))
+    print(f'report written to {report_dir}')
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()